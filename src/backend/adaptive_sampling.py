@@ -0,0 +1,219 @@
+import math
+
+import numpy as np
+
+from .scenarios import Scenario
+from .surrogate import evaluate_scenario, get_output_columns
+
+
+class AdaptiveSampler:
+    """
+    An adaptive design of experiments over a box of scenario parameters.
+
+    Sampling starts from a coarse grid and adds points in batches where they
+    resolve the outputs best. The outputs are the final values of the fields
+    and, when times are set, their values at those times (as returned by
+    evaluate_scenario), each scaled by its range over the samples. At every
+    sample a local gradient of the outputs is fitted by least squares to its
+    nearest neighbours. A candidate point is scored by the output change
+    expected between it and its nearest sample: the gradient norm of that
+    sample times their distance in the unit cube. The best candidates form
+    the next batch; a chosen point counts as a sample for the rest of the
+    batch, so the batch spreads over the regions that need it.
+
+    Points therefore accumulate around sharp transitions, e.g. where the
+    vesicle pH crosses a gating threshold, and stay sparse where the outputs
+    are flat. Sampling stops when no candidate's expected change exceeds the
+    tolerance, i.e. the map is resolved to the tolerance everywhere except
+    in gaps narrower than min_distance, or after max_samples runs.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The base scenario; the parameters are applied to it as overrides.
+    parameters : dict
+        Maps Scenario override paths, e.g. 'channels.asor.conductance', to (low, high)
+        or (low, high, 'log') for parameters sampled on a log scale.
+    fields : sequence of str, optional
+        Tracked fields of the outputs. Default is the vesicle pH.
+    times : sequence of float, optional
+        Times at which the fields are also output. Default is None, final values only.
+    initial_points : int, optional
+        Points per dimension of the initial grid, reduced so that the grid takes at most half
+        of max_samples. Default is 5.
+    batch_size : int, optional
+        Points run per batch, e.g. the number of workers. Default is 8.
+    tolerance : float, optional
+        Largest expected output change, as a fraction of the output range, between a point
+        of the box and its nearest sample. Default is 0.02.
+    min_distance : float, optional
+        Smallest distance in the unit cube between two samples. Default is 0.005.
+    max_samples : int, optional
+        Maximum number of runs. Default is 200.
+    candidates : int, optional
+        Random candidate points scored per batch. Default is 2000.
+    seed : int, optional
+        Seed of the candidate points.
+    """
+
+    DEFAULT_FIELDS = ('Vesicle_pH',)
+    DEFAULT_INITIAL_POINTS = 5
+    DEFAULT_BATCH_SIZE = 8
+    DEFAULT_TOLERANCE = 0.02
+    DEFAULT_MIN_DISTANCE = 0.005
+    DEFAULT_MAX_SAMPLES = 200
+    DEFAULT_CANDIDATES = 2000
+
+    def __init__(self,
+                 *,
+                 scenario: Scenario,
+                 parameters: dict,
+                 fields=None,
+                 times=None,
+                 initial_points: int = None,
+                 batch_size: int = None,
+                 tolerance: float = None,
+                 min_distance: float = None,
+                 max_samples: int = None,
+                 candidates: int = None,
+                 seed: int = None):
+        if not parameters:
+            raise ValueError("An adaptive design needs at least one parameter.")
+        self.scenario = scenario
+        self.parameters = {}
+        for path, bounds in parameters.items():
+            low, high, scale = (*bounds, 'linear') if len(bounds) == 2 else bounds
+            if scale not in ('linear', 'log'):
+                raise ValueError(f"Unknown scale '{scale}' for parameter '{path}'. Expected 'linear' or 'log'.")
+            if not low < high or (scale == 'log' and low <= 0):
+                raise ValueError(f"Invalid bounds ({low}, {high}) for parameter '{path}'.")
+            self.parameters[path] = (float(low), float(high), scale)
+        self.fields = list(fields) if fields is not None else list(self.DEFAULT_FIELDS)
+        self.times = [float(t) for t in times] if times is not None else []
+        self.initial_points = initial_points if initial_points is not None else self.DEFAULT_INITIAL_POINTS
+        self.batch_size = batch_size if batch_size is not None else self.DEFAULT_BATCH_SIZE
+        self.tolerance = tolerance if tolerance is not None else self.DEFAULT_TOLERANCE
+        self.min_distance = min_distance if min_distance is not None else self.DEFAULT_MIN_DISTANCE
+        self.max_samples = max_samples if max_samples is not None else self.DEFAULT_MAX_SAMPLES
+        self.candidates = candidates if candidates is not None else self.DEFAULT_CANDIDATES
+        if self.initial_points < 2:
+            raise ValueError(f"initial_points must be at least 2, got {self.initial_points}.")
+        if 2 ** len(self.parameters) > self.max_samples // 2:
+            raise ValueError(f"An initial grid over {len(self.parameters)} parameters needs at least "
+                             f"{2 ** len(self.parameters)} runs, more than half of max_samples={self.max_samples}.")
+        self._rng = np.random.default_rng(seed)
+
+        dimensions = len(self.parameters)
+        self.design = np.zeros((0, dimensions))
+        self.outputs = np.zeros((0, len(self.get_columns())))
+        self.batches = np.zeros(0, dtype=np.int64)
+        self.scores = []
+        self.converged = False
+
+    # Parameter space
+
+    def from_unit(self, unit: np.ndarray) -> dict:
+        point = {}
+        for coordinate, (path, (low, high, scale)) in zip(unit, self.parameters.items()):
+            if scale == 'log':
+                point[path] = float(math.exp(math.log(low) + coordinate * (math.log(high) - math.log(low))))
+            else:
+                point[path] = float(low + coordinate * (high - low))
+        return point
+
+    def get_points(self) -> list:
+        """Return the sampled parameter values, one dict per run."""
+        return [self.from_unit(unit) for unit in self.design]
+
+    def get_columns(self) -> list:
+        """Return the names of the output columns, in the order of evaluate_scenario."""
+        return get_output_columns(self.fields, self.times)
+
+    def get_grid_points(self) -> int:
+        """Return the points per dimension of the initial grid, leaving half of max_samples for refinement."""
+        points = self.initial_points
+        while points > 2 and points ** len(self.parameters) > self.max_samples // 2:
+            points -= 1
+        return points
+
+    def initial_design(self) -> np.ndarray:
+        axes = [np.linspace(0.0, 1.0, self.get_grid_points())] * len(self.parameters)
+        return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(self.parameters))
+
+    # Sampling
+
+    def run(self, *, map_function=map, progress_callback=None):
+        """
+        Run the initial grid and then batches of proposed points until the map is resolved.
+
+        map_function is used to run each batch, e.g. ProcessPoolExecutor().map to run it in
+        parallel. progress_callback, if given, is called after every batch with the number of
+        samples and the largest expected output change left.
+        """
+        if not len(self.design):
+            self._evaluate(self.initial_design(), map_function)
+        while len(self.design) < self.max_samples:
+            batch, score = self.propose()
+            self.scores.append(score)
+            if not len(batch):
+                self.converged = True
+                break
+            self._evaluate(batch, map_function)
+            if progress_callback is not None:
+                progress_callback(len(self.design), score)
+        return self
+
+    def _evaluate(self, units: np.ndarray, map_function):
+        scenarios = [self.scenario.with_overrides(self.from_unit(unit)).to_dict() for unit in units]
+        outputs = list(map_function(evaluate_scenario, scenarios,
+                                    [self.fields] * len(units), [self.times] * len(units)))
+        self.design = np.vstack([self.design, units])
+        self.outputs = np.vstack([self.outputs, np.array(outputs, dtype=np.float64).reshape(len(units), -1)])
+        batch = self.batches[-1] + 1 if len(self.batches) else 0
+        self.batches = np.concatenate([self.batches, np.full(len(units), batch)])
+
+    def get_slopes(self) -> np.ndarray:
+        """Return the largest local gradient norm of the scaled outputs at every sample."""
+        design, outputs = self.design, self.outputs
+        spread = outputs.max(axis=0) - outputs.min(axis=0)
+        scaled = outputs / np.where(spread > 0, spread, 1.0)
+        neighbours = min(len(design) - 1, 2 * design.shape[1] + 2)
+        distances = np.linalg.norm(design[:, None, :] - design[None, :, :], axis=-1)
+        slopes = np.zeros(len(design))
+        for index in range(len(design)):
+            nearest = np.argsort(distances[index])[1:neighbours + 1]
+            gradient = np.linalg.lstsq(design[nearest] - design[index], scaled[nearest] - scaled[index], rcond=None)[0]
+            slopes[index] = np.max(np.linalg.norm(gradient, axis=0))
+        return slopes
+
+    def propose(self):
+        """Return the next batch of points in the unit cube and the largest expected output change left."""
+        slopes = self.get_slopes()
+        candidates = self._rng.random((self.candidates, self.design.shape[1]))
+        distances = np.linalg.norm(candidates[:, None, :] - self.design[None, :, :], axis=-1)
+        nearest = np.argmin(distances, axis=1)
+        gaps = distances[np.arange(len(candidates)), nearest]
+        slope = slopes[nearest]
+
+        batch = []
+        size = min(self.batch_size, self.max_samples - len(self.design))
+        largest = None
+        while len(batch) < size:
+            scores = np.where(gaps >= self.min_distance, slope * gaps, 0.0)
+            best = int(np.argmax(scores))
+            largest = float(scores[best]) if largest is None else largest
+            if scores[best] <= self.tolerance:
+                break
+            batch.append(candidates[best])
+            gaps = np.minimum(gaps, np.linalg.norm(candidates - candidates[best], axis=1))
+        return np.array(batch).reshape(-1, self.design.shape[1]), largest
+
+    def to_dataset(self) -> dict:
+        """Return the samples as columns: 'batch', one column per parameter, then the output columns."""
+        points = self.get_points()
+        dataset = {'batch': self.batches.copy()}
+        for path in self.parameters:
+            dataset[path] = np.array([point[path] for point in points])
+        for position, column in enumerate(self.get_columns()):
+            dataset[column] = self.outputs[:, position]
+        return dataset
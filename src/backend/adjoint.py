@@ -0,0 +1,476 @@
+import math
+
+import numpy as np
+
+from .constants import FARADAY_CONSTANT, VOLUME_TO_AREA_CONSTANT
+from .model_spec import ModelSpec
+from .scenarios import Scenario
+from .simulation import SimulationConfig
+from .vesicle import VesicleConfig
+
+
+class Objective:
+    """
+    A scalar objective of simulated trajectories, e.g. a sum of squared residuals against data.
+
+    evaluate() receives the step times and the trajectories of the fields
+    listed in fields, one value per step as recorded by Simulation, and returns
+    the value of the objective with its derivative with respect to every
+    trajectory value.
+    """
+
+    fields = ()
+
+    def evaluate(self, times: np.ndarray, trajectories: dict):
+        """Return (value, {field: derivative array shaped like the trajectory})."""
+        raise NotImplementedError
+
+
+class SquaredResiduals(Objective):
+    """
+    The weighted sum of squared differences between a field, interpolated linearly between
+    steps, and measured values, e.g. SquaredResiduals('Vesicle_pH', data_times, data_pH).
+    """
+
+    def __init__(self, field: str, times, values, *, weights=None):
+        self.fields = (field,)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64) if weights is not None else np.ones_like(self.values)
+        if not self.times.shape == self.values.shape == self.weights.shape:
+            raise ValueError("times, values and weights must have the same length.")
+
+    def evaluate(self, times: np.ndarray, trajectories: dict):
+        trajectory = trajectories[self.fields[0]]
+        left = np.clip(np.searchsorted(times, self.times, side='right') - 1, 0, len(times) - 2)
+        fraction = np.clip((self.times - times[left]) / (times[left + 1] - times[left]), 0.0, 1.0)
+        residuals = (1 - fraction) * trajectory[left] + fraction * trajectory[left + 1] - self.values
+
+        derivative = np.zeros_like(trajectory)
+        np.add.at(derivative, left, 2 * self.weights * residuals * (1 - fraction))
+        np.add.at(derivative, left + 1, 2 * self.weights * residuals * fraction)
+        return float(np.sum(self.weights * residuals ** 2)), {self.fields[0]: derivative}
+
+
+class TerminalCost(Objective):
+    """The final value of a field, or with a target, weight * (final value - target) ** 2."""
+
+    def __init__(self, field: str, *, target: float = None, weight: float = 1.0):
+        self.fields = (field,)
+        self.target = target
+        self.weight = weight
+
+    def evaluate(self, times: np.ndarray, trajectories: dict):
+        trajectory = trajectories[self.fields[0]]
+        derivative = np.zeros_like(trajectory)
+        if self.target is None:
+            derivative[-1] = self.weight
+            return self.weight * float(trajectory[-1]), {self.fields[0]: derivative}
+        residual = float(trajectory[-1]) - self.target
+        derivative[-1] = 2 * self.weight * residual
+        return self.weight * residual ** 2, {self.fields[0]: derivative}
+
+
+class AdjointSimulation:
+    """
+    Gradients of trajectory objectives with respect to every numeric parameter of a scenario.
+
+    The gradient is computed by the discrete adjoint method: the exact derivative
+    of the objective of the stepped model, not of the underlying ODE. A forward
+    run keeps the state every checkpoint_interval steps and the trajectories the
+    objective needs. The steps are then revisited from the last segment to the
+    first: each segment is recomputed from its checkpoint, keeping the
+    intermediate values of its steps, and the adjoint state is propagated back
+    through them. This costs about four forward runs and needs memory for
+    about 2 * sqrt(steps) steps, whatever the number of parameters.
+
+    The steps are the same as Simulation's single-rate steps, with the exact
+    gating curves; clamped ion amounts have zero derivative. Parameters are
+    named by Scenario override paths, e.g. 'channels.asor.conductance',
+    'species.h.init_vesicle_conc', 'vesicle.init_radius' or
+    'config.init_buffer_capacity', so that fitted values can be applied with
+    Scenario.with_overrides.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The scenario to differentiate.
+    checkpoint_interval : int, optional
+        Steps between two checkpoints. Default is the square root of the number of steps.
+    """
+
+    OBSERVED_VESICLE_FIELDS = ('pH', 'voltage', 'volume')
+
+    def __init__(self, scenario: Scenario, *, checkpoint_interval: int = None):
+        template = scenario.build_simulation()
+        if template.config.slow_update_ratio is not None:
+            raise ValueError("Multi-rate integration is not supported by the adjoint.")
+        self.scenario = scenario
+        self.iter_num = template.iter_num
+        self.time_step = template.config.time_step
+        self.checkpoint_interval = (checkpoint_interval if checkpoint_interval is not None
+                                    else max(1, math.isqrt(self.iter_num)))
+        if self.checkpoint_interval < 1:
+            raise ValueError(f"checkpoint_interval must be a positive integer, got {self.checkpoint_interval}.")
+
+        species = template.all_species
+        self.species_names = [ion.display_name for ion in species]
+        if 'h' not in self.species_names:
+            raise ValueError("Hydrogen species not found in the simulation.")
+        n_species = len(species)
+        self.hydrogen_index = self.species_names.index('h')
+        self.charges = np.array([ion.elementary_charge for ion in species], dtype=np.float64)
+        self.non_hydrogen = np.array([name != 'h' for name in self.species_names], dtype=np.float64)
+
+        # Channels in the order in which Simulation sums them. Concentrations are looked up in
+        # [vesicle concentrations..., free hydrogen, 1.0]; channels without a secondary ion use
+        # the constant 1.0 with a zero exponent
+        free_hydrogen_index, unit_index = n_species, n_species + 1
+        channels = [(owner, channel) for owner, ion in enumerate(species) for channel in ion.channels]
+        self.channel_names = [channel.display_name for _, channel in channels]
+        self.owners = np.array([owner for owner, _ in channels], dtype=np.int64)
+
+        def source(channel, ion):
+            if ion is None:
+                return unit_index
+            if channel.config.use_free_hydrogen and ion.display_name == 'h':
+                return free_hydrogen_index
+            return self.species_names.index(ion.display_name)
+
+        self.primary = np.array([source(c, c.primary_ion_species) for _, c in channels], dtype=np.int64)
+        self.secondary = np.array([source(c, c.secondary_ion_species) for _, c in channels], dtype=np.int64)
+        self.has_secondary = self.secondary != unit_index
+        self.nernst_constants = np.array([c.config.custom_nernst_constant if c.config.custom_nernst_constant is not None
+                                          else template.nernst_constant for _, c in channels])
+        self.gating = {}
+        for kind, dependence_types in (('voltage', ('voltage', 'voltage_and_pH')), ('pH', ('pH', 'voltage_and_pH')),
+                                       ('time', ('time',))):
+            mask = np.array([c.config.dependence_type in dependence_types for _, c in channels])
+            exponents = np.array([getattr(c, f'{kind}_exponent') if gated else 0.0 for (_, c), gated in zip(channels, mask)])
+            half_activations = np.array([getattr(c, f'half_act_{kind}') if gated else 0.0
+                                         for (_, c), gated in zip(channels, mask)])
+            # Time gating is 1 / (1 + exp(exponent * (half_act_time - time))): the same curve with the opposite exponent
+            self.gating[kind] = (mask, -exponents if kind == 'time' else exponents, half_activations)
+
+        self.parameters = self._gather_parameters(scenario)
+
+    def _gather_parameters(self, scenario: Scenario) -> dict:
+        spec, vesicle = scenario.spec, VesicleConfig(**scenario.vesicle)
+        parameters = {}
+        for name in self.species_names:
+            for parameter in ModelSpec.NUMERIC_SPECIES_PARAMETERS:
+                parameters[f'species.{name}.{parameter}'] = float(spec.species[name][parameter])
+        for name, has_secondary in zip(self.channel_names, self.has_secondary):
+            for parameter in (*ModelSpec.NUMERIC_CHANNEL_PARAMETERS, 'primary_exponent', 'secondary_exponent'):
+                if parameter != 'secondary_exponent' or has_secondary:
+                    parameters[f'channels.{name}.{parameter}'] = float(spec.channels[name][parameter])
+        for parameter in ('init_radius', 'specific_capacitance', 'init_voltage'):
+            parameters[f'vesicle.{parameter}'] = float(getattr(vesicle, parameter))
+        parameters['config.init_buffer_capacity'] = float(SimulationConfig(**scenario.config).init_buffer_capacity)
+        return parameters
+
+    def get_parameters(self) -> dict:
+        """Return the differentiable parameters by override path, with their values."""
+        return dict(self.parameters)
+
+    def _channel_parameter(self, parameter: str) -> np.ndarray:
+        return np.array([self.parameters.get(f'channels.{name}.{parameter}', 0.0) for name in self.channel_names])
+
+    def _prepare(self) -> dict:
+        """Compute the constants of a run from the parameters, as Vesicle and Simulation do."""
+        p = self.parameters
+        radius = p['vesicle.init_radius']
+        specific_capacitance = p['vesicle.specific_capacitance']
+        buffer_capacity = p['config.init_buffer_capacity']
+        init_concs = np.array([p[f'species.{name}.init_vesicle_conc'] for name in self.species_names])
+        exterior_concs = np.array([p[f'species.{name}.exterior_conc'] for name in self.species_names])
+
+        init_volume = (4 / 3) * math.pi * radius ** 3
+        init_charge = p['vesicle.init_voltage'] * 4.0 * math.pi * radius ** 2 * specific_capacitance
+        unaccounted = init_charge / FARADAY_CONSTANT - float(self.charges @ init_concs) * 1000 * init_volume
+        exterior = np.concatenate([exterior_concs, [exterior_concs[self.hydrogen_index] * buffer_capacity, 1.0]])
+        constants = {
+            'init_concs': init_concs,
+            'exterior': exterior,
+            'init_volume': init_volume,
+            'specific_capacitance': specific_capacitance,
+            'buffer_capacity': buffer_capacity,
+            'unaccounted': unaccounted,
+            'abs_unaccounted': abs(unaccounted),
+            'init_conc_total': float(self.non_hydrogen @ init_concs) + abs(unaccounted),
+            'log_exterior_primary': np.log(exterior[self.primary]),
+            'log_exterior_secondary': np.log(exterior[self.secondary]),
+        }
+        for parameter in (*ModelSpec.NUMERIC_CHANNEL_PARAMETERS, 'primary_exponent', 'secondary_exponent'):
+            constants[parameter] = self._channel_parameter(parameter)
+        constants['nernst_factor'] = constants['nernst_multiplier'] * self.nernst_constants
+        return constants
+
+    # Forward steps
+
+    def _step(self, k: dict, amounts: np.ndarray, previous_concs: np.ndarray, time: float, tape: list = None):
+        """
+        Advance one step as Simulation.run_one_iteration; returns the next amounts, the
+        concentrations and the observed (pH, voltage, volume) of the step.
+        """
+        total = float(self.non_hydrogen @ previous_concs) + k['abs_unaccounted']
+        volume = k['init_volume'] * total / k['init_conc_total']
+        concs = amounts / (1000 * volume)
+        buffer_capacity = k['buffer_capacity'] * volume / k['init_volume']
+        area = VOLUME_TO_AREA_CONSTANT * volume ** (2 / 3)
+        capacitance = area * k['specific_capacitance']
+        charge = FARADAY_CONSTANT * (float(self.charges @ amounts) + k['unaccounted'])
+        voltage = charge / capacitance
+        free_hydrogen = concs[self.hydrogen_index] * buffer_capacity
+        pH = -math.log10(free_hydrogen)
+
+        # Nernst potentials and driving forces of every channel
+        sources = np.concatenate([concs, [free_hydrogen, 1.0]])
+        log_sources = np.log(sources)
+        log_ratio = (k['primary_exponent'] * (k['log_exterior_primary'] - log_sources[self.primary]) +
+                     k['secondary_exponent'] * (log_sources[self.secondary] - k['log_exterior_secondary']))
+        drive = k['voltage_multiplier'] * voltage + k['nernst_factor'] * log_ratio - k['voltage_shift']
+
+        gates = {}
+        for kind, value in (('voltage', voltage), ('pH', pH), ('time', time)):
+            mask, exponents, half_activations = self.gating[kind]
+            gates[kind] = np.where(mask, 1.0 / (1.0 + np.exp(exponents * (value - half_activations))), 1.0)
+        gate = gates['voltage'] * gates['pH'] * gates['time']
+        scale = k['flux_multiplier'] * k['conductance'] * area * gate
+        fluxes = scale * drive
+        species_fluxes = np.bincount(self.owners, weights=fluxes, minlength=len(amounts))
+
+        unclamped = amounts + self.time_step * species_fluxes
+        next_amounts = np.maximum(unclamped, 0.0)
+        if tape is not None:
+            tape.append((amounts, concs, total, volume, buffer_capacity, area, capacitance, charge, voltage,
+                         free_hydrogen, sources, log_sources, log_ratio, drive, gates, gate, scale, unclamped))
+        return next_amounts, concs, (pH, voltage, volume)
+
+    def _observe(self, field: str):
+        """Return a function extracting a field from (amounts, concs, observed) of a step."""
+        object_name, _, attribute = field.partition('_')
+        if object_name == 'Vesicle' and attribute in self.OBSERVED_VESICLE_FIELDS:
+            position = self.OBSERVED_VESICLE_FIELDS.index(attribute)
+            return lambda amounts, concs, observed: observed[position]
+        if object_name in self.species_names and attribute in ('vesicle_conc', 'vesicle_amount'):
+            index = self.species_names.index(object_name)
+            if attribute == 'vesicle_conc':
+                return lambda amounts, concs, observed: concs[index]
+            return lambda amounts, concs, observed: amounts[index]
+        raise ValueError(f"Field '{field}' cannot be differentiated by the adjoint.")
+
+    def simulate(self, fields, checkpoints: list = None):
+        """Run forward and return the step times and the trajectories of the fields."""
+        k = self._prepare()
+        observers = {field: self._observe(field) for field in fields}
+        trajectories = {field: np.empty(self.iter_num) for field in fields}
+        times = np.empty(self.iter_num)
+        amounts, concs, time = k['init_concs'] * 1000 * k['init_volume'], k['init_concs'], 0.0
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for step in range(self.iter_num):
+                if checkpoints is not None and step % self.checkpoint_interval == 0:
+                    checkpoints.append((amounts, concs, time))
+                next_amounts, concs, observed = self._step(k, amounts, concs, time)
+                times[step] = time
+                for field, observe in observers.items():
+                    trajectories[field][step] = observe(amounts, concs, observed)
+                amounts = next_amounts
+                time += self.time_step
+        return times, trajectories
+
+    # Gradient
+
+    def value_and_gradient(self, objective):
+        """
+        Return the value of an objective, or of the sum of a list of objectives, and its
+        gradient as {override path: derivative}.
+        """
+        objectives = list(objective) if isinstance(objective, (list, tuple)) else [objective]
+        fields = list(dict.fromkeys(field for item in objectives for field in item.fields))
+        checkpoints = []
+        times, trajectories = self.simulate(fields, checkpoints)
+
+        value = 0.0
+        adjoint_trajectories = {field: np.zeros(self.iter_num) for field in fields}
+        for item in objectives:
+            item_value, derivatives = item.evaluate(times, trajectories)
+            value += item_value
+            for field, derivative in derivatives.items():
+                adjoint_trajectories[field] += derivative
+
+        k = self._prepare()
+        n_species, n_channels = len(self.species_names), len(self.channel_names)
+        # Adjoints of the constants, accumulated over the steps
+        g = {name: 0.0 for name in ('init_volume', 'init_conc_total', 'abs_unaccounted', 'unaccounted',
+                                    'specific_capacitance', 'buffer_capacity')}
+        for name in (*ModelSpec.NUMERIC_CHANNEL_PARAMETERS, 'primary_exponent', 'secondary_exponent', 'nernst_factor',
+                     'log_exterior_primary', 'log_exterior_secondary'):
+            g[name] = np.zeros(n_channels)
+        observed_adjoints = [(self.OBSERVED_VESICLE_FIELDS.index(field.partition('_')[2]), adjoint_trajectories[field])
+                             for field in fields if field.startswith('Vesicle_')]
+        species_adjoints = [(field.partition('_')[2], self.species_names.index(field.partition('_')[0]),
+                             adjoint_trajectories[field]) for field in fields if not field.startswith('Vesicle_')]
+
+        amounts_adjoint, concs_adjoint = np.zeros(n_species), np.zeros(n_species)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for segment in reversed(range(len(checkpoints))):
+                first_step = segment * self.checkpoint_interval
+                last_step = min(first_step + self.checkpoint_interval, self.iter_num)
+                amounts, concs, time = checkpoints[segment]
+                tape, step_times = [], []
+                for step in range(first_step, last_step):
+                    step_times.append(time)
+                    amounts, concs, _ = self._step(k, amounts, concs, time, tape)
+                    time += self.time_step
+                for step, record in zip(reversed(range(first_step, last_step)), reversed(tape)):
+                    observed = [0.0, 0.0, 0.0]
+                    for position, adjoint in observed_adjoints:
+                        observed[position] += adjoint[step]
+                    step_amounts_adjoint, step_concs_adjoint = np.zeros(n_species), np.zeros(n_species)
+                    for attribute, index, adjoint in species_adjoints:
+                        target = step_concs_adjoint if attribute == 'vesicle_conc' else step_amounts_adjoint
+                        target[index] += adjoint[step]
+                    amounts_adjoint, concs_adjoint = self._step_adjoint(
+                        k, g, record, amounts_adjoint, concs_adjoint + step_concs_adjoint, observed)
+                    amounts_adjoint += step_amounts_adjoint
+        return value, self._parameter_gradient(k, g, amounts_adjoint, concs_adjoint)
+
+    def gradient(self, objective) -> dict:
+        return self.value_and_gradient(objective)[1]
+
+    def _step_adjoint(self, k: dict, g: dict, record: tuple, next_amounts_adjoint: np.ndarray,
+                      concs_adjoint: np.ndarray, observed: list):
+        """
+        Propagate the adjoints of a step's outputs (next amounts, concentrations and observed
+        pH, voltage and volume) back to its inputs (amounts and previous concentrations),
+        accumulating the adjoints of the constants in g.
+        """
+        (amounts, concs, total, volume, buffer_capacity, area, capacitance, charge, voltage,
+         free_hydrogen, sources, log_sources, log_ratio, drive, gates, gate, scale, unclamped) = record
+        pH_adjoint, voltage_adjoint, volume_adjoint = observed
+
+        # next amounts = max(amounts + time_step * species fluxes, 0)
+        unclamped_adjoint = np.where(unclamped >= 0.0, next_amounts_adjoint, 0.0)
+        amounts_adjoint = unclamped_adjoint.copy()
+        fluxes_adjoint = self.time_step * unclamped_adjoint[self.owners]
+
+        # fluxes = flux_multiplier * conductance * area * gate * drive
+        drive_adjoint = fluxes_adjoint * scale
+        product_adjoint = fluxes_adjoint * drive
+        g['flux_multiplier'] += product_adjoint * k['conductance'] * area * gate
+        g['conductance'] += product_adjoint * k['flux_multiplier'] * area * gate
+        gate_adjoint = product_adjoint * k['flux_multiplier'] * k['conductance'] * area
+        area_adjoint = float(product_adjoint @ (k['flux_multiplier'] * k['conductance'] * gate))
+        for kind in ('voltage', 'pH'):
+            others = gate_adjoint * gates['time'] * gates['pH' if kind == 'voltage' else 'voltage']
+            _, exponents, _ = self.gating[kind]
+            value_adjoint = float(others @ (-exponents * gates[kind] * (1.0 - gates[kind])))
+            if kind == 'voltage':
+                voltage_adjoint += value_adjoint
+            else:
+                pH_adjoint += value_adjoint
+
+        # drive = voltage_multiplier * voltage + nernst_factor * log_ratio - voltage_shift
+        g['voltage_multiplier'] += drive_adjoint * voltage
+        voltage_adjoint += float(drive_adjoint @ k['voltage_multiplier'])
+        g['nernst_factor'] += drive_adjoint * log_ratio
+        g['voltage_shift'] -= drive_adjoint
+        log_ratio_adjoint = drive_adjoint * k['nernst_factor']
+
+        # log_ratio = primary_exponent * (log exterior primary - log primary)
+        #             + secondary_exponent * (log secondary - log exterior secondary)
+        g['primary_exponent'] += log_ratio_adjoint * (k['log_exterior_primary'] - log_sources[self.primary])
+        g['secondary_exponent'] += log_ratio_adjoint * (log_sources[self.secondary] - k['log_exterior_secondary'])
+        g['log_exterior_primary'] += log_ratio_adjoint * k['primary_exponent']
+        g['log_exterior_secondary'] -= log_ratio_adjoint * k['secondary_exponent']
+        sources_adjoint = (np.bincount(self.primary, weights=-log_ratio_adjoint * k['primary_exponent'],
+                                       minlength=len(sources)) +
+                           np.bincount(self.secondary, weights=log_ratio_adjoint * k['secondary_exponent'],
+                                       minlength=len(sources))) / sources
+        n_species = len(amounts)
+        concs_adjoint = concs_adjoint + sources_adjoint[:n_species]
+
+        # pH = -log10(free hydrogen), free hydrogen = hydrogen concentration * buffer capacity
+        free_hydrogen_adjoint = sources_adjoint[n_species] - pH_adjoint / (free_hydrogen * math.log(10))
+        concs_adjoint[self.hydrogen_index] += free_hydrogen_adjoint * buffer_capacity
+        buffer_capacity_adjoint = free_hydrogen_adjoint * concs[self.hydrogen_index]
+
+        # voltage = charge / capacitance, charge = F * (charges . amounts + unaccounted)
+        charge_adjoint = voltage_adjoint / capacitance
+        capacitance_adjoint = -voltage_adjoint * voltage / capacitance
+        amounts_adjoint += charge_adjoint * FARADAY_CONSTANT * self.charges
+        g['unaccounted'] += charge_adjoint * FARADAY_CONSTANT
+
+        # capacitance = area * specific capacitance, area = K * volume ** (2 / 3)
+        area_adjoint += capacitance_adjoint * k['specific_capacitance']
+        g['specific_capacitance'] += capacitance_adjoint * area
+        volume_adjoint += area_adjoint * (2 / 3) * area / volume
+
+        # buffer capacity = init buffer capacity * volume / init volume
+        g['buffer_capacity'] += buffer_capacity_adjoint * volume / k['init_volume']
+        volume_adjoint += buffer_capacity_adjoint * buffer_capacity / volume
+        g['init_volume'] -= buffer_capacity_adjoint * buffer_capacity / k['init_volume']
+
+        # concs = amounts / (1000 * volume)
+        amounts_adjoint += concs_adjoint / (1000 * volume)
+        volume_adjoint -= float(concs_adjoint @ concs) / volume
+
+        # volume = init volume * total / init conc total, total = non-hydrogen previous concs + |unaccounted|
+        total_adjoint = volume_adjoint * volume / total
+        g['init_volume'] += volume_adjoint * volume / k['init_volume']
+        g['init_conc_total'] -= volume_adjoint * volume / k['init_conc_total']
+        g['abs_unaccounted'] += total_adjoint
+        return amounts_adjoint, total_adjoint * self.non_hydrogen
+
+    def _parameter_gradient(self, k: dict, g: dict, amounts_adjoint: np.ndarray, concs_adjoint: np.ndarray) -> dict:
+        """Propagate the adjoints of the initial state and of the constants to the parameters."""
+        p = self.parameters
+        radius = p['vesicle.init_radius']
+        specific_capacitance = p['vesicle.specific_capacitance']
+        init_voltage = p['vesicle.init_voltage']
+        init_concs, init_volume = k['init_concs'], k['init_volume']
+        exterior = k['exterior']
+
+        # Initial amounts = init concs * 1000 * init volume; the first step's previous concs are the init concs
+        init_concs_adjoint = concs_adjoint + amounts_adjoint * 1000 * init_volume
+        init_volume_adjoint = g['init_volume'] + float(amounts_adjoint @ init_concs) * 1000
+
+        # init conc total = non-hydrogen init concs + |unaccounted|
+        init_concs_adjoint += g['init_conc_total'] * self.non_hydrogen
+        abs_unaccounted_adjoint = g['abs_unaccounted'] + g['init_conc_total']
+        unaccounted_adjoint = g['unaccounted'] + abs_unaccounted_adjoint * math.copysign(1.0, k['unaccounted'])
+
+        # unaccounted = init voltage * init capacitance / F - charges . init concs * 1000 * init volume
+        init_capacitance = 4.0 * math.pi * radius ** 2 * specific_capacitance
+        init_charge_adjoint = unaccounted_adjoint / FARADAY_CONSTANT
+        init_concs_adjoint -= unaccounted_adjoint * self.charges * 1000 * init_volume
+        init_volume_adjoint -= unaccounted_adjoint * float(self.charges @ init_concs) * 1000
+        init_capacitance_adjoint = init_charge_adjoint * init_voltage
+
+        # Exterior concentrations enter the channels through their logarithms
+        exterior_adjoint = (np.bincount(self.primary, weights=g['log_exterior_primary'], minlength=len(exterior)) +
+                            np.bincount(self.secondary, weights=g['log_exterior_secondary'], minlength=len(exterior))
+                            ) / exterior
+        n_species = len(init_concs)
+        exterior_concs_adjoint = exterior_adjoint[:n_species].copy()
+        # The free hydrogen exterior concentration is the hydrogen one times the buffer capacity
+        exterior_concs_adjoint[self.hydrogen_index] += exterior_adjoint[n_species] * k['buffer_capacity']
+        buffer_capacity_adjoint = g['buffer_capacity'] + exterior_adjoint[n_species] * exterior[self.hydrogen_index]
+
+        gradient = {}
+        for index, name in enumerate(self.species_names):
+            gradient[f'species.{name}.init_vesicle_conc'] = float(init_concs_adjoint[index])
+            gradient[f'species.{name}.exterior_conc'] = float(exterior_concs_adjoint[index])
+        channel_adjoints = dict(g, nernst_multiplier=g['nernst_factor'] * self.nernst_constants)
+        for index, name in enumerate(self.channel_names):
+            for parameter in (*ModelSpec.NUMERIC_CHANNEL_PARAMETERS, 'primary_exponent', 'secondary_exponent'):
+                if f'channels.{name}.{parameter}' in p:
+                    gradient[f'channels.{name}.{parameter}'] = float(channel_adjoints[parameter][index])
+        gradient['vesicle.init_radius'] = (init_volume_adjoint * 4 * math.pi * radius ** 2 +
+                                           init_capacitance_adjoint * 8 * math.pi * radius * specific_capacitance)
+        gradient['vesicle.specific_capacitance'] = (g['specific_capacitance'] +
+                                                    init_capacitance_adjoint * 4 * math.pi * radius ** 2)
+        gradient['vesicle.init_voltage'] = init_charge_adjoint * init_capacitance
+        gradient['config.init_buffer_capacity'] = buffer_capacity_adjoint
+        return gradient
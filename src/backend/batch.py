@@ -0,0 +1,419 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .constants import FARADAY_CONSTANT, VOLUME_TO_AREA_CONSTANT
+from .model_spec import ModelSpec
+from .simulation import SimulationConfig
+from .vesicle import VesicleConfig
+
+
+class BatchSimulation:
+    """
+    Runs many scenarios with the same model structure as one vectorized simulation.
+
+    Every quantity of the model is an array over the batch. The batch is split
+    into chunks that advance independently on a ThreadPoolExecutor; NumPy
+    releases the GIL inside the vectorized operations, so the chunks run on
+    several cores of one process. Each chunk owns its state and scratch
+    buffers and every operation of a step writes into them in place, so the
+    step loop allocates no arrays. The steps are the same as Simulation's.
+
+    The scenarios may differ in their numeric parameters: species
+    concentrations, channel conductances, multipliers and voltage shifts,
+    the vesicle and the buffer capacity. Everything else, the
+    species, channels and links, the channel types and exponents and the time
+    step and total time, must be the same.
+
+    Parameters:
+    ----------
+    scenarios : list
+        The Scenarios to run.
+    threads : int, optional
+        Number of worker threads. Default is the number of CPUs.
+    chunk_size : int, optional
+        Number of scenarios per chunk. Default splits the batch evenly over the threads.
+    fields : sequence of str, optional
+        Recorded fields: Vesicle fields ('Vesicle_pH', 'Vesicle_voltage', 'Vesicle_volume',
+        'Vesicle_area', 'Vesicle_capacitance', 'Vesicle_charge') and species fields
+        ('<species>_vesicle_conc', '<species>_vesicle_amount'). Default is DEFAULT_FIELDS.
+    record_interval : int, optional
+        Record every record_interval-th step. Default is 1.
+    """
+
+    DEFAULT_FIELDS = ('Vesicle_pH', 'Vesicle_voltage', 'Vesicle_volume')
+    DEFAULT_BLOCK_STEPS = 1000
+    MIN_CHUNK_SIZE = 256
+    SHARED_CONFIG_OPTIONS = ('time_step', 'total_time')
+
+    def __init__(self,
+                 scenarios: list,
+                 *,
+                 threads: int = None,
+                 chunk_size: int = None,
+                 fields=None,
+                 record_interval: int = 1):
+        if not scenarios:
+            raise ValueError("A batch needs at least one scenario.")
+        self.scenarios = list(scenarios)
+        self.threads = threads if threads is not None else (os.cpu_count() or 1)
+        self.fields = tuple(fields) if fields is not None else self.DEFAULT_FIELDS
+        if record_interval < 1:
+            raise ValueError(f"record_interval must be a positive integer, got {record_interval}.")
+        self.record_interval = record_interval
+        self.stop_requested = False
+
+        # The structure is taken from a simulation of the first scenario
+        template = self.scenarios[0].build_simulation()
+        self._check_structure(template)
+        self.config = template.config
+        self.iter_num = template.iter_num
+        self.time_field = template.histories.metadata['time_field']
+        self.species_names = [ion.display_name for ion in template.all_species]
+        if 'h' not in self.species_names:
+            raise ValueError("Hydrogen species not found in the simulation.")
+        for field in self.fields:
+            self._field_source(field)
+
+        batch_size = len(self.scenarios)
+        default_chunk_size = max(self.MIN_CHUNK_SIZE, math.ceil(batch_size / self.threads))
+        self.chunk_size = chunk_size if chunk_size is not None else default_chunk_size
+        parameters = self._gather_parameters(template)
+        self.chunks = [_BatchChunk(template, parameters, start, min(start + self.chunk_size, batch_size))
+                       for start in range(0, batch_size, self.chunk_size)]
+
+    def _check_structure(self, template):
+        structure = self._structure(self.scenarios[0])
+        for index, scenario in enumerate(self.scenarios[1:], start=1):
+            if self._structure(scenario) != structure:
+                raise ValueError(f"Scenario {index} has a different model structure or time stepping than scenario 0; "
+                                 f"a batch can only vary numeric parameters.")
+        if template.config.slow_update_ratio is not None:
+            raise ValueError("Multi-rate integration is not supported by the batch engine.")
+
+    @classmethod
+    def _structure(cls, scenario) -> tuple:
+        config = SimulationConfig(**scenario.config)
+        return scenario.spec.topology_key(), tuple(getattr(config, option) for option in cls.SHARED_CONFIG_OPTIONS)
+
+    def _gather_parameters(self, template) -> dict:
+        """Collect the numeric parameters of every scenario as arrays over the batch."""
+        configs = [SimulationConfig(**scenario.config) for scenario in self.scenarios]
+        vesicles = [VesicleConfig(**scenario.vesicle) for scenario in self.scenarios]
+        specs = [scenario.spec for scenario in self.scenarios]
+        parameters = {
+            'init_buffer_capacity': np.array([config.init_buffer_capacity for config in configs], dtype=np.float64),
+            'init_radius': np.array([vesicle.init_radius for vesicle in vesicles], dtype=np.float64),
+            'specific_capacitance': np.array([vesicle.specific_capacitance for vesicle in vesicles], dtype=np.float64),
+            'init_voltage': np.array([vesicle.init_voltage for vesicle in vesicles], dtype=np.float64),
+        }
+        for ion in template.all_species:
+            for parameter in ModelSpec.NUMERIC_SPECIES_PARAMETERS:
+                parameters[ion.display_name, parameter] = np.array(
+                    [spec.species[ion.display_name][parameter] for spec in specs], dtype=np.float64)
+        for ion in template.all_species:
+            for channel in ion.channels:
+                for parameter in ModelSpec.NUMERIC_CHANNEL_PARAMETERS:
+                    parameters[channel.display_name, parameter] = np.array(
+                        [spec.channels[channel.display_name][parameter] for spec in specs], dtype=np.float64)
+        return parameters
+
+    def _field_source(self, field: str):
+        """Return (kind, index) locating a recorded field in the state of a chunk."""
+        object_name, _, attribute = field.partition('_')
+        if object_name == 'Vesicle' and attribute in _BatchChunk.VESICLE_FIELDS:
+            return 'vesicle', attribute
+        if object_name in self.species_names and attribute in ('vesicle_conc', 'vesicle_amount'):
+            return attribute, self.species_names.index(object_name)
+        raise ValueError(f"Field '{field}' cannot be recorded by the batch engine.")
+
+    def get_times(self) -> np.ndarray:
+        """Return the sample times, accumulated step by step as in Simulation."""
+        times = np.empty(math.ceil(self.iter_num / self.record_interval))
+        time = 0.0
+        for step in range(self.iter_num):
+            if step % self.record_interval == 0:
+                times[step // self.record_interval] = time
+            time += self.config.time_step
+        return times
+
+    def stop(self):
+        """Ask a running batch, e.g. from another thread, to stop after the current block of steps."""
+        self.stop_requested = True
+
+    def run(self, progress_callback=None) -> dict:
+        """
+        Run every scenario and return {field: array of shape (samples, scenarios)}, with the
+        sample times under the time field. progress_callback, if given, is called with the
+        completed fraction after every block of steps.
+        """
+        times = self.get_times()
+        histories = {field: np.empty((len(times), len(self.scenarios)), dtype=np.float64) for field in self.fields}
+        sources = [(field, self._field_source(field)) for field in self.fields]
+        for chunk in self.chunks:
+            chunk.prepare_recording(histories, sources, self.record_interval)
+
+        executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 and len(self.chunks) > 1 else None
+        try:
+            step = 0
+            while step < self.iter_num and not self.stop_requested:
+                block_steps = min(self.DEFAULT_BLOCK_STEPS, self.iter_num - step)
+                if executor is None:
+                    for chunk in self.chunks:
+                        chunk.advance(step, block_steps)
+                else:
+                    # result() re-raises the errors of the workers
+                    for future in [executor.submit(chunk.advance, step, block_steps) for chunk in self.chunks]:
+                        future.result()
+                step += block_steps
+                if progress_callback is not None:
+                    progress_callback(step / self.iter_num)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        recorded = math.ceil(step / self.record_interval)
+        histories = {field: values[:recorded] for field, values in histories.items()}
+        histories[self.time_field] = times[:recorded]
+        return histories
+
+    def get_diagnostics(self) -> dict:
+        """Return the clamp counts per species, summed over the batch, and the scenarios with a NaN or inf pH."""
+        clamp_counts = {}
+        for chunk in self.chunks:
+            for name, count in zip(self.species_names, chunk.clamp_counts):
+                if count:
+                    clamp_counts[name] = clamp_counts.get(name, 0) + int(count)
+        nonfinite = [chunk.start + int(index) for chunk in self.chunks
+                     for index in np.flatnonzero(~np.isfinite(chunk.vesicle['pH']))]
+        return {'clamp_counts': clamp_counts, 'nonfinite': nonfinite}
+
+
+class _BatchChunk:
+    """The state, parameters and scratch buffers of a contiguous slice of a batch."""
+
+    VESICLE_FIELDS = ('pH', 'voltage', 'volume', 'area', 'capacitance', 'charge')
+
+    def __init__(self, template, parameters: dict, start: int, stop: int):
+        self.start = start
+        self.stop = stop
+        size = stop - start
+        species = template.all_species
+        species_index = {ion.display_name: index for index, ion in enumerate(species)}
+        hydrogen_index = species_index['h']
+        self.time_step = template.config.time_step
+        self.time = 0.0
+
+        def take(key):
+            return np.ascontiguousarray(parameters[key][start:stop])
+
+        # Vesicle and buffer constants, computed as in Vesicle and Simulation
+        init_radius = take('init_radius')
+        self.specific_capacitance = take('specific_capacitance')
+        self.init_volume = (4 / 3) * math.pi * (init_radius ** 3)
+        init_charge = take('init_voltage') * (4.0 * math.pi * (init_radius ** 2) * self.specific_capacitance)
+        self.init_buffer_capacity = take('init_buffer_capacity')
+        self.nernst_constant = template.nernst_constant
+
+        self.charges = np.array([[ion.elementary_charge] * size for ion in species], dtype=np.float64)
+        init_concs = np.array([take((ion.display_name, 'init_vesicle_conc')) for ion in species])
+        self.exterior_concs = np.array([take((ion.display_name, 'exterior_conc')) for ion in species])
+        self.exterior_hydrogen_free = self.exterior_concs[hydrogen_index] * self.init_buffer_capacity
+
+        charge_sum = np.zeros(size)
+        for row in range(len(species)):
+            charge_sum += self.charges[row] * init_concs[row]
+        self.unaccounted = init_charge / FARADAY_CONSTANT - charge_sum * 1000 * self.init_volume
+        self.abs_unaccounted = np.abs(self.unaccounted)
+        self.non_hydrogen_rows = [row for row, ion in enumerate(species) if ion.display_name != 'h']
+        init_conc_sum = np.zeros(size)
+        for row in self.non_hydrogen_rows:
+            init_conc_sum += init_concs[row]
+        self.init_conc_total = init_conc_sum + self.abs_unaccounted
+        self.hydrogen_index = hydrogen_index
+
+        # State, set as in Simulation.set_ion_amounts
+        self.concs = init_concs.copy()
+        self.amounts = self.concs * 1000 * self.init_volume
+        self.vesicle = {name: np.zeros(size) for name in self.VESICLE_FIELDS}
+        self.buffer_capacity = np.zeros(size)
+        self.hydrogen_free = np.zeros(size)
+        self.species_fluxes = np.zeros((len(species), size))
+        self.clamp_counts = np.zeros(len(species), dtype=np.int64)
+
+        # Scratch buffers, reused by every step
+        self._first = np.zeros(size)
+        self._second = np.zeros(size)
+        self._flux = np.zeros(size)
+        self._negative = np.zeros((len(species), size), dtype=bool)
+
+        # Row views, so that the step only runs one-dimensional operations without broadcasting buffers
+        self._amount_rows = list(self.amounts)
+        self._conc_rows = list(self.concs)
+        self._charge_rows = list(self.charges)
+        self._non_hydrogen_conc_rows = [self._conc_rows[row] for row in self.non_hydrogen_rows]
+        self._species_flux_rows = list(self.species_fluxes)
+
+        # Channels in the order in which Simulation sums them
+        self.channels = []
+        for owner_index, ion in enumerate(species):
+            for channel in ion.channels:
+                self.channels.append(self._compile_channel(channel, owner_index, species_index, take))
+
+        self._recorders = []
+        self._record_interval = 1
+
+    def _compile_channel(self, channel, owner_index: int, species_index: dict, take) -> dict:
+        config = channel.config
+
+        def concentrations(ion, exponent):
+            """Return the vesicle concentration array of an ion and its constant exterior term."""
+            if config.use_free_hydrogen and ion.display_name == 'h':
+                return self.hydrogen_free, self.exterior_hydrogen_free ** exponent
+            row = species_index[ion.display_name]
+            return self._conc_rows[row], self.exterior_concs[row] ** exponent
+
+        primary_source, exterior_primary = concentrations(channel.primary_ion_species, config.primary_exponent)
+        compiled = {
+            'owner': self._species_flux_rows[owner_index],
+            'primary': primary_source,
+            'primary_exponent': config.primary_exponent,
+            'exterior_primary': exterior_primary,
+            'secondary': None,
+            'voltage_multiplier': take((channel.display_name, 'voltage_multiplier')),
+            'voltage_shift': take((channel.display_name, 'voltage_shift')),
+            'flux_multiplier': take((channel.display_name, 'flux_multiplier')),
+            'conductance': take((channel.display_name, 'conductance')),
+            'voltage_gating': None,
+            'pH_gating': None,
+            'time_gating': None,
+        }
+        nernst_constant = config.custom_nernst_constant if config.custom_nernst_constant is not None else self.nernst_constant
+        compiled['nernst_factor'] = take((channel.display_name, 'nernst_multiplier')) * nernst_constant
+        if channel.secondary_ion_species is not None:
+            compiled['secondary'], compiled['exterior_secondary'] = concentrations(channel.secondary_ion_species,
+                                                                                   config.secondary_exponent)
+            compiled['secondary_exponent'] = config.secondary_exponent
+        if config.dependence_type in ('voltage', 'voltage_and_pH'):
+            compiled['voltage_gating'] = (channel.voltage_exponent, channel.half_act_voltage)
+        if config.dependence_type in ('pH', 'voltage_and_pH'):
+            compiled['pH_gating'] = (channel.pH_exponent, channel.half_act_pH)
+        if config.dependence_type == 'time':
+            compiled['time_gating'] = (channel.time_exponent, channel.half_act_time)
+        return compiled
+
+    def prepare_recording(self, histories: dict, sources: list, record_interval: int):
+        """Bind the recorded fields to this chunk's columns of the output arrays."""
+        self._record_interval = record_interval
+        self._recorders = []
+        for field, (kind, index) in sources:
+            if kind == 'vesicle':
+                source = self.vesicle[index]
+            elif kind == 'vesicle_conc':
+                source = self.concs[index]
+            else:
+                source = self.amounts[index]
+            self._recorders.append((histories[field][:, self.start:self.stop], source))
+
+    def advance(self, first_step: int, steps: int):
+        """Run steps iterations starting at step number first_step."""
+        # A diverging scenario must not flood the other ones with warnings; see get_diagnostics
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for step in range(first_step, first_step + steps):
+                self.update_state()
+                self.compute_fluxes()
+                if step % self._record_interval == 0:
+                    row = step // self._record_interval
+                    for output, source in self._recorders:
+                        output[row] = source
+                self.update_amounts()
+                self.time += self.time_step
+
+    def update_state(self):
+        """Simulation.update_simulation_state over the chunk."""
+        vesicle = self.vesicle
+        volume, first = vesicle['volume'], self._first
+
+        # The volume follows the concentrations of the previous step
+        first.fill(0.0)
+        for conc in self._non_hydrogen_conc_rows:
+            first += conc
+        first += self.abs_unaccounted
+        np.multiply(self.init_volume, first, out=volume)
+        volume /= self.init_conc_total
+
+        np.multiply(volume, 1000, out=first)
+        for amount, conc in zip(self._amount_rows, self._conc_rows):
+            np.divide(amount, first, out=conc)
+
+        np.multiply(self.init_buffer_capacity, volume, out=self.buffer_capacity)
+        self.buffer_capacity /= self.init_volume
+        np.power(volume, 2 / 3, out=vesicle['area'])
+        vesicle['area'] *= VOLUME_TO_AREA_CONSTANT
+        np.multiply(vesicle['area'], self.specific_capacitance, out=vesicle['capacitance'])
+
+        charge = vesicle['charge']
+        charge.fill(0.0)
+        for elementary_charge, amount in zip(self._charge_rows, self._amount_rows):
+            np.multiply(elementary_charge, amount, out=first)
+            charge += first
+        charge += self.unaccounted
+        charge *= FARADAY_CONSTANT
+        np.divide(charge, vesicle['capacitance'], out=vesicle['voltage'])
+
+        np.multiply(self._conc_rows[self.hydrogen_index], self.buffer_capacity, out=self.hydrogen_free)
+        np.log10(self.hydrogen_free, out=vesicle['pH'])
+        np.negative(vesicle['pH'], out=vesicle['pH'])
+
+    def compute_fluxes(self):
+        """Compute the total flux of every species, summing the channels in Simulation's order."""
+        vesicle = self.vesicle
+        first, second, flux = self._first, self._second, self._flux
+        self.species_fluxes.fill(0.0)
+        for channel in self.channels:
+            # Nernst potential
+            np.power(channel['primary'], channel['primary_exponent'], out=second)
+            np.divide(channel['exterior_primary'], second, out=first)
+            if channel['secondary'] is not None:
+                np.power(channel['secondary'], channel['secondary_exponent'], out=second)
+                second /= channel['exterior_secondary']
+                first *= second
+            np.log(first, out=first)
+            first *= channel['nernst_factor']
+            np.multiply(channel['voltage_multiplier'], vesicle['voltage'], out=second)
+            second += first
+            second -= channel['voltage_shift']
+
+            # Flux and gating
+            np.multiply(channel['flux_multiplier'], second, out=flux)
+            flux *= channel['conductance']
+            flux *= vesicle['area']
+            if channel['voltage_gating'] is not None:
+                self._apply_gating(flux, vesicle['voltage'], *channel['voltage_gating'])
+            if channel['pH_gating'] is not None:
+                self._apply_gating(flux, vesicle['pH'], *channel['pH_gating'])
+            if channel['time_gating'] is not None:
+                exponent, half_activation = channel['time_gating']
+                flux *= 1.0 / (1.0 + math.exp(exponent * (half_activation - self.time)))
+            channel['owner'] += flux
+
+    def _apply_gating(self, flux, values, exponent: float, half_activation: float):
+        """flux *= 1 / (1 + exp(exponent * (values - half_activation)))"""
+        first = self._first
+        np.subtract(values, half_activation, out=first)
+        first *= exponent
+        np.exp(first, out=first)
+        first += 1.0
+        np.divide(1.0, first, out=first)
+        flux *= first
+
+    def update_amounts(self):
+        """Simulation.update_ion_amounts over the chunk, counting the clamped amounts per species."""
+        np.multiply(self.species_fluxes, self.time_step, out=self.species_fluxes)
+        self.amounts += self.species_fluxes
+        np.less(self.amounts, 0.0, out=self._negative)
+        if np.count_nonzero(self._negative):
+            self.clamp_counts += self._negative.sum(axis=1)
+            np.maximum(self.amounts, 0.0, out=self.amounts)
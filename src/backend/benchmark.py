@@ -0,0 +1,210 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from .scenarios import Scenario
+from .result_store import ResultStore
+from .histories_storage import HistoriesStorage
+from .history_codecs import ArrayColumn
+
+
+def canonical_scenarios(total_time: float = 20.0) -> dict:
+    """Return the benchmark scenarios: the default model and variants that stress different processes."""
+    base = Scenario(config={'total_time': total_time})
+    return {
+        'default': base.with_overrides({}, name='default'),
+        'strong_asor': base.with_overrides({'channels.asor.conductance': 8e-4}, name='strong_asor'),
+        'no_vatpase': base.with_overrides({'channels.vatpase.conductance': 0.0}, name='no_vatpase'),
+        'large_radius': base.with_overrides({'vesicle.init_radius': 2.6e-6}, name='large_radius'),
+        'small_radius': base.with_overrides({'vesicle.init_radius': 0.65e-6}, name='small_radius'),
+    }
+
+
+# SimulationConfig options of every engine compared with the golden references
+ENGINES = {
+    'default': {},
+    'transport_network': {'use_transport_network': True},
+    'multirate': {'slow_update_ratio': 'auto'},
+    'gating_tables': {'use_gating_tables': True},
+}
+
+
+class WorkPrecisionBenchmark:
+    """
+    Measures the wall time and the error of every engine and time step against golden references.
+
+    The golden reference of a scenario is the Richardson extrapolation of two
+    runs of the default engine at reference_time_step and half of it, which
+    removes the first-order error of the time integration. References are
+    computed once and kept in a ResultStore, so later benchmarks only run the
+    candidates.
+
+    Parameters:
+    ----------
+    reference_root : str
+        Directory of the reference store.
+    scenarios : dict, optional
+        Maps names to Scenarios. Default is canonical_scenarios().
+    engines : dict, optional
+        Maps names to SimulationConfig options. Default is ENGINES.
+    time_steps : sequence of float, optional
+        Time steps at which every engine is run.
+    reference_time_step : float, optional
+        Coarser of the two reference time steps. Default is 2.5e-4 s.
+    repeats : int, optional
+        Every candidate is run this many times and the fastest wall time is kept. Default is 1.
+    """
+
+    DEFAULT_TIME_STEPS = (0.01, 0.005, 0.002, 0.001)
+    DEFAULT_REFERENCE_TIME_STEP = 2.5e-4
+    FIELDS = ('Vesicle_pH', 'Vesicle_voltage', 'Vesicle_volume')
+
+    def __init__(self,
+                 reference_root: str,
+                 *,
+                 scenarios: dict = None,
+                 engines: dict = None,
+                 time_steps=None,
+                 reference_time_step: float = None,
+                 repeats: int = 1):
+        self.references = ResultStore(reference_root)
+        self.scenarios = scenarios if scenarios is not None else canonical_scenarios()
+        self.engines = engines if engines is not None else ENGINES
+        self.time_steps = tuple(time_steps) if time_steps is not None else self.DEFAULT_TIME_STEPS
+        self.reference_time_step = reference_time_step if reference_time_step is not None else self.DEFAULT_REFERENCE_TIME_STEP
+        self.repeats = repeats
+
+    def _reference_key(self, scenario: Scenario) -> str:
+        return scenario.with_overrides({'config.time_step': self.reference_time_step}).key() + '-reference'
+
+    def get_reference(self, scenario: Scenario):
+        """Return the stored golden reference of a scenario, computing it if needed."""
+        key = self._reference_key(scenario)
+        if not self.references.has(key):
+            self.references.save(key, self._compute_reference(scenario), scenario=scenario.to_dict())
+        return self.references.load(key)
+
+    def _compute_reference(self, scenario: Scenario) -> HistoriesStorage:
+        coarse = self._run(scenario, {'time_step': self.reference_time_step})[0]
+        fine = self._run(scenario, {'time_step': self.reference_time_step / 2})[0]
+        time_field = coarse.metadata['time_field']
+        coarse_time = np.asarray(coarse.histories[time_field])
+        fine_time = np.asarray(fine.histories[time_field])[::2][:len(coarse_time)]
+        if len(fine_time) != len(coarse_time) or not np.allclose(fine_time, coarse_time, atol=self.reference_time_step * 1e-6):
+            raise RuntimeError('The reference runs are not sampled at matching times.')
+
+        # For a first-order method y(h) = y + c h + O(h^2), so 2 y(h/2) - y(h) = y + O(h^2)
+        reference = HistoriesStorage()
+        reference.metadata = coarse.metadata
+        reference.histories[time_field] = ArrayColumn.wrap(coarse_time.copy())
+        reference.intervals[time_field] = 1
+        for tracked_field_name in self.FIELDS:
+            coarse_values = np.asarray(coarse.histories[tracked_field_name], dtype=np.float64)
+            fine_values = np.asarray(fine.histories[tracked_field_name], dtype=np.float64)[::2][:len(coarse_time)]
+            reference.histories[tracked_field_name] = ArrayColumn.wrap(2.0 * fine_values - coarse_values)
+            reference.intervals[tracked_field_name] = 1
+            reference.units[tracked_field_name] = coarse.units.get(tracked_field_name, '')
+        return reference
+
+    @staticmethod
+    def _run(scenario: Scenario, config: dict):
+        overrides = {f'config.{option}': value for option, value in config.items()}
+        simulation = scenario.with_overrides(overrides).build_simulation()
+        start = time.perf_counter()
+        histories = simulation.run()
+        return histories, time.perf_counter() - start
+
+    def run(self, progress_callback=None) -> list:
+        """
+        Run every scenario, engine and time step, returning one row per run with its wall time
+        and, for every field, the maximum and root-mean-square error against the reference.
+        """
+        rows = []
+        for scenario_name, scenario in self.scenarios.items():
+            reference = self.get_reference(scenario)
+            time_field = reference.metadata['time_field']
+            reference_time = reference.get(time_field)
+            for engine_name, engine_config in self.engines.items():
+                for time_step in self.time_steps:
+                    wall_time = np.inf
+                    for _ in range(self.repeats):
+                        histories, elapsed = self._run(scenario, dict(engine_config, time_step=time_step))
+                        wall_time = min(wall_time, elapsed)
+                    row = {'scenario': scenario_name, 'engine': engine_name, 'time_step': time_step, 'wall_time': wall_time}
+                    candidate_time = np.asarray(histories.get_histories()[time_field])
+                    for tracked_field_name in self.FIELDS:
+                        expected = np.interp(candidate_time, reference_time, reference.get(tracked_field_name))
+                        errors = np.asarray(histories.get_histories()[tracked_field_name]) - expected
+                        row[f'{tracked_field_name}_max_error'] = float(np.max(np.abs(errors)))
+                        row[f'{tracked_field_name}_rms_error'] = float(np.sqrt(np.mean(errors ** 2)))
+                    rows.append(row)
+                    if progress_callback is not None:
+                        progress_callback(row)
+        return rows
+
+    @classmethod
+    def format_table(cls, rows: list) -> str:
+        """Format rows as a text work-precision table with the maximum errors."""
+        headers = ['scenario', 'engine', 'time_step', 'wall_time'] + [f'{field}_max_error' for field in cls.FIELDS]
+        lines = [[str(header) for header in headers]]
+        for row in rows:
+            lines.append([row['scenario'], row['engine'], f"{row['time_step']:g}", f"{row['wall_time']:.3f}"] +
+                         [f"{row[header]:.2e}" for header in headers[4:]])
+        widths = [max(len(line[column]) for line in lines) for column in range(len(headers))]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)) for line in lines)
+
+    @staticmethod
+    def save_csv(rows: list, path: str):
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    @classmethod
+    def plot(cls, rows: list, path: str, field: str = 'Vesicle_pH'):
+        """Save a work-precision plot, error against wall time, with one panel per scenario."""
+        from matplotlib.figure import Figure
+
+        scenario_names = list(dict.fromkeys(row['scenario'] for row in rows))
+        figure = Figure(figsize=(4 * len(scenario_names), 3.5))
+        for index, scenario_name in enumerate(scenario_names):
+            ax = figure.add_subplot(1, len(scenario_names), index + 1)
+            for engine_name in dict.fromkeys(row['engine'] for row in rows):
+                selected = [row for row in rows if row['scenario'] == scenario_name and row['engine'] == engine_name]
+                ax.loglog([row['wall_time'] for row in selected],
+                          [max(row[f'{field}_max_error'], 1e-16) for row in selected], 'o-', label=engine_name)
+            ax.set_title(scenario_name)
+            ax.set_xlabel('Wall time (s)')
+            if index == 0:
+                ax.set_ylabel(f'Max error of {field}')
+                ax.legend()
+        figure.tight_layout()
+        figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the accuracy and cost of the simulation engines.')
+    parser.add_argument('--references', default='benchmark_references', help='Directory of the golden references.')
+    parser.add_argument('--total-time', type=float, default=20.0)
+    parser.add_argument('--time-steps', type=float, nargs='+', default=None)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--csv', default=None, help='Write the rows to this CSV file.')
+    parser.add_argument('--plot', default=None, help='Save a work-precision plot to this file.')
+    arguments = parser.parse_args()
+
+    benchmark = WorkPrecisionBenchmark(arguments.references,
+                                       scenarios=canonical_scenarios(arguments.total_time),
+                                       time_steps=arguments.time_steps,
+                                       repeats=arguments.repeats)
+    rows = benchmark.run()
+    print(benchmark.format_table(rows))
+    if arguments.csv:
+        benchmark.save_csv(rows, arguments.csv)
+    if arguments.plot:
+        benchmark.plot(rows, arguments.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+from typing import Callable
+
+
+class Event:
+    """
+    A scalar function of the simulation state whose zero crossings are located
+    within a step rather than at the step boundaries.
+
+    Parameters:
+    ----------
+    name : str
+        Name under which occurrences are recorded.
+    function : callable
+        Called as function(simulation) on a fully updated simulation state; an
+        event occurs when its sign changes, e.g. lambda sim: sim.vesicle.pH - 5.5.
+    direction : str, optional
+        'falling', 'rising' or 'any' (default). A falling crossing goes from a
+        positive value to zero or below.
+    terminal : bool, optional
+        Stop the run at the event time. Default is False.
+    action : callable, optional
+        Called as action(simulation) at the event time. It may change ion amounts
+        or any model parameter; the remainder of the step uses the new values.
+    """
+
+    ALLOWED_DIRECTIONS = ('any', 'rising', 'falling')
+
+    def __init__(self,
+                 *,
+                 name: str,
+                 function: Callable,
+                 direction: str = 'any',
+                 terminal: bool = False,
+                 action: Callable = None):
+        if direction not in self.ALLOWED_DIRECTIONS:
+            raise ValueError(f"Unsupported direction: {direction}. Expected one of {self.ALLOWED_DIRECTIONS}.")
+        self.name = name
+        self.function = function
+        self.direction = direction
+        self.terminal = terminal
+        self.action = action
+
+    def is_crossing(self, previous_value: float, current_value: float) -> bool:
+        rising = previous_value < 0.0 <= current_value
+        falling = previous_value > 0.0 >= current_value
+        if self.direction == 'rising':
+            return rising
+        if self.direction == 'falling':
+            return falling
+        return rising or falling
+
+
+class EventsStorage:
+    """
+    Holds the events registered with a simulation, their last evaluated values
+    and the recorded occurrences.
+    """
+
+    DEFAULT_TOLERANCE = 1e-12
+    DEFAULT_MAX_ITERATIONS = 100
+
+    def __init__(self, *, tolerance: float = None, max_iterations: int = None):
+        self.tolerance = tolerance if tolerance is not None else self.DEFAULT_TOLERANCE
+        self.max_iterations = max_iterations if max_iterations is not None else self.DEFAULT_MAX_ITERATIONS
+        self.events = {}
+        self.occurrences = []
+        self.last_values = None
+
+    def register_event(self, event: Event):
+        if not isinstance(event, Event):
+            raise TypeError("The event object must be of type Event.")
+        if event.name in self.events:
+            raise RuntimeError(f'An event with the name {event.name} has been already registered')
+        self.events[event.name] = event
+        self.last_values = None
+
+    def evaluate(self, simulation) -> list:
+        return [event.function(simulation) for event in self.events.values()]
+
+    def find_crossings(self, previous_values: list, current_values: list) -> list:
+        return [event for event, previous, current in zip(self.events.values(), previous_values, current_values)
+                if event.is_crossing(previous, current)]
+
+    def locate(self, event: Event, evaluate_at: Callable, previous_value: float, current_value: float) -> float:
+        """
+        Locate the fraction of the step at which the event function changes sign.
+
+        evaluate_at(fraction) must return the event function value for the state
+        at that fraction of the step. The Illinois variant of regula falsi is used;
+        the returned fraction is the right end of the final bracket, so the event
+        function has already changed sign there.
+        """
+        left, right = 0.0, 1.0
+        left_value, right_value = previous_value, current_value
+        side = 0
+        for _ in range(self.max_iterations):
+            if right - left <= self.tolerance:
+                break
+            denominator = right_value - left_value
+            fraction = left - left_value * (right - left) / denominator if denominator != 0 else 0.5 * (left + right)
+            if not left < fraction < right:
+                fraction = 0.5 * (left + right)
+            value = evaluate_at(fraction)
+            if event.is_crossing(left_value, value):
+                right, right_value = fraction, value
+                if side == -1:
+                    left_value *= 0.5
+                side = -1
+            else:
+                left, left_value = fraction, value
+                if side == 1:
+                    right_value *= 0.5
+                side = 1
+        return right
+
+    def record(self, event: Event, time: float):
+        self.occurrences.append({'name': event.name, 'time': time})
+
+    def get_occurrences(self) -> list:
+        return self.occurrences
@@ -12,7 +12,10 @@ class ExteriorConfig:
 
 
 class Exterior(Trackable):
+    __slots__ = ('display_name', 'config', 'pH')
+
     TRACKABLE_FIELDS = ('pH',)
+    FIELD_UNITS = {'pH': ''}
 
     def __init__(self,
                  *,
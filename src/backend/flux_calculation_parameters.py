@@ -1,4 +1,7 @@
 class FluxCalculationParameters:
+
+    __slots__ = ('voltage', 'pH', 'time', 'area', 'nernst_constant',
+                 'vesicle_hydrogen_free', 'exterior_hydrogen_free')
     
     def __init__(self):
         self.voltage = None
@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+
+
+class GatingTable:
+    """
+    A tabulated logistic gating curve 1 / (1 + exp(exponent * (x - half_activation))).
+
+    The curve is sampled on a uniform grid over [lower, upper] and evaluated by
+    linear interpolation. The interpolation error of a function with second
+    derivative bounded by M on a grid of spacing h is at most h**2 * M / 8, and
+    the second derivative of the logistic is bounded by exponent**2 / (6 * sqrt(3)),
+    so the grid spacing is chosen to guarantee max_error everywhere in the
+    range. Outside the range the exact formula is used.
+
+    Tables can be evaluated on scalars or, vectorized, on NumPy arrays. They
+    replace the exponential by a gather and a multiply-add, which only pays
+    off where the exponential dominates; with CPython and NumPy's vectorized
+    exp the exact formula is usually as fast.
+
+    Parameters:
+    ----------
+    exponent : float
+        Steepness of the curve, e.g. IonChannel.voltage_exponent.
+    half_activation : float
+        Position of the midpoint, e.g. IonChannel.half_act_voltage.
+    lower, upper : float
+        Tabulated range.
+    max_error : float, optional
+        Guaranteed maximum absolute error inside the range. Default is 1e-6.
+    """
+
+    SECOND_DERIVATIVE_FACTOR = 1.0 / (6.0 * math.sqrt(3.0))
+    MAX_POINTS = 10_000_000
+
+    def __init__(self,
+                 *,
+                 exponent: float,
+                 half_activation: float,
+                 lower: float,
+                 upper: float,
+                 max_error: float = 1e-6):
+        if upper <= lower:
+            raise ValueError(f"The table range must satisfy lower < upper, got [{lower}, {upper}].")
+        if max_error <= 0:
+            raise ValueError(f"The maximum error must be positive, got {max_error}.")
+        self.exponent = exponent
+        self.half_activation = half_activation
+        self.lower = lower
+        self.upper = upper
+        self.max_error = max_error
+
+        second_derivative_bound = exponent ** 2 * self.SECOND_DERIVATIVE_FACTOR
+        if second_derivative_bound > 0:
+            spacing = math.sqrt(8.0 * max_error / second_derivative_bound)
+            intervals = max(1, math.ceil((upper - lower) / spacing))
+        else:
+            intervals = 1
+        if intervals + 1 > self.MAX_POINTS:
+            raise ValueError(f"A table over [{lower}, {upper}] with max_error={max_error} would need "
+                             f"{intervals + 1} points; narrow the range or relax the error.")
+
+        self.grid = np.linspace(lower, upper, intervals + 1)
+        self.values = self.exact(self.grid)
+        self.spacing = (upper - lower) / intervals
+        self.error_bound = self.spacing ** 2 * second_derivative_bound / 8.0
+        self._inverse_spacing = 1.0 / self.spacing
+        self._last_interval = intervals - 1
+        self._value_list = self.values.tolist()
+
+    def matches(self, exponent: float, half_activation: float) -> bool:
+        return exponent == self.exponent and half_activation == self.half_activation
+
+    def rebuild(self, *, exponent: float, half_activation: float):
+        """Return a table of another curve over the same range and with the same maximum error."""
+        return GatingTable(exponent=exponent, half_activation=half_activation,
+                           lower=self.lower, upper=self.upper, max_error=self.max_error)
+
+    def exact(self, x):
+        if isinstance(x, np.ndarray):
+            with np.errstate(over='ignore'):
+                return 1.0 / (1.0 + np.exp(self.exponent * (x - self.half_activation)))
+        return 1.0 / (1.0 + math.exp(self.exponent * (x - self.half_activation)))
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            # The grid is uniform, so the interval of each point is found by arithmetic, not by search
+            position = (np.clip(x, self.lower, self.upper) - self.lower) * self._inverse_spacing
+            index = np.minimum(position.astype(np.intp), self._last_interval)
+            fraction = position - index
+            lower_values = self.values[index]
+            result = lower_values + fraction * (self.values[index + 1] - lower_values)
+            inside = (x >= self.lower) & (x <= self.upper)
+            if inside.all():
+                return result
+            return np.where(inside, result, self.exact(x))
+
+        if not self.lower <= x <= self.upper:
+            return self.exact(x)
+        position = (x - self.lower) * self._inverse_spacing
+        index = min(int(position), self._last_interval)
+        fraction = position - index
+        values = self._value_list
+        return values[index] + fraction * (values[index + 1] - values[index])
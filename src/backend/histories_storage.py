@@ -1,13 +1,94 @@
 from abc import ABC
+import json
+import math
 import numpy as np
 from typing import List, Tuple
 from .trackable import Trackable
+from .history_codecs import HistoryStorageConfig
+
+
+class TrackingConfig:
+    """
+    Selects the object/field pairs recorded by a HistoriesStorage and how often.
+
+    Objects and fields that are not selected are not recorded at all, so they
+    cost nothing in the step loop. Any attribute of a registered object can be
+    selected, not only its TRACKABLE_FIELDS, e.g. the flux of a single channel.
+
+    Parameters:
+    ----------
+    fields : dict, optional
+        Maps object names to either a list of field names, recorded every
+        `every` steps, or a dict mapping field names to their own interval in steps.
+    every : int, optional
+        Default recording interval in steps. Default is 1.
+    """
+
+    def __init__(self,
+                 *,
+                 fields: dict = None,
+                 every: int = 1):
+        self.every = every
+        self.fields = {}
+        for object_name, selection in (fields or {}).items():
+            if isinstance(selection, dict):
+                for field_name, field_every in selection.items():
+                    self.track(object_name, field_name, every=field_every)
+            else:
+                for field_name in selection:
+                    self.track(object_name, field_name)
+
+    def track(self, object_name: str, field_name: str, every: int = None):
+        every = every if every is not None else self.every
+        if not isinstance(every, int) or every < 1:
+            raise ValueError(f"The recording interval must be a positive integer, got {every}.")
+        self.fields.setdefault(object_name, {})[field_name] = every
+
+    def track_channels(self, channel_names: list, *, every: int = None, nernst_potential: bool = False):
+        """Record the flux, and optionally the Nernst potential, of the given channels."""
+        for channel_name in channel_names:
+            self.track(channel_name, 'flux', every=every)
+            if nernst_potential:
+                self.track(channel_name, 'nernst_potential', every=every)
+
+    def get_fields(self, object_name: str) -> dict:
+        """Return the selected fields of an object mapped to their recording intervals."""
+        return dict(self.fields.get(object_name, {}))
+
+    def key(self) -> str:
+        """Return a string identifying the selection, e.g. to cache the history layout it produces."""
+        return json.dumps(self.fields, sort_keys=True)
 
 
 class HistoriesStorage:
-    def __init__(self):
+    # Memory of one recorded sample: a list slot plus a Python float object
+    BYTES_PER_SAMPLE = 32
+
+    def __init__(self,
+                 tracking_config: TrackingConfig = None,
+                 memory_budget: int = None,
+                 storage_config: HistoryStorageConfig = None,
+                 layouts: dict = None):
         self.objects = {}
         self.histories = {}
+        self.intervals = {}
+        self.units = {}
+        self.metadata = {}
+        self.tracking_config = tracking_config
+        self.storage_config = storage_config
+        self.step = 0
+        self._recorders = []
+
+        # The recorded fields of every registered object, (field_name, every, tracked_field_name, unit) tuples.
+        # Layouts given here, e.g. from a compiled model, are used as they are, without selecting and checking the fields
+        self.layouts = dict(layouts) if layouts is not None else {}
+
+        # With a memory budget (in bytes) every interval is multiplied by a common stride,
+        # which is planned before a run and doubled whenever the recorded data outgrows the budget
+        self.memory_budget = memory_budget
+        self.stride = 1
+        # Running total of get_memory_usage(), so that recording does not sum over all columns every step
+        self._memory_usage = 0
         
     def register_object(self, obj: Trackable):
         assert issubclass(type(obj), Trackable)
@@ -15,25 +96,210 @@ class HistoriesStorage:
             raise RuntimeError(f'An object with the name {obj_name} has been already registered')
         else:
             self.objects[obj_name] = obj
-            for field_name in obj.TRACKABLE_FIELDS:
-                if not hasattr(obj, field_name):
-                    raise ValueError(f'An error while trying to registed an object {obj_name} with Histories. '
-                                      f'The object doesn\'t have {field_name} attribute.')
-                self.histories[f'{obj_name}_{field_name}'] = []
+            layout = self.layouts.get(obj_name)
+            if layout is None:
+                layout = self.layouts[obj_name] = self.get_layout(obj)
+            for field_name, every, tracked_field_name, unit in layout:
+                if self.storage_config is None:
+                    self.histories[tracked_field_name] = []
+                else:
+                    self.histories[tracked_field_name] = self.storage_config.create_column(tracked_field_name)
+                history = self.histories[tracked_field_name]
+                if hasattr(history, 'on_flush'):
+                    history.on_flush = self._add_memory_usage
+                self.intervals[tracked_field_name] = every
+                self.units[tracked_field_name] = unit
+                self._recorders.append((obj, field_name, every, history, self._get_sample_cost(history)))
+            self._memory_usage = self.get_memory_usage()
+
+    def get_layout(self, obj: Trackable) -> list:
+        """Select and check the recorded fields of an object."""
+        obj_name = obj.display_name
+        if self.tracking_config is None:
+            selected_fields = {field_name: 1 for field_name in obj.TRACKABLE_FIELDS}
+        else:
+            selected_fields = self.tracking_config.get_fields(obj_name)
+        layout = []
+        for field_name, every in selected_fields.items():
+            if not hasattr(obj, field_name):
+                raise ValueError(f'An error while trying to registed an object {obj_name} with Histories. '
+                                  f'The object doesn\'t have {field_name} attribute.')
+            layout.append((field_name, every, f'{obj_name}_{field_name}', obj.FIELD_UNITS.get(field_name, '')))
+        return layout
         
+    def check_tracked_objects(self):
+        """Raise if the tracking config selects objects that were not registered, e.g. a misspelled channel."""
+        if self.tracking_config is None:
+            return
+        unknown = [object_name for object_name in self.tracking_config.fields if object_name not in self.objects]
+        if unknown:
+            raise ValueError(f'The tracking config selects unknown objects: {unknown}. '
+                             f'Available objects: {list(self.objects)}.')
+
     def update_histories(self):
-        for obj_name, obj in self.objects.items():
-            current_state = obj.get_current_state()
-            for field_name, field_value in current_state.items():
-                self.histories[f'{obj_name}_{field_name}'].append(field_value)
+        step = self.step
+        stride = self.stride
+        recorded_bytes = 0
+        for obj, field_name, every, history, sample_cost in self._recorders:
+            interval = every * stride
+            if interval == 1 or step % interval == 0:
+                history.append(getattr(obj, field_name))
+                recorded_bytes += sample_cost
+        self.step += 1
+        self._memory_usage += recorded_bytes
+
+        if self.memory_budget is not None and self._memory_usage > self.memory_budget:
+            self.coarsen()
                 
     def flush_histories(self):
-        for tracked_field_name in self.histories.keys():
-            self.histories[tracked_field_name] = []
+        for history in self.histories.values():
+            history.clear()
+        self.step = 0
+        self._memory_usage = self.get_memory_usage()
+
+    def get_interval(self, tracked_field_name: str) -> int:
+        """Return the number of steps between two recorded samples of a field."""
+        return self.intervals[tracked_field_name] * self.stride
+
+    def get_memory_usage(self) -> int:
+        """Return the estimated memory held by the recorded samples, in bytes."""
+        return sum(history.nbytes if hasattr(history, 'nbytes') else len(history) * self.BYTES_PER_SAMPLE
+                   for history in self.histories.values())
+
+    def _get_sample_cost(self, history) -> int:
+        """Memory added by recording one sample; compressed columns only grow when a block is flushed, see on_flush."""
+        if hasattr(history, 'on_flush'):
+            return 0
+        return getattr(history, 'sample_nbytes', self.BYTES_PER_SAMPLE)
+
+    def _add_memory_usage(self, nbytes: int):
+        self._memory_usage += nbytes
+
+    def plan_recording(self, iter_num: int):
+        """
+        Prepare the columns for recording iter_num more steps: within the memory budget the stride
+        is chosen so that samples stay uniformly spaced over the whole run, and columns that can
+        reserve memory do so for the expected number of samples.
+        """
+        if not self._recorders:
+            return
+        self._memory_usage = self.get_memory_usage()
+        if self.memory_budget is not None:
+            self._plan_stride(iter_num)
+        for _, _, every, history, _ in self._recorders:
+            if hasattr(history, 'reserve'):
+                history.reserve(len(history) + math.ceil((iter_num + 1) / (every * self.stride)))
+
+    def _plan_stride(self, iter_num: int):
+        samples_per_step = sum(1.0 / every for _, _, every, _, _ in self._recorders)
+
+        # Compressed columns hold a fixed block buffer and at most the raw size of each sample
+        fixed_bytes = sum(getattr(history, 'buffer_nbytes', 0) for history in self.histories.values())
+        sample_bytes = max(getattr(history, 'sample_nbytes', self.BYTES_PER_SAMPLE) for history in self.histories.values())
+        budget_samples = max(self.memory_budget - fixed_bytes, 0) // sample_bytes
+        if budget_samples < 2 * len(self._recorders):
+            raise ValueError(f'A memory budget of {self.memory_budget} bytes cannot hold two samples '
+                             f'of each of the {len(self._recorders)} tracked fields.')
+
+        if not any(self.histories.values()):
+            self.stride = max(self.stride, math.ceil((iter_num + 1) * samples_per_step / budget_samples))
+            return
+
+        # Already recorded samples can only be coarsened by halving to stay uniformly spaced
+        while (sum(len(history) for history in self.histories.values()) +
+               (iter_num + 1) * samples_per_step / self.stride > budget_samples):
+            self.coarsen()
+
+    def coarsen(self):
+        """Halve the resolution of everything recorded so far and of everything recorded from now on."""
+        for history in self.histories.values():
+            history[:] = history[::2]
+        self.stride *= 2
+        self._memory_usage = self.get_memory_usage()
 
     def display_histories(self):
         for key, values in self.histories.items():
             print(f"{key}: {values}")
         
     def get_histories(self):
-        return self.histories    
\ No newline at end of file
+        return self.histories
+
+    def _select_fields(self, fields: list = None) -> list:
+        """Return the requested tracked fields, all of which must share one recording interval."""
+        if fields is None:
+            time_field = self.metadata.get('time_field')
+            fields = [key for key in self.histories if key != time_field]
+        unknown = [key for key in fields if key not in self.histories]
+        if unknown:
+            raise KeyError(f'The fields {unknown} are not recorded')
+        if len({self.get_interval(key) for key in fields}) > 1:
+            raise ValueError('The selected fields are recorded at different intervals; '
+                             'export fields that share an interval together.')
+        return list(fields)
+
+    def _get_array(self, tracked_field_name: str) -> np.ndarray:
+        """Return a column as a float64 array, without copying if the column is an ArrayColumn."""
+        return np.asarray(self.histories[tracked_field_name], dtype=np.float64)
+
+    def get_time(self, tracked_field_name: str) -> np.ndarray:
+        """Return the time of every recorded sample of a field."""
+        interval = self.get_interval(tracked_field_name)
+        length = len(self.histories[tracked_field_name])
+        time_field = self.metadata.get('time_field')
+        if (time_field in self.histories and self.get_interval(time_field) == interval and
+                len(self.histories[time_field]) == length):
+            return self._get_array(time_field)
+        if 'time_step' not in self.metadata:
+            raise ValueError(f'Cannot reconstruct the time of {tracked_field_name}: no time is recorded '
+                             f'at its interval and the time step is unknown.')
+        return self.metadata.get('start_time', 0.0) + self.metadata['time_step'] * interval * np.arange(length)
+
+    def to_numpy(self, fields: list = None) -> dict:
+        """
+        Export fields as float64 arrays, together with their 'time'.
+
+        Columns stored as ArrayColumns are returned as views; lists and compressed
+        columns are converted. fields defaults to every recorded field but the time.
+        """
+        fields = self._select_fields(fields)
+        arrays = {'time': self.get_time(fields[0]) if fields else np.zeros(0)}
+        for key in fields:
+            arrays[key] = self._get_array(key)
+        return arrays
+
+    def to_pandas(self, fields: list = None):
+        """
+        Export fields as a pandas DataFrame indexed by time. The generating configuration
+        and the units are stored in DataFrame.attrs.
+        """
+        import pandas as pd
+
+        arrays = self.to_numpy(fields)
+        time = arrays.pop('time')
+        data_frame = pd.DataFrame(arrays, index=pd.Index(time, name='time', copy=False), copy=False)
+        data_frame.attrs['metadata'] = self.metadata
+        data_frame.attrs['units'] = {key: self.units.get(key, '') for key in arrays}
+        return data_frame
+
+    def to_arrow(self, fields: list = None):
+        """
+        Export fields as a pyarrow Table with a leading 'time' column. The generating
+        configuration is stored in the schema metadata and the units in the field metadata.
+        """
+        import pyarrow as pa
+
+        arrays = self.to_numpy(fields)
+        time_unit = self.units.get(self.metadata.get('time_field'), 's')
+        schema_fields = [pa.field(key, pa.float64(), nullable=False,
+                                  metadata={'unit': time_unit if key == 'time' else self.units.get(key, '')})
+                         for key in arrays]
+        schema = pa.schema(schema_fields, metadata={'metadata': json.dumps(self.metadata, default=str)})
+        return pa.Table.from_arrays([pa.array(values) for values in arrays.values()], schema=schema)
+
+    def resolve_field(self, tracked_field_name: str):
+        """Return the (object, field_name) pair behind a tracked field name such as 'Vesicle_pH'."""
+        for obj_name, obj in self.objects.items():
+            field_name = tracked_field_name[len(obj_name) + 1:]
+            if tracked_field_name.startswith(f'{obj_name}_') and hasattr(obj, field_name):
+                return obj, field_name
+        raise KeyError(f'No registered object has the field {tracked_field_name}')    
\ No newline at end of file
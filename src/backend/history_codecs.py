@@ -0,0 +1,380 @@
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class HistoryCodec:
+    """
+    Encodes blocks of float64 samples to bytes and back.
+
+    Parameters:
+    ----------
+    precision : str, optional
+        'float64' (default) keeps the samples exactly; 'float32' downcasts them
+        before encoding, halving their size at the cost of ~7 significant digits.
+    """
+
+    PRECISIONS = {'float64': (np.float64, np.int64), 'float32': (np.float32, np.int32)}
+
+    def __init__(self, precision: str = 'float64'):
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}. Expected one of {tuple(self.PRECISIONS)}.")
+        self.precision = precision
+        self.float_type, self.int_type = self.PRECISIONS[precision]
+
+    def encode(self, values: np.ndarray) -> bytes:
+        return np.ascontiguousarray(values, dtype=self.float_type).tobytes()
+
+    def decode(self, data: bytes, count: int) -> np.ndarray:
+        return np.frombuffer(data, dtype=self.float_type, count=count).astype(np.float64)
+
+    @staticmethod
+    def _shuffle(integers: np.ndarray) -> bytes:
+        """Group the bytes by significance so that the block compressor sees long runs of equal bytes."""
+        return integers.view(np.uint8).reshape(-1, integers.itemsize).T.tobytes()
+
+    def _unshuffle(self, data: bytes, count: int) -> np.ndarray:
+        width = np.dtype(self.int_type).itemsize
+        planes = np.frombuffer(data, dtype=np.uint8, count=count * width).reshape(width, count)
+        return np.ascontiguousarray(planes.T).view(self.int_type).reshape(count)
+
+
+class DeltaCodec(HistoryCodec):
+    """
+    Stores the differences between the bit patterns of consecutive samples.
+
+    Neighbouring samples of a slowly changing series have nearly equal bit
+    patterns, so the differences are small integers that compress well; for
+    smooth series the second differences (order=2, the default) are smaller
+    still. The integer arithmetic wraps around, which makes the encoding
+    exactly reversible.
+    """
+
+    def __init__(self, precision: str = 'float64', order: int = 2):
+        super().__init__(precision)
+        if order < 1:
+            raise ValueError(f"The delta order must be at least 1, got {order}.")
+        self.order = order
+
+    def encode(self, values: np.ndarray) -> bytes:
+        deltas = np.ascontiguousarray(values, dtype=self.float_type).view(self.int_type)
+        for _ in range(self.order):
+            deltas = np.diff(deltas, prepend=self.int_type(0))
+        return self._shuffle(deltas)
+
+    def decode(self, data: bytes, count: int) -> np.ndarray:
+        integers = self._unshuffle(data, count)
+        with np.errstate(over='ignore'):
+            for _ in range(self.order):
+                integers = np.cumsum(integers, dtype=self.int_type)
+        return integers.view(self.float_type).astype(np.float64)
+
+
+class XorCodec(HistoryCodec):
+    """
+    Stores the XOR of the bit patterns of consecutive samples, as in Gorilla-style
+    time series compression. Equal leading bits of neighbouring samples become zeros.
+    """
+
+    def encode(self, values: np.ndarray) -> bytes:
+        integers = np.ascontiguousarray(values, dtype=self.float_type).view(self.int_type)
+        xored = integers.copy()
+        xored[1:] ^= integers[:-1]
+        return self._shuffle(xored)
+
+    def decode(self, data: bytes, count: int) -> np.ndarray:
+        xored = self._unshuffle(data, count)
+        integers = np.bitwise_xor.accumulate(xored)
+        return integers.view(self.float_type).astype(np.float64)
+
+
+class HistoryStorageConfig:
+    """
+    Selects how HistoriesStorage keeps its columns.
+
+    Without a storage config histories are plain Python lists. With one, every
+    column is a CompressedColumn: samples are gathered into fixed-size blocks,
+    and each full block is encoded by the column's codec and compressed with
+    zlib, in memory or, if spill_directory is set, in one file per column.
+    With compress=False every column is an ArrayColumn, a single float64
+    buffer that exporters can share without copying.
+
+    Parameters:
+    ----------
+    codec : HistoryCodec, optional
+        Codec for all columns. Default is a lossless DeltaCodec.
+    field_codecs : dict, optional
+        Maps tracked field names, e.g. 'Vesicle_area', to codecs overriding the default.
+    block_size : int, optional
+        Number of samples per block. Default is 4096.
+    compression_level : int, optional
+        zlib compression level, 0 to 9. Default is 6.
+    spill_directory : str, optional
+        Directory in which the encoded blocks are written instead of kept in memory.
+    compress : bool, optional
+        Store compressed blocks (default) or uncompressed ArrayColumns.
+    """
+
+    DEFAULT_BLOCK_SIZE = 4096
+    DEFAULT_COMPRESSION_LEVEL = 6
+
+    def __init__(self,
+                 *,
+                 codec: HistoryCodec = None,
+                 field_codecs: dict = None,
+                 block_size: int = None,
+                 compression_level: int = None,
+                 spill_directory: str = None,
+                 compress: bool = True):
+        self.codec = codec if codec is not None else DeltaCodec()
+        self.field_codecs = field_codecs if field_codecs is not None else {}
+        self.block_size = block_size if block_size is not None else self.DEFAULT_BLOCK_SIZE
+        self.compression_level = compression_level if compression_level is not None else self.DEFAULT_COMPRESSION_LEVEL
+        self.spill_directory = spill_directory
+        self.compress = compress
+
+    def create_column(self, tracked_field_name: str):
+        if not self.compress:
+            return ArrayColumn()
+        spill_path = None
+        if self.spill_directory is not None:
+            os.makedirs(self.spill_directory, exist_ok=True)
+            spill_path = os.path.join(self.spill_directory, f'{tracked_field_name}.blocks')
+        return CompressedColumn(codec=self.field_codecs.get(tracked_field_name, self.codec),
+                                block_size=self.block_size,
+                                compression_level=self.compression_level,
+                                spill_path=spill_path)
+
+
+class CompressedColumn:
+    """
+    An append-only column of samples stored as compressed blocks.
+
+    The column behaves like a read-only sequence: indexing with an integer
+    returns a float and slicing returns a float64 array. Only the blocks that
+    overlap the requested range are decompressed, and the most recently
+    decoded blocks are cached.
+    """
+
+    DECODED_CACHE_SIZE = 4
+    # Memory of the index entry of a block spilled to disk
+    SPILLED_BLOCK_NBYTES = 16
+
+    def __init__(self,
+                 *,
+                 codec: HistoryCodec,
+                 block_size: int,
+                 compression_level: int,
+                 spill_path: str = None):
+        self.codec = codec
+        self.block_size = block_size
+        self.compression_level = compression_level
+        self.spill_path = spill_path
+        self._blocks = []   # bytes in memory, or (offset, size) in the spill file
+        self._blocks_nbytes = 0
+        # Called with the memory a flushed block adds, so an owner can keep a running total
+        self.on_flush = None
+        # The block being filled keeps the stored precision, so samples read the same before and after a flush
+        self._tail = np.empty(block_size, dtype=codec.float_type)
+        self._tail_length = 0
+        self._decoded = OrderedDict()
+        if spill_path is not None:
+            open(spill_path, 'wb').close()
+
+    def __len__(self):
+        return len(self._blocks) * self.block_size + self._tail_length
+
+    def append(self, value: float):
+        self._tail[self._tail_length] = value
+        self._tail_length += 1
+        if self._tail_length == self.block_size:
+            self._flush_tail()
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self._blocks = []
+        self._blocks_nbytes = 0
+        self._tail_length = 0
+        self._decoded.clear()
+        if self.spill_path is not None:
+            open(self.spill_path, 'wb').close()
+
+    def _flush_tail(self):
+        data = zlib.compress(self.codec.encode(self._tail), self.compression_level)
+        if self.spill_path is None:
+            self._blocks.append(data)
+        else:
+            with open(self.spill_path, 'ab') as spill_file:
+                offset = spill_file.tell()
+                spill_file.write(data)
+            self._blocks.append((offset, len(data)))
+        block_nbytes = len(data) if self.spill_path is None else self.SPILLED_BLOCK_NBYTES
+        self._blocks_nbytes += block_nbytes
+        self._tail_length = 0
+        if self.on_flush is not None:
+            self.on_flush(block_nbytes)
+
+    def _read_block(self, block_index: int) -> np.ndarray:
+        if block_index == len(self._blocks):
+            return self._tail[:self._tail_length]
+        if block_index in self._decoded:
+            self._decoded.move_to_end(block_index)
+            return self._decoded[block_index]
+
+        block = self._blocks[block_index]
+        if isinstance(block, tuple):
+            offset, size = block
+            with open(self.spill_path, 'rb') as spill_file:
+                spill_file.seek(offset)
+                block = spill_file.read(size)
+        values = self.codec.decode(zlib.decompress(block), self.block_size)
+
+        self._decoded[block_index] = values
+        if len(self._decoded) > self.DECODED_CACHE_SIZE:
+            self._decoded.popitem(last=False)
+        return values
+
+    def __getitem__(self, index):
+        length = len(self)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(length)
+            positions = np.arange(start, stop, step)
+            result = np.empty(len(positions), dtype=np.float64)
+            if len(positions) == 0:
+                return result
+            block_indices = positions // self.block_size
+            for block_index in np.unique(block_indices):
+                selected = block_indices == block_index
+                result[selected] = self._read_block(int(block_index))[positions[selected] - block_index * self.block_size]
+            return result
+
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('CompressedColumn index out of range')
+        return float(self._read_block(index // self.block_size)[index % self.block_size])
+
+    def __setitem__(self, index, values):
+        """Only whole-column assignment, column[:] = values, is supported."""
+        if index != slice(None):
+            raise TypeError('CompressedColumn only supports replacing its whole content')
+        values = np.asarray(values, dtype=np.float64)
+        self.clear()
+        self.extend(values.tolist())
+
+    def __iter__(self):
+        for block_index in range(len(self._blocks) + 1):
+            yield from self._read_block(block_index).tolist()
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+    def tolist(self) -> list:
+        return self[:].tolist()
+
+    @property
+    def buffer_nbytes(self) -> int:
+        """Fixed memory of the block being filled."""
+        return self._tail.nbytes
+
+    @property
+    def sample_nbytes(self) -> int:
+        """Upper bound of the memory of one stored sample, before compression."""
+        return np.dtype(self.codec.float_type).itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column; blocks spilled to disk only cost their index entry."""
+        return self._blocks_nbytes + self._tail.nbytes
+
+
+class ArrayColumn:
+    """
+    An append-only float64 column backed by a single growable NumPy buffer.
+
+    Slices are views into the buffer, so exporting the column to NumPy, pandas
+    or Arrow does not copy the samples. Reserving the expected number of
+    samples before a run avoids any reallocation while recording.
+    """
+
+    DEFAULT_CAPACITY = 1024
+
+    def __init__(self, capacity: int = None):
+        self._buffer = np.empty(capacity if capacity is not None else self.DEFAULT_CAPACITY, dtype=np.float64)
+        self._length = 0
+
+    @classmethod
+    def wrap(cls, values: np.ndarray):
+        """Return a column over an existing float64 array, e.g. one in shared memory, without copying it."""
+        if values.dtype != np.float64 or values.ndim != 1:
+            raise TypeError('ArrayColumn can only wrap one-dimensional float64 arrays')
+        column = cls.__new__(cls)
+        column._buffer = values
+        column._length = len(values)
+        return column
+
+    def __len__(self):
+        return self._length
+
+    def reserve(self, capacity: int):
+        if capacity > len(self._buffer):
+            buffer = np.empty(capacity, dtype=np.float64)
+            buffer[:self._length] = self._buffer[:self._length]
+            self._buffer = buffer
+
+    def append(self, value: float):
+        if self._length == len(self._buffer):
+            self.reserve(2 * len(self._buffer) + 1)
+        self._buffer[self._length] = value
+        self._length += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.reserve(self._length + len(values))
+        self._buffer[self._length:self._length + len(values)] = values
+        self._length += len(values)
+
+    def clear(self):
+        self._length = 0
+
+    @property
+    def values(self) -> np.ndarray:
+        """A view of the recorded samples."""
+        return self._buffer[:self._length]
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __setitem__(self, index, values):
+        """Only whole-column assignment, column[:] = values, is supported."""
+        if index != slice(None):
+            raise TypeError('ArrayColumn only supports replacing its whole content')
+        values = np.array(values, dtype=np.float64)
+        self.clear()
+        self.extend(values)
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return self.values if dtype is None else self.values.astype(dtype, copy=False)
+
+    def tolist(self) -> list:
+        return self.values.tolist()
+
+    @property
+    def sample_nbytes(self) -> int:
+        return self._buffer.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the recorded samples."""
+        return self._length * self._buffer.itemsize
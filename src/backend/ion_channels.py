@@ -2,6 +2,7 @@ from math import exp, log
 
 from .trackable import Trackable
 from .flux_calculation_parameters import FluxCalculationParameters
+from .gating_tables import GatingTable
 # from .ion_species2 import IonSpecies
 
 from typing import TYPE_CHECKING
@@ -13,6 +14,7 @@ class IonChannelConfig(Trackable):
     
 
     TRACKABLE_FIELDS = ('conductance',)
+    FIELD_UNITS = {'conductance': 'mol/(s*V*m^2)'}
     
     def __init__(self, 
                  *,
@@ -53,15 +55,27 @@ class IonChannelConfig(Trackable):
         self.use_free_hydrogen = use_free_hydrogen        
 
 class IonChannel(Trackable):
+
+    __slots__ = ('display_name', 'config', 'primary_ion_species', 'secondary_ion_species',
+                 'pH_dependence', 'voltage_dependence', 'time_dependence',
+                 'pH_exponent', 'half_act_pH', 'voltage_exponent', 'half_act_voltage',
+                 'time_exponent', 'half_act_time', 'flux', 'nernst_potential',
+                 'voltage_table', 'pH_table')
     
     TRACKABLE_FIELDS = ('flux', 'nernst_potential')
+    FIELD_UNITS = {'flux': 'mol/s', 'nernst_potential': 'V', 'pH_dependence': '', 'voltage_dependence': ''}
+
+    DEPENDENCE_PARAMETERS = ('pH_exponent', 'half_act_pH', 'voltage_exponent', 'half_act_voltage',
+                             'time_exponent', 'half_act_time')
 
     def __init__(self,
                  *,
                  config: IonChannelConfig,
+                 dependence_parameters: dict = None,
                  **kwargs):
         """
-        Initializes an IonChannel instance.
+        Initializes an IonChannel instance. dependence_parameters, e.g. from get_dependence_parameters()
+        of a channel with the same config, are set instead of configuring them from the config.
         """          
         super().__init__(**kwargs)
         self.config = config
@@ -74,9 +88,32 @@ class IonChannel(Trackable):
         self.pH_dependence = None
         self.voltage_dependence = None
         self.time_dependence = None
+
+        # Initialize dependence parameters, set below for the configured dependence types
+        self.pH_exponent = None
+        self.half_act_pH = None
+        self.voltage_exponent = None
+        self.half_act_voltage = None
+        self.time_exponent = None
+        self.half_act_time = None
+
+        # Tabulated gating curves, see use_gating_tables
+        self.voltage_table = None
+        self.pH_table = None
+
+        # Initialize the results of the last flux computation
+        self.flux = None
+        self.nernst_potential = None
         
         # Configure dependence parameters based on the config settings
-        self.configure_dependence_parameters()
+        if dependence_parameters is None:
+            self.configure_dependence_parameters()
+        else:
+            for name, value in dependence_parameters.items():
+                setattr(self, name, value)
+
+    def get_dependence_parameters(self) -> dict:
+        return {name: getattr(self, name) for name in self.DEPENDENCE_PARAMETERS}
 
     def configure_dependence_parameters(self):
         """Set parameters dynamically based on dependence types in the config."""
@@ -120,8 +157,31 @@ class IonChannel(Trackable):
             self.time_exponent = 0.0
             self.half_act_time = 0.0
 
+    def use_gating_tables(self,
+                          *,
+                          voltage_range: tuple = (-0.5, 0.5),
+                          pH_range: tuple = (0.0, 14.0),
+                          max_error: float = 1e-6):
+        """
+        Evaluate the voltage and pH dependences from tables precomputed over the given ranges,
+        with an absolute error of at most max_error. Values outside the ranges use the exact formula.
+        A table is rebuilt when its exponent or half activation is changed, e.g. by a protocol.
+        """
+        if self.voltage_exponent is not None and self.half_act_voltage is not None:
+            self.voltage_table = GatingTable(exponent=self.voltage_exponent, half_activation=self.half_act_voltage,
+                                             lower=voltage_range[0], upper=voltage_range[1], max_error=max_error)
+        if self.pH_exponent is not None and self.half_act_pH is not None:
+            self.pH_table = GatingTable(exponent=self.pH_exponent, half_activation=self.half_act_pH,
+                                        lower=pH_range[0], upper=pH_range[1], max_error=max_error)
+
     def compute_pH_dependence(self, pH: float):
         """Compute the pH dependence."""
+        if self.pH_table is not None:
+            if not self.pH_table.matches(self.pH_exponent, self.half_act_pH):
+                self.pH_table = self._rebuild_table(self.pH_table, self.pH_exponent, self.half_act_pH)
+        if self.pH_table is not None:
+            self.pH_dependence = self.pH_table(pH)
+            return self.pH_dependence
         if self.pH_exponent is None or self.half_act_pH is None:
             raise ValueError("pH dependence parameters are not set.")
         self.pH_dependence = 1.0 / (1.0 + exp(self.pH_exponent * (pH - self.half_act_pH)))
@@ -129,11 +189,23 @@ class IonChannel(Trackable):
 
     def compute_voltage_dependence(self, voltage: float):
         """Compute the voltage dependence."""
+        if self.voltage_table is not None:
+            if not self.voltage_table.matches(self.voltage_exponent, self.half_act_voltage):
+                self.voltage_table = self._rebuild_table(self.voltage_table, self.voltage_exponent, self.half_act_voltage)
+        if self.voltage_table is not None:
+            self.voltage_dependence = self.voltage_table(voltage)
+            return self.voltage_dependence
         if self.voltage_exponent is None or self.half_act_voltage is None:
             raise ValueError("Voltage dependence parameters are not set.")
         self.voltage_dependence = 1.0 / (1.0 + exp(self.voltage_exponent * (voltage - self.half_act_voltage)))
         return self.voltage_dependence
 
+    @staticmethod
+    def _rebuild_table(table: GatingTable, exponent: float, half_activation: float):
+        if exponent is None or half_activation is None:
+            return None
+        return table.rebuild(exponent=exponent, half_activation=half_activation)
+
     def compute_time_dependence(self, time: float):
         """Compute the time dependence."""
         if self.time_exponent is None or self.half_act_time is None:
@@ -4,7 +4,11 @@ from .flux_calculation_parameters import FluxCalculationParameters
 
 class IonSpecies(Trackable):
 
+    __slots__ = ('display_name', 'init_vesicle_conc', 'exterior_conc', 'elementary_charge',
+                 'channels', 'vesicle_conc', 'vesicle_amount')
+
     TRACKABLE_FIELDS = ('vesicle_conc', 'vesicle_amount')
+    FIELD_UNITS = {'vesicle_conc': 'mol/L', 'vesicle_amount': 'mol', 'exterior_conc': 'mol/L'}
 
     def __init__(self,
                  *, 
@@ -50,11 +54,12 @@ class IonSpecies(Trackable):
         self.channels.append(channel)
 
     def compute_total_flux(self, 
-                           flux_calculation_parameters: FluxCalculationParameters
+                           flux_calculation_parameters: FluxCalculationParameters,
+                           channels: list = None
                            ):
-        """Compute the total flux across all connected channels."""
+        """Compute the total flux across all connected channels, or across the given subset of them."""
         total_flux = 0.0
-        for channel in self.channels:
+        for channel in (channels if channels is not None else self.channels):
             flux = channel.compute_flux(flux_calculation_parameters)
             total_flux += flux
         return total_flux
@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import collections
+import getpass
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .scenarios import Scenario
+from .result_store import ResultStore
+
+
+def run_job(job_id: str, key: str, scenario_data: dict, store_root: str, progress_queue=None) -> str:
+    """Run one scenario in a worker process and save its results; returns the result path."""
+    scenario = Scenario.from_dict(scenario_data)
+    simulation = scenario.build_simulation()
+    progress_callback = None
+    if progress_queue is not None:
+        def progress_callback(fraction):
+            progress_queue.put((job_id, fraction))
+    simulation.run(progress_callback=progress_callback)
+    return ResultStore(store_root).save(key, simulation.histories,
+                                        scenario=scenario_data,
+                                        reductions=simulation.get_reductions(),
+                                        events=simulation.get_event_occurrences())
+
+
+class Job:
+    TERMINAL_STATES = ('done', 'failed', 'cancelled')
+
+    def __init__(self, *, job_id: str, key: str, scenario: dict, priority: int, user: str):
+        self.job_id = job_id
+        self.key = key
+        self.scenario = scenario
+        self.priority = priority
+        self.user = user
+        self.status = 'queued'
+        self.progress = 0.0
+        self.path = None
+        self.error = None
+        self.share = 0
+        self.watchers = []
+
+    def describe(self) -> dict:
+        return {'job_id': self.job_id, 'key': self.key, 'status': self.status, 'progress': self.progress,
+                'priority': self.priority, 'user': self.user, 'path': self.path, 'error': self.error}
+
+
+class JobServer:
+    """
+    A local simulation service: scenarios are submitted over a localhost TCP
+    socket, queued by priority and run on a bounded pool of worker processes.
+
+    The protocol is one JSON object per line. Requests have an 'op':
+    'submit' (with 'scenario', optional 'priority' and 'user'), 'status',
+    'watch' and 'cancel' (with 'job_id'), 'list' and 'shutdown'. 'watch'
+    streams the job's progress until it finishes. Results are written to a
+    ResultStore and replies carry the path of the result directory. Invalid
+    requests are answered with {'status': 'error', 'error': message}.
+
+    Higher priorities run first. Among equal priorities the jobs of different
+    users are interleaved, so one user's batch does not hold everyone else's
+    runs back: a job is ranked by the number of jobs its user already had
+    queued or running when it was submitted. A submission identical to a
+    queued or running job is attached to that job, and one whose results are
+    already stored completes at once. Only the last retained_jobs finished
+    jobs are kept for 'status' and 'list'.
+
+    Parameters:
+    ----------
+    store_root : str
+        Directory of the result store.
+    max_workers : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    host : str, optional
+        Default is 127.0.0.1.
+    port : int, optional
+        Default is 8765; 0 picks a free port, available as server.port after start().
+    retained_jobs : int, optional
+        Number of finished jobs kept. Default is 1000.
+    """
+
+    DEFAULT_HOST = '127.0.0.1'
+    DEFAULT_PORT = 8765
+    DEFAULT_RETAINED_JOBS = 1000
+
+    def __init__(self,
+                 store_root: str,
+                 *,
+                 max_workers: int = None,
+                 host: str = None,
+                 port: int = None,
+                 retained_jobs: int = None):
+        self.store = ResultStore(store_root)
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.host = host if host is not None else self.DEFAULT_HOST
+        self.port = port if port is not None else self.DEFAULT_PORT
+        self.retained_jobs = retained_jobs if retained_jobs is not None else self.DEFAULT_RETAINED_JOBS
+        self.jobs = {}
+        self._finished = collections.deque()
+        self._active_by_key = {}
+        self._queue = []
+        self._started = set()
+        self._user_active_jobs = {}
+        self._sequence = itertools.count()
+        self._job_ids = itertools.count(1)
+        self._server = None
+        self._client_tasks = set()
+        self._job_tasks = set()
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        self._progress_thread = None
+        self._dispatcher = None
+        self._queue_changed = None
+        self._slots = None
+        self._stopped = None
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue_changed = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._stopped = asyncio.Event()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._manager = multiprocessing.Manager()
+        self._progress_queue = self._manager.Queue()
+        self._progress_thread = threading.Thread(target=self._forward_progress, daemon=True)
+        self._progress_thread.start()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._stopped.wait()
+        await self.stop()
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        for task in list(self._client_tasks):
+            task.cancel()
+        await asyncio.gather(*self._client_tasks, return_exceptions=True)
+        self._dispatcher.cancel()
+        for task in list(self._job_tasks):
+            task.cancel()
+        await asyncio.gather(self._dispatcher, *self._job_tasks, return_exceptions=True)
+        # Waiting for the running jobs would block the event loop
+        await self._loop.run_in_executor(None, self._shutdown_workers)
+        self._stopped.set()
+
+    def _shutdown_workers(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._progress_queue.put(None)
+        self._progress_thread.join()
+        self._manager.shutdown()
+
+    # Scheduling
+
+    def submit(self, scenario: dict, *, priority: int = 0, user: str = '') -> dict:
+        scenario_object = Scenario.from_dict(scenario)
+        # Building the simulation checks the configs and the model, so that a bad job is rejected to the client
+        scenario_object.build_simulation()
+        scenario, key = scenario_object.to_dict(), scenario_object.key()
+
+        if key in self._active_by_key:
+            job = self._active_by_key[key]
+            if job.status == 'queued' and priority > job.priority:
+                job.priority = priority
+                self._push(job)
+            return dict(job.describe(), deduplicated=True)
+
+        job = Job(job_id=str(next(self._job_ids)), key=key, scenario=scenario, priority=priority, user=user)
+        self.jobs[job.job_id] = job
+        if self.store.has(key):
+            job.status = 'done'
+            job.progress = 1.0
+            job.path = self.store.path_for(key)
+            self._retire(job)
+            return dict(job.describe(), cached=True)
+
+        # The number of queued and running jobs of the same user interleaves users of equal priority
+        job.share = self._user_active_jobs.get(user, 0)
+        self._user_active_jobs[user] = job.share + 1
+        self._active_by_key[key] = job
+        self._push(job)
+        return job.describe()
+
+    def _push(self, job: Job):
+        heapq.heappush(self._queue, (-job.priority, job.share, next(self._sequence), job))
+        self._queue_changed.set()
+
+    def _retire(self, job: Job):
+        """Release the user's share of a finished job and forget the oldest finished jobs beyond retained_jobs."""
+        if self._active_by_key.get(job.key) is job:
+            del self._active_by_key[job.key]
+            remaining = self._user_active_jobs[job.user] - 1
+            if remaining:
+                self._user_active_jobs[job.user] = remaining
+            else:
+                del self._user_active_jobs[job.user]
+        self._finished.append(job.job_id)
+        while len(self._finished) > self.retained_jobs:
+            job_id = self._finished.popleft()
+            self.jobs.pop(job_id, None)
+            self._started.discard(job_id)
+
+    async def _next_job(self) -> Job:
+        while True:
+            while self._queue:
+                _, _, _, job = heapq.heappop(self._queue)
+                # Jobs that were cancelled or re-queued with a higher priority leave stale entries
+                if job.status == 'queued' and job.job_id not in self._started:
+                    return job
+            self._queue_changed.clear()
+            await self._queue_changed.wait()
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            job = await self._next_job()
+            self._started.add(job.job_id)
+            # The loop only keeps weak references to tasks
+            task = asyncio.create_task(self._run(job))
+            self._job_tasks.add(task)
+            task.add_done_callback(self._job_tasks.discard)
+
+    async def _run(self, job: Job):
+        self._set_status(job, 'running')
+        try:
+            job.path = await self._loop.run_in_executor(self._executor, run_job, job.job_id, job.key,
+                                                        job.scenario, self.store.root, self._progress_queue)
+            job.progress = 1.0
+            self._set_status(job, 'done')
+        except asyncio.CancelledError:
+            self._set_status(job, 'cancelled')
+            raise
+        except Exception as error:
+            job.error = f'{type(error).__name__}: {error}'
+            self._set_status(job, 'failed')
+        finally:
+            self._retire(job)
+            self._slots.release()
+
+    def cancel(self, job_id: str) -> dict:
+        job = self._get_job(job_id)
+        if job.status == 'running':
+            raise RuntimeError(f'Job {job_id} is already running and cannot be cancelled')
+        if job.status == 'queued':
+            self._set_status(job, 'cancelled')
+            self._retire(job)
+        return job.describe()
+
+    def _get_job(self, job_id: str) -> Job:
+        if job_id not in self.jobs:
+            raise KeyError(f'Unknown job {job_id}')
+        return self.jobs[job_id]
+
+    # Progress
+
+    def _forward_progress(self):
+        while (item := self._progress_queue.get()) is not None:
+            self._loop.call_soon_threadsafe(self._on_progress, *item)
+
+    def _on_progress(self, job_id: str, fraction: float):
+        job = self.jobs.get(job_id)
+        if job is not None and job.status == 'running':
+            job.progress = fraction
+            self._notify(job)
+
+    def _set_status(self, job: Job, status: str):
+        job.status = status
+        self._notify(job)
+
+    def _notify(self, job: Job):
+        for watcher in job.watchers:
+            watcher.put_nowait(job.describe())
+
+    # Protocol
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if request.get('op') == 'watch':
+                        await self._watch(self._get_job(str(request.get('job_id'))), writer)
+                        continue
+                    response = self.handle_request(request)
+                except Exception as error:
+                    response = {'status': 'error', 'error': f'{type(error).__name__}: {error}'}
+                await self._send(writer, response)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._client_tasks.discard(task)
+            writer.close()
+
+    def handle_request(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'submit':
+            return self.submit(request['scenario'], priority=int(request.get('priority', 0)),
+                               user=str(request.get('user', '')))
+        if op == 'status':
+            return self._get_job(str(request.get('job_id'))).describe()
+        if op == 'cancel':
+            return self.cancel(str(request.get('job_id')))
+        if op == 'list':
+            return {'jobs': [job.describe() for job in self.jobs.values()]}
+        if op == 'shutdown':
+            self._stopped.set()
+            return {'status': 'stopping'}
+        raise ValueError(f'Unknown operation: {op}')
+
+    async def _watch(self, job: Job, writer: asyncio.StreamWriter):
+        watcher = asyncio.Queue()
+        job.watchers.append(watcher)
+        try:
+            message = job.describe()
+            while True:
+                await self._send(writer, message)
+                if message['status'] in Job.TERMINAL_STATES:
+                    return
+                message = await watcher.get()
+        finally:
+            job.watchers.remove(watcher)
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: dict):
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+
+
+class JobClient:
+    """
+    A blocking client of a JobServer.
+
+    Example:
+    -------
+    client = JobClient()
+    job = client.submit(Scenario(config={'total_time': 10.0}))
+    result = client.wait(job['job_id'], progress_callback=print)
+    """
+
+    def __init__(self, host: str = None, port: int = None, user: str = None, timeout: float = None):
+        self.host = host if host is not None else JobServer.DEFAULT_HOST
+        self.port = port if port is not None else JobServer.DEFAULT_PORT
+        self.user = user if user is not None else getpass.getuser()
+        self.timeout = timeout
+
+    def _open(self):
+        connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        return connection, connection.makefile('rb')
+
+    def request(self, message: dict) -> dict:
+        connection, stream = self._open()
+        with connection, stream:
+            connection.sendall(json.dumps(message).encode() + b'\n')
+            response = json.loads(stream.readline())
+        if response.get('status') == 'error':
+            raise RuntimeError(response['error'])
+        return response
+
+    def submit(self, scenario, priority: int = 0) -> dict:
+        scenario = scenario.to_dict() if isinstance(scenario, Scenario) else scenario
+        return self.request({'op': 'submit', 'scenario': scenario, 'priority': priority, 'user': self.user})
+
+    def status(self, job_id: str) -> dict:
+        return self.request({'op': 'status', 'job_id': job_id})
+
+    def cancel(self, job_id: str) -> dict:
+        return self.request({'op': 'cancel', 'job_id': job_id})
+
+    def list_jobs(self) -> list:
+        return self.request({'op': 'list'})['jobs']
+
+    def shutdown(self) -> dict:
+        return self.request({'op': 'shutdown'})
+
+    def wait(self, job_id: str, progress_callback=None) -> dict:
+        """Block until the job finishes, passing every progress message to progress_callback."""
+        connection, stream = self._open()
+        with connection, stream:
+            connection.sendall(json.dumps({'op': 'watch', 'job_id': job_id}).encode() + b'\n')
+            while line := stream.readline():
+                message = json.loads(line)
+                if message['status'] == 'error':
+                    raise RuntimeError(message['error'])
+                if progress_callback is not None:
+                    progress_callback(message)
+                if message['status'] in Job.TERMINAL_STATES:
+                    return message
+        raise ConnectionError(f'The server closed the connection while job {job_id} was running')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the local simulation job server.')
+    parser.add_argument('--store', default='results', help='Directory of the result store.')
+    parser.add_argument('--host', default=JobServer.DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=JobServer.DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+    arguments = parser.parse_args()
+
+    server = JobServer(arguments.store, max_workers=arguments.workers, host=arguments.host, port=arguments.port)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .model_spec import ModelSpec
+
+
+class CompiledModel:
+    """
+    The validated setup of a model topology.
+
+    Compiling connects the species and channels of a spec through the
+    validating IonSpecies.connect_channel path once and keeps the outcome:
+    for every link, in order, the species the channel is added to and the
+    species it uses as primary and secondary ion. It also keeps the gating
+    parameters that IonChannel.configure_dependence_parameters derives from
+    each channel config. Both only depend on the topology of the spec, so
+    objects instantiated from any spec with the same topology get their
+    parameters and are connected directly, without the compatibility checks.
+
+    The history layout of the simulations, which fields of which objects are
+    recorded under which names, also only depends on the topology and the
+    tracking config. The first simulation of each tracking config stores it
+    in history_layouts (in memory only) and later ones register their
+    objects with HistoriesStorage from it.
+
+    Parameters:
+    ----------
+    key : str
+        The topology key of the compiled specs.
+    connections : list
+        (species_name, channel_name, primary_name, secondary_name) tuples, in link order.
+    dependence_parameters : dict, optional
+        Maps channel names to their dependence parameters.
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, *, key: str, connections: list, dependence_parameters: dict = None):
+        self.key = key
+        self.connections = [tuple(connection) for connection in connections]
+        self.dependence_parameters = dependence_parameters
+        self.history_layouts = {}
+
+    @classmethod
+    def compile(cls, spec: ModelSpec):
+        species, channels, ion_channel_links = spec.instantiate()
+        connections = []
+        for species_name, links in ion_channel_links.get_links().items():
+            for channel_name, secondary_species_name in links:
+                channel = channels[channel_name]
+                species[species_name].connect_channel(channel=channel, secondary_species=species.get(secondary_species_name))
+                # connect_species only sets the secondary ion of two-ion channels
+                secondary = channel.secondary_ion_species if secondary_species_name is not None else None
+                connections.append((species_name, channel_name, channel.primary_ion_species.display_name,
+                                    secondary.display_name if secondary is not None else None))
+        dependence_parameters = {name: channel.get_dependence_parameters() for name, channel in channels.items()}
+        return cls(key=spec.topology_key(), connections=connections, dependence_parameters=dependence_parameters)
+
+    def connect(self, species: dict, channels: dict):
+        """Connect unconnected species and channels, e.g. from ModelSpec.instantiate(), as compiled."""
+        for species_name, channel_name, primary_name, secondary_name in self.connections:
+            channel = channels[channel_name]
+            channel.primary_ion_species = species[primary_name]
+            if secondary_name is not None:
+                channel.secondary_ion_species = species[secondary_name]
+            species[species_name].channels.append(channel)
+
+    def to_dict(self) -> dict:
+        return {'format': self.FORMAT_VERSION, 'key': self.key, 'connections': [list(c) for c in self.connections],
+                'dependence_parameters': self.dependence_parameters}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if data.get('format') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled model format {data.get('format')}.")
+        return cls(key=data['key'], connections=data['connections'], dependence_parameters=data['dependence_parameters'])
+
+
+class ModelCache:
+    """
+    Compiled models by topology key, in memory and optionally in a directory.
+
+    Simulations look their spec up here, so only the first simulation of a
+    topology pays for validating its wiring and configuring its channels. The memory cache keeps the most
+    recently used max_entries models; with a directory, compiled models are
+    also written there as JSON and shared by other processes and later sessions.
+
+    Parameters:
+    ----------
+    directory : str, optional
+        Directory of the on-disk cache. Default is None, memory only.
+    max_entries : int, optional
+        Number of models kept in memory. Default is 128.
+    """
+
+    DEFAULT_MAX_ENTRIES = 128
+
+    def __init__(self, directory: str = None, *, max_entries: int = None):
+        self.directory = directory
+        self.max_entries = max_entries if max_entries is not None else self.DEFAULT_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, spec: ModelSpec) -> CompiledModel:
+        """Return the compiled model of the spec's topology, compiling it if needed."""
+        key = spec.topology_key()
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+
+        model = self._load(key)
+        if model is None:
+            model = CompiledModel.compile(spec)
+            self._save(model)
+        with self._lock:
+            self.misses += 1
+            self._models[key] = model
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+        return model
+
+    def clear(self):
+        """Forget the models held in memory; the on-disk cache is kept."""
+        with self._lock:
+            self._models.clear()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _load(self, key: str):
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key)) as model_file:
+                model = CompiledModel.from_dict(json.load(model_file))
+        except (OSError, ValueError, KeyError):
+            # A damaged or outdated entry is compiled again and overwritten
+            return None
+        return model if model.key == key else None
+
+    def _save(self, model: CompiledModel):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name and renamed, so concurrent readers never see a partial file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as model_file:
+            json.dump(model.to_dict(), model_file)
+        os.replace(temporary_path, self._path(model.key))
+
+
+# The cache used by simulations; set model_cache.directory to keep compiled models on disk
+model_cache = ModelCache()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+from types import MappingProxyType
+
+from .ion_species import IonSpecies
+from .ion_channels import IonChannel, IonChannelConfig
+from .ion_and_channels_link import IonChannelsLink
+from .default_channels import default_channels
+from .default_ion_species import default_ion_species
+
+
+class ModelSpec:
+    """
+    An immutable description of a model: the parameters of every ion species,
+    the configuration of every channel and the links between them.
+
+    A spec holds no run state. Simulations instantiate fresh IonSpecies and
+    IonChannel objects from it, so any number of simulations, in one thread or
+    many, can share a single spec without seeing each other's state.
+
+    Parameters:
+    ----------
+    species : dict
+        Maps species names to dicts of IonSpecies arguments
+        (init_vesicle_conc, exterior_conc, elementary_charge).
+    channels : dict
+        Maps channel names to dicts of IonChannelConfig arguments.
+    links : dict
+        Maps species names to lists of (channel_name, secondary_species_name)
+        tuples, as returned by IonChannelsLink.get_links().
+    """
+
+    __slots__ = ('_species', '_channels', '_links', '_topology_key')
+
+    SPECIES_PARAMETERS = ('init_vesicle_conc', 'exterior_conc', 'elementary_charge')
+    # Parameters that only change numbers in the model; everything else is part of its topology
+    NUMERIC_SPECIES_PARAMETERS = ('init_vesicle_conc', 'exterior_conc')
+    NUMERIC_CHANNEL_PARAMETERS = ('conductance', 'voltage_multiplier', 'nernst_multiplier', 'voltage_shift', 'flux_multiplier')
+
+    def __init__(self, *, species: dict, channels: dict, links: dict):
+        frozen_species = MappingProxyType({name: MappingProxyType(dict(params)) for name, params in species.items()})
+        frozen_channels = MappingProxyType({name: MappingProxyType(dict(params)) for name, params in channels.items()})
+        frozen_links = MappingProxyType({name: tuple((channel_name, secondary_name) for channel_name, secondary_name in connections)
+                                         for name, connections in links.items()})
+
+        for species_name, connections in frozen_links.items():
+            if species_name not in frozen_species:
+                raise ValueError(f"Link refers to an unknown ion species '{species_name}'.")
+            for channel_name, secondary_name in connections:
+                if channel_name not in frozen_channels:
+                    raise ValueError(f"Link refers to an unknown channel '{channel_name}'.")
+                if secondary_name is not None and secondary_name not in frozen_species:
+                    raise ValueError(f"Link refers to an unknown ion species '{secondary_name}'.")
+
+        object.__setattr__(self, '_species', frozen_species)
+        object.__setattr__(self, '_channels', frozen_channels)
+        object.__setattr__(self, '_links', frozen_links)
+        object.__setattr__(self, '_topology_key', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable; use evolve() to derive a modified spec.")
+
+    def __reduce__(self):
+        return (self.__class__.from_dict, (self.to_dict(),))
+
+    def __eq__(self, other):
+        return isinstance(other, ModelSpec) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash(repr(self.to_dict()))
+
+    @property
+    def species(self):
+        return self._species
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def links(self):
+        return self._links
+
+    @classmethod
+    def from_objects(cls,
+                     *,
+                     species: dict,
+                     channels: dict,
+                     ion_channel_links: IonChannelsLink):
+        """Build a spec from IonSpecies objects, IonChannel or IonChannelConfig objects and a links object."""
+        species_params = {name: {parameter: getattr(obj, parameter) for parameter in cls.SPECIES_PARAMETERS}
+                           for name, obj in species.items()}
+        channel_params = {}
+        for name, obj in channels.items():
+            config = obj.config if isinstance(obj, IonChannel) else obj
+            channel_params[name] = dict(vars(config))
+        return cls(species=species_params, channels=channel_params, links=ion_channel_links.get_links())
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(species=data['species'], channels=data['channels'], links=data['links'])
+
+    def to_dict(self) -> dict:
+        """Return the spec as plain dicts and lists, e.g. for serialization."""
+        return {
+            'species': {name: dict(params) for name, params in self._species.items()},
+            'channels': {name: dict(params) for name, params in self._channels.items()},
+            'links': {name: [list(connection) for connection in connections] for name, connections in self._links.items()},
+        }
+
+    def topology(self) -> dict:
+        """
+        Return the structure of the model: the species and channels, their links and every
+        parameter that decides how they are connected or which equations they use.
+        """
+        return {
+            'species': {name: {key: value for key, value in params.items() if key not in self.NUMERIC_SPECIES_PARAMETERS}
+                        for name, params in self._species.items()},
+            'channels': {name: {key: value for key, value in params.items()
+                                if key not in self.NUMERIC_CHANNEL_PARAMETERS and key != 'display_name'}
+                         for name, params in self._channels.items()},
+            'links': {name: [list(connection) for connection in connections] for name, connections in self._links.items()},
+        }
+
+    def topology_key(self) -> str:
+        """Return a hash of the topology; specs differing only in numeric parameters share it."""
+        if self._topology_key is None:
+            # The species order is kept, as the simulation sums over the species in that order
+            content = json.dumps([list(self._species), self.topology()], sort_keys=True, default=str)
+            object.__setattr__(self, '_topology_key', hashlib.sha256(content.encode()).hexdigest()[:32])
+        return self._topology_key
+
+    def evolve(self, *, species: dict = None, channels: dict = None, links: dict = None):
+        """
+        Return a new spec with some parameters replaced.
+
+        species and channels map names to dicts of the parameters to override,
+        e.g. evolve(channels={'asor': {'conductance': 1e-4}}). Names that are not
+        in the spec are added. links, if given, replaces the links entirely.
+        """
+        new_species = {name: dict(params) for name, params in self._species.items()}
+        for name, overrides in (species or {}).items():
+            new_species.setdefault(name, {}).update(overrides)
+        new_channels = {name: dict(params) for name, params in self._channels.items()}
+        for name, overrides in (channels or {}).items():
+            new_channels.setdefault(name, {}).update(overrides)
+        spec = ModelSpec(species=new_species,
+                         channels=new_channels,
+                         links=links if links is not None else self._links)
+
+        # Sweeps derive many specs that only differ in numbers; they share the topology key
+        numeric_only = (links is None and
+                        all(name in self._species and set(overrides) <= set(self.NUMERIC_SPECIES_PARAMETERS)
+                            for name, overrides in (species or {}).items()) and
+                        all(name in self._channels and set(overrides) <= {'display_name', *self.NUMERIC_CHANNEL_PARAMETERS}
+                            for name, overrides in (channels or {}).items()))
+        if numeric_only:
+            object.__setattr__(spec, '_topology_key', self.topology_key())
+        return spec
+
+    def instantiate(self, dependence_parameters: dict = None):
+        """
+        Create fresh, unconnected run objects from the spec. dependence_parameters, if given, maps
+        channel names to their dependence parameters, e.g. from a CompiledModel of the spec's topology.
+
+        Returns:
+        -------
+        tuple
+            (species, channels, ion_channel_links): a dict of new IonSpecies, a dict of
+            new IonChannel objects each with its own IonChannelConfig, and a new IonChannelsLink.
+        """
+        species = {name: IonSpecies(display_name=name, **params) for name, params in self._species.items()}
+        dependence_parameters = dependence_parameters if dependence_parameters is not None else {}
+        channels = {name: IonChannel(config=IonChannelConfig(**params), display_name=name,
+                                     dependence_parameters=dependence_parameters.get(name))
+                    for name, params in self._channels.items()}
+        ion_channel_links = IonChannelsLink()
+        ion_channel_links.clear_links()
+        for species_name, connections in self._links.items():
+            for channel_name, secondary_name in connections:
+                ion_channel_links.add_link(species_name, channel_name, secondary_species_name=secondary_name)
+        return species, channels, ion_channel_links
+
+
+default_model_spec = ModelSpec.from_objects(species=default_ion_species,
+                                            channels=default_channels,
+                                            ion_channel_links=IonChannelsLink())
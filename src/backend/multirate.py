@@ -0,0 +1,64 @@
+class MultirateScheduler:
+    """
+    Decides when the slow processes of a multi-rate run are updated.
+
+    Between slow updates the volume, area, capacitance, buffer capacity and the
+    fluxes of slow channels are held fixed while the fast channels and the
+    charge, voltage and pH are advanced every step. The slow processes are
+    updated once every ratio steps, the update step included; the ratio is
+    either fixed or chosen from an error estimate: holding a quantity constant
+    over a macro step is a first order hold, whose error is about half of the
+    relative change of that quantity over the step. An adapted ratio is never
+    below MIN_ADAPTIVE_RATIO, as updating every step only adds the cost of the
+    estimate to a single-rate run.
+
+    Parameters:
+    ----------
+    ratio : int or str
+        Number of steps per slow update, or 'auto' to adapt it.
+    tolerance : float
+        Target relative error of the slow quantities per macro step (used with 'auto').
+    max_ratio : int
+        Upper bound of the adapted ratio.
+    """
+
+    # The ratio is never grown by more than this factor at once
+    MAX_GROWTH = 2.0
+    MIN_ADAPTIVE_RATIO = 2
+
+    def __init__(self,
+                 *,
+                 ratio=1,
+                 tolerance: float = 1e-6,
+                 max_ratio: int = 1000):
+        self.adaptive = ratio == 'auto'
+        if not self.adaptive and (not isinstance(ratio, int) or ratio < 1):
+            raise ValueError(f"The slow update ratio must be a positive integer or 'auto', got {ratio}.")
+        self.ratio = min(self.MIN_ADAPTIVE_RATIO, max_ratio) if self.adaptive else ratio
+        self.tolerance = tolerance
+        self.max_ratio = max_ratio
+        self.steps_since_slow_update = None
+        self.last_slow_state = None
+        self.error_estimate = None
+
+    def is_slow_update_due(self) -> bool:
+        return self.steps_since_slow_update is None or self.steps_since_slow_update >= self.ratio
+
+    def record_fast_step(self):
+        self.steps_since_slow_update += 1
+
+    def record_slow_update(self, slow_state: list):
+        """Register the values of the slow quantities after an update and adapt the ratio."""
+        if self.adaptive and self.last_slow_state is not None and self.steps_since_slow_update:
+            relative_change = max(abs(new - old) / max(abs(old), abs(new), 1e-300)
+                                  for old, new in zip(self.last_slow_state, slow_state))
+            self.error_estimate = 0.5 * relative_change
+            if self.error_estimate > 0:
+                proposed = self.steps_since_slow_update * self.tolerance / self.error_estimate
+            else:
+                proposed = self.max_ratio
+            proposed = min(proposed, self.MAX_GROWTH * self.steps_since_slow_update)
+            self.ratio = int(min(self.max_ratio, max(self.MIN_ADAPTIVE_RATIO, proposed)))
+        self.last_slow_state = list(slow_state)
+        # The update step is the first step of the macro step
+        self.steps_since_slow_update = 1
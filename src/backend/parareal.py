@@ -0,0 +1,195 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .scenarios import Scenario
+from .histories_storage import HistoriesStorage
+from .history_codecs import ArrayColumn
+from .shared_histories import share_histories
+
+
+def propagate(scenario: dict, state: np.ndarray, steps: int, time_step: float, record: bool = False):
+    """
+    Advance a state vector of a Scenario given as a dict by steps steps of time_step, as
+    Simulation.run does; returns the final state and, if record, the SharedHistories of
+    the steps. Top-level so that it can run in a process pool.
+    """
+    overrides = {'config.time_step': time_step, 'config.record_histories': record}
+    simulation = Scenario.from_dict(scenario).with_overrides(overrides).build_simulation()
+    simulation.get_unaccounted_ion_amount()
+    simulation.set_state(state)
+    if record:
+        simulation.histories.metadata['start_time'] = simulation.time
+        simulation.histories.plan_recording(steps)
+    for _ in range(steps):
+        simulation.run_one_iteration()
+    if not record:
+        return simulation.get_state(), None
+    return simulation.get_state(), share_histories(simulation.histories)
+
+
+class PararealSimulation:
+    """
+    Runs one long scenario in parallel in time with the Parareal method.
+
+    The run is split into time slices. A coarse propagator, the same model
+    stepped with a large time step, sweeps the whole horizon serially to
+    predict the state at every slice boundary. Fine propagators, the
+    scenario's own time step, then advance every slice from its predicted
+    initial state in parallel worker processes, and a new coarse sweep
+    corrects the boundaries:
+
+        U[j + 1] = coarse(new U[j]) + fine(old U[j]) - coarse(old U[j])
+
+    The iteration stops when the largest relative change of the ion amounts
+    and concentrations at the boundaries falls below the tolerance; after k
+    iterations the first k slices are exact, so the slices before them are
+    not run again. A last parallel fine pass records the histories of every
+    slice from the converged boundaries. With k iterations and P slices on P
+    workers, the wall time is about (k + 1) / P of a serial run plus the
+    coarse sweeps.
+
+    Multi-rate integration and memory-budgeted recording keep state outside
+    the state vector and are not supported.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The run.
+    slices : int, optional
+        Number of time slices. Default is the number of workers.
+    workers : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    coarse_time_step : float, optional
+        Time step of the coarse propagator, below the step at which the model becomes unstable. Default is 0.02 s.
+    tolerance : float, optional
+        Largest relative change of the boundary states at convergence. Default is 1e-8.
+    max_iterations : int, optional
+        Maximum number of iterations. Default is the number of slices, at which the result is exact.
+    """
+
+    DEFAULT_COARSE_TIME_STEP = 0.02
+    DEFAULT_TOLERANCE = 1e-8
+
+    def __init__(self,
+                 scenario: Scenario,
+                 *,
+                 slices: int = None,
+                 workers: int = None,
+                 coarse_time_step: float = None,
+                 tolerance: float = None,
+                 max_iterations: int = None):
+        self.scenario = scenario
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.coarse_time_step = coarse_time_step if coarse_time_step is not None else self.DEFAULT_COARSE_TIME_STEP
+        self.tolerance = tolerance if tolerance is not None else self.DEFAULT_TOLERANCE
+
+        template = scenario.build_simulation()
+        if template.config.slow_update_ratio is not None:
+            raise ValueError("Multi-rate integration is not supported by Parareal.")
+        if template.config.history_memory_budget is not None:
+            raise ValueError("Memory-budgeted recording is not supported by Parareal.")
+        self.time_step = template.config.time_step
+        self.iter_num = template.iter_num
+
+        slices = slices if slices is not None else self.workers
+        if not 1 <= slices <= self.iter_num:
+            raise ValueError(f"The number of slices must be between 1 and {self.iter_num}, got {slices}.")
+        # Slices start at multiples of every recording interval, so the joined histories stay uniformly spaced
+        alignment = math.lcm(*template.histories.intervals.values()) if template.histories.intervals else 1
+        boundaries = {min(round(self.iter_num * index / slices / alignment) * alignment, self.iter_num)
+                      for index in range(slices)}
+        self.boundaries = sorted(boundaries) + [self.iter_num]
+        self.max_iterations = max_iterations if max_iterations is not None else len(self.boundaries) - 1
+
+        # The ion amounts and the concentrations they follow are the state the steps depend on
+        self.convergence_indices = [template.state_layout.index[f'{ion.display_name}_{field}']
+                                    for ion in template.all_species for field in ('vesicle_amount', 'vesicle_conc')]
+        template.set_ion_amounts()
+        template.get_unaccounted_ion_amount()
+        self.initial_state = template.get_state()
+        self.iterations = 0
+        self.changes = []
+
+    @property
+    def slices(self) -> int:
+        return len(self.boundaries) - 1
+
+    def _coarse(self, scenario: dict, state: np.ndarray, slice_index: int) -> np.ndarray:
+        duration = (self.boundaries[slice_index + 1] - self.boundaries[slice_index]) * self.time_step
+        steps = max(1, round(duration / self.coarse_time_step))
+        return propagate(scenario, state, steps, duration / steps)[0]
+
+    def _change(self, old: list, new: list) -> float:
+        change = 0.0
+        for old_state, new_state in zip(old, new):
+            old_values, new_values = old_state[self.convergence_indices], new_state[self.convergence_indices]
+            scale = np.maximum(np.abs(new_values), np.finfo(np.float64).tiny)
+            change = max(change, float(np.max(np.abs(new_values - old_values) / scale)))
+        return change
+
+    def run(self, progress_callback=None) -> HistoriesStorage:
+        """
+        Run the scenario and return its histories, as Simulation.run. progress_callback, if given,
+        is called with the iteration and the largest relative change of the boundary states.
+        """
+        scenario = self.scenario.to_dict()
+        slices = self.slices
+        states = [self.initial_state]
+        coarse = [None] * slices
+        for index in range(slices):
+            coarse[index] = self._coarse(scenario, states[index], index)
+            states.append(coarse[index])
+
+        self.iterations = 0
+        self.changes = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for iteration in range(self.max_iterations):
+                # The first slices are exact after as many iterations
+                first = iteration
+                futures = {index: executor.submit(propagate, scenario, states[index],
+                                                  self.boundaries[index + 1] - self.boundaries[index], self.time_step)
+                           for index in range(first, slices)}
+                fine = {index: future.result()[0] for index, future in futures.items()}
+
+                new_states = states[:first + 1]
+                for index in range(first, slices):
+                    predicted = self._coarse(scenario, new_states[index], index) if index > first else coarse[index]
+                    new_states.append(predicted + fine[index] - coarse[index])
+                    coarse[index] = predicted
+                change = self._change(states[first + 1:], new_states[first + 1:])
+                states = new_states
+                self.iterations += 1
+                self.changes.append(change)
+                if progress_callback is not None:
+                    progress_callback(self.iterations, change)
+                if change <= self.tolerance:
+                    break
+
+            futures = [executor.submit(propagate, scenario, states[index],
+                                       self.boundaries[index + 1] - self.boundaries[index], self.time_step, True)
+                       for index in range(slices)]
+            shared = [future.result()[1] for future in futures]
+        return self._join(shared)
+
+    def _join(self, shared: list) -> HistoriesStorage:
+        """Concatenate the histories of the slices into one HistoriesStorage and free the shared blocks."""
+        histories = HistoriesStorage()
+        try:
+            parts = [block.attach() for block in shared]
+            first = parts[0]
+            for tracked_field_name in first.histories:
+                histories.histories[tracked_field_name] = ArrayColumn.wrap(np.concatenate(
+                    [np.asarray(part.histories[tracked_field_name]) for part in parts]))
+                histories.intervals[tracked_field_name] = first.intervals[tracked_field_name]
+            histories.units = dict(first.units)
+            histories.metadata = dict(first.metadata, parareal={'slices': self.slices,
+                                                                'iterations': self.iterations,
+                                                                'changes': self.changes})
+            del parts, first
+        finally:
+            for block in shared:
+                block.release()
+        return histories
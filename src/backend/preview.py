@@ -0,0 +1,108 @@
+import threading
+
+from .scenarios import Scenario
+from .simulation import SimulationConfig
+from .histories_storage import HistoriesStorage
+
+
+class ProgressivePreview:
+    """
+    Runs a scenario at increasing resolutions for interactive previews.
+
+    The first level uses a large time step over a short horizon, so that it
+    finishes within a fraction of a second. The following levels cover the
+    whole horizon and divide the time step by REFINEMENT_FACTOR until the
+    scenario's own time step is reached. Only the preview fields are
+    recorded, and at most max_samples samples of each, so drawing a level
+    costs the same whatever its resolution.
+
+    cancel() stops the running level within one iteration and skips the
+    remaining ones, so a preview can be abandoned as soon as a parameter changes.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The run to preview.
+    coarse_iterations : int, optional
+        Number of iterations of the first level. Default is 1000.
+    max_time_step : float, optional
+        Largest time step used, below the step at which the model becomes unstable. Default is 0.02 s.
+    fields : dict, optional
+        TrackingConfig fields selection. Default is the vesicle pH.
+    max_samples : int, optional
+        Maximum number of samples recorded per field. Default is 2000.
+    """
+
+    DEFAULT_COARSE_ITERATIONS = 1000
+    DEFAULT_MAX_TIME_STEP = 0.02
+    DEFAULT_FIELDS = {'Vesicle': ['pH']}
+    DEFAULT_MAX_SAMPLES = 2000
+    REFINEMENT_FACTOR = 4
+
+    def __init__(self,
+                 scenario: Scenario,
+                 *,
+                 coarse_iterations: int = None,
+                 max_time_step: float = None,
+                 fields: dict = None,
+                 max_samples: int = None):
+        self.scenario = scenario
+        self.coarse_iterations = coarse_iterations if coarse_iterations is not None else self.DEFAULT_COARSE_ITERATIONS
+        self.max_time_step = max_time_step if max_time_step is not None else self.DEFAULT_MAX_TIME_STEP
+        self.fields = fields if fields is not None else self.DEFAULT_FIELDS
+        self.max_samples = max_samples if max_samples is not None else self.DEFAULT_MAX_SAMPLES
+        self.cancelled = False
+        self._simulation = None
+        self._lock = threading.Lock()
+
+    def get_levels(self) -> list:
+        """Return the (time_step, total_time) of every level, coarsest first."""
+        time_step = self.scenario.config.get('time_step', SimulationConfig.DEFAULT_TIME_STEP)
+        total_time = self.scenario.config.get('total_time', SimulationConfig.DEFAULT_TOTAL_TIME)
+
+        coarse_time_step = max(time_step, min(self.max_time_step, total_time / self.coarse_iterations))
+        levels = [(coarse_time_step, min(total_time, coarse_time_step * self.coarse_iterations))]
+        if levels[0][1] < total_time:
+            levels.append((coarse_time_step, total_time))
+        level_time_step = coarse_time_step
+        while level_time_step > time_step:
+            level_time_step = max(time_step, level_time_step / self.REFINEMENT_FACTOR)
+            levels.append((level_time_step, total_time))
+        return levels
+
+    def _build_level(self, time_step: float, total_time: float):
+        tracking = dict(self.fields)
+        tracking.setdefault('simulation', ['time'])
+        field_count = sum(len(field_names) for field_names in tracking.values())
+        iterations = total_time / time_step
+        budget = None
+        if iterations > self.max_samples:
+            budget = self.max_samples * field_count * HistoriesStorage.BYTES_PER_SAMPLE
+        level = self.scenario.with_overrides({'config.time_step': time_step,
+                                              'config.total_time': total_time,
+                                              'config.history_memory_budget': budget})
+        level.tracking = tracking
+        return level.build_simulation()
+
+    def run(self, callback) -> bool:
+        """
+        Run the levels in order, calling callback(level_index, histories, is_final) after each one.
+        Returns False if the preview was cancelled.
+        """
+        levels = self.get_levels()
+        for level_index, (time_step, total_time) in enumerate(levels):
+            with self._lock:
+                if self.cancelled:
+                    return False
+                self._simulation = self._build_level(time_step, total_time)
+            histories = self._simulation.run()
+            if self._simulation.stop_requested:
+                return False
+            callback(level_index, histories, level_index == len(levels) - 1)
+        return True
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._simulation is not None:
+                self._simulation.stop()
@@ -0,0 +1,141 @@
+from bisect import bisect_right
+from typing import Callable, Sequence
+
+
+class Timeline:
+    """
+    A piecewise-constant or piecewise-linear function of time.
+
+    Before the first time point the timeline is inactive and the scheduled
+    parameter keeps whatever value it already had. After the last time point
+    the last value is held.
+
+    A timeline holds no lookup state, so it can be shared by several protocols
+    and simulations. Callers evaluating it at increasing times, as the step
+    loop does, pass the index of their previous lookup to find_index, which
+    makes each lookup O(1) amortized.
+
+    Parameters:
+    ----------
+    times : sequence of float
+        Strictly increasing time points in seconds.
+    values : sequence of float
+        The parameter value at each time point.
+    interpolation : str, optional
+        'step' (default) holds each value until the next time point; 'linear'
+        interpolates between consecutive time points.
+    """
+
+    ALLOWED_INTERPOLATIONS = ('step', 'linear')
+
+    def __init__(self,
+                 *,
+                 times: Sequence[float],
+                 values: Sequence[float],
+                 interpolation: str = 'step'):
+        if interpolation not in self.ALLOWED_INTERPOLATIONS:
+            raise ValueError(f"Unsupported interpolation: {interpolation}. Expected one of {self.ALLOWED_INTERPOLATIONS}.")
+        if len(times) == 0 or len(times) != len(values):
+            raise ValueError("A timeline needs the same, non-zero number of times and values.")
+        if any(later <= earlier for earlier, later in zip(times, times[1:])):
+            raise ValueError("Timeline times must be strictly increasing.")
+        self.times = list(times)
+        self.values = list(values)
+        self.interpolation = interpolation
+
+    def find_index(self, time: float, start: int = 0) -> int:
+        """
+        Return the index of the last time point at or before time, or -1. The search walks
+        forward from start, e.g. the index found by an earlier lookup, when it is not past time.
+        """
+        times = self.times
+        if 0 <= start < len(times) and times[start] <= time:
+            # Usual case: time moved forward by less than a few time points
+            index = start
+            while index + 1 < len(times) and times[index + 1] <= time:
+                index += 1
+            return index
+        return bisect_right(times, time) - 1
+
+    def value_at(self, time: float, index: int = None):
+        """Return the value at the given time, or None before the first time point; index is find_index(time) if known."""
+        if index is None:
+            index = self.find_index(time)
+        if index < 0:
+            return None
+        if self.interpolation == 'step' or index == len(self.times) - 1:
+            return self.values[index]
+        start_time, end_time = self.times[index], self.times[index + 1]
+        fraction = (time - start_time) / (end_time - start_time)
+        return self.values[index] + fraction * (self.values[index + 1] - self.values[index])
+
+    def get_breakpoints(self) -> list:
+        return list(self.times)
+
+
+class Protocol:
+    """
+    A set of timelines applied to model parameters during a run.
+
+    Each schedule is either an (object, attribute) pair, e.g. a channel config
+    and 'conductance', or a setter callable that receives the new value.
+    """
+
+    def __init__(self):
+        self.schedules = []
+        self._last_values = []
+        # The index of the last lookup into each schedule's timeline
+        self._cursors = []
+        self._breakpoints = []
+        self._breakpoint_cursor = 0
+
+    def add_schedule(self,
+                     timeline: Timeline,
+                     *,
+                     obj=None,
+                     attribute: str = None,
+                     setter: Callable = None):
+        if setter is None:
+            if obj is None or attribute is None:
+                raise ValueError("A schedule needs either a setter or both an object and an attribute.")
+            if not hasattr(obj, attribute):
+                raise ValueError(f"Cannot schedule '{attribute}': the object {obj} doesn't have this attribute.")
+            setter = lambda value, obj=obj, attribute=attribute: setattr(obj, attribute, value)
+        else:
+            obj = None
+        self.schedules.append((setter, timeline, obj))
+        self._last_values.append(None)
+        self._cursors.append(0)
+        self._breakpoints = sorted(set(self._breakpoints) | set(timeline.get_breakpoints()))
+        self._breakpoint_cursor = 0
+
+    def apply(self, time: float) -> list:
+        """
+        Set every scheduled parameter to its value at the given time. Returns the objects of the
+        schedules whose value changed since the last call, None standing for a setter schedule.
+        """
+        changed = []
+        for index, (setter, timeline, obj) in enumerate(self.schedules):
+            timeline_index = timeline.find_index(time, self._cursors[index])
+            self._cursors[index] = max(timeline_index, 0)
+            value = timeline.value_at(time, timeline_index)
+            if value is not None:
+                setter(value)
+                if value != self._last_values[index]:
+                    self._last_values[index] = value
+                    changed.append(obj)
+        return changed
+
+    def get_breakpoints(self) -> list:
+        return list(self._breakpoints)
+
+    def next_breakpoint(self, time: float):
+        """Return the first breakpoint strictly after the given time, or None."""
+        breakpoints = self._breakpoints
+        cursor = self._breakpoint_cursor
+        if cursor > 0 and breakpoints[cursor - 1] > time:
+            cursor = 0
+        while cursor < len(breakpoints) and breakpoints[cursor] <= time:
+            cursor += 1
+        self._breakpoint_cursor = cursor
+        return breakpoints[cursor] if cursor < len(breakpoints) else None
@@ -0,0 +1,213 @@
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+class Reducer(ABC):
+    """
+    An online reduction of a single tracked field.
+
+    A reducer sees one (time, value) sample per simulation step and keeps only
+    the running quantities it needs, so its memory does not grow with the
+    number of iterations.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    @abstractmethod
+    def reset(self):
+        """Forget all samples seen so far."""
+
+    @abstractmethod
+    def update(self, time: float, value: float):
+        """Consume one sample."""
+
+    @abstractmethod
+    def result(self):
+        """Return the current value of the reduction."""
+
+
+class LastValueReducer(Reducer):
+    """Keep the most recent value of the field."""
+
+    def reset(self):
+        self.value = None
+        self.time = None
+
+    def update(self, time: float, value: float):
+        self.time = time
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class MinimumReducer(Reducer):
+    """Keep the minimum value of the field and the time at which it occurred."""
+
+    def reset(self):
+        self.value = None
+        self.time = None
+
+    def update(self, time: float, value: float):
+        if self.value is None or value < self.value:
+            self.value = value
+            self.time = time
+
+    def result(self):
+        return {'value': self.value, 'time': self.time}
+
+
+class MaximumReducer(Reducer):
+    """Keep the maximum value of the field and the time at which it occurred."""
+
+    def reset(self):
+        self.value = None
+        self.time = None
+
+    def update(self, time: float, value: float):
+        if self.value is None or value > self.value:
+            self.value = value
+            self.time = time
+
+    def result(self):
+        return {'value': self.value, 'time': self.time}
+
+
+class IntegralReducer(Reducer):
+    """Integrate the field over time with the trapezoidal rule."""
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_time = None
+        self.last_value = None
+
+    def update(self, time: float, value: float):
+        if self.last_time is not None:
+            self.integral += 0.5 * (value + self.last_value) * (time - self.last_time)
+        self.last_time = time
+        self.last_value = value
+
+    def result(self):
+        return self.integral
+
+
+class ThresholdCrossingReducer(Reducer):
+    """
+    Record the first time the field crosses a threshold.
+
+    Parameters:
+    ----------
+    threshold : float
+        The value to watch for.
+    direction : str, optional
+        'falling', 'rising' or 'any' (default). A falling crossing is a change
+        from above the threshold to at or below it.
+    """
+
+    ALLOWED_DIRECTIONS = ('any', 'rising', 'falling')
+
+    def __init__(self, threshold: float, direction: str = 'any'):
+        if direction not in self.ALLOWED_DIRECTIONS:
+            raise ValueError(f"Unsupported direction: {direction}. Expected one of {self.ALLOWED_DIRECTIONS}.")
+        self.threshold = threshold
+        self.direction = direction
+        super().__init__()
+
+    def reset(self):
+        self.crossing_time = None
+        self.last_time = None
+        self.last_value = None
+
+    def update(self, time: float, value: float):
+        if self.crossing_time is not None:
+            return
+        if self.last_value is not None:
+            previous = self.last_value - self.threshold
+            current = value - self.threshold
+            rising = previous < 0.0 <= current
+            falling = previous > 0.0 >= current
+            if ((rising and self.direction != 'falling') or
+                    (falling and self.direction != 'rising')):
+                # Linear interpolation between the two samples bracketing the crossing
+                fraction = previous / (previous - current)
+                self.crossing_time = self.last_time + fraction * (time - self.last_time)
+        self.last_time = time
+        self.last_value = value
+
+    def result(self):
+        return self.crossing_time
+
+
+class WindowAverageReducer(Reducer):
+    """
+    Keep the time average of the field over a trailing window.
+
+    Parameters:
+    ----------
+    window : float
+        Length of the trailing window in seconds.
+    """
+
+    def __init__(self, window: float):
+        if window <= 0:
+            raise ValueError(f"The averaging window must be positive, got {window}.")
+        self.window = window
+        super().__init__()
+
+    def reset(self):
+        self.samples = deque()
+        self.weighted_sum = 0.0
+        self.last_time = None
+        self.last_value = None
+
+    def update(self, time: float, value: float):
+        # Each sample holds the trapezoid between the previous sample and this one
+        if self.last_time is not None:
+            dt = time - self.last_time
+            area = 0.5 * (value + self.last_value) * dt
+            self.samples.append((self.last_time, time, area))
+            self.weighted_sum += area
+
+        window_start = time - self.window
+        while self.samples and self.samples[0][1] <= window_start:
+            self.weighted_sum -= self.samples.popleft()[2]
+
+        self.last_time = time
+        self.last_value = value
+
+    def result(self):
+        if not self.samples:
+            return self.last_value
+        span = self.samples[-1][1] - self.samples[0][0]
+        return self.weighted_sum / span if span > 0 else self.last_value
+
+
+class ReducersStorage:
+    """
+    Holds the reducers registered with a simulation and feeds them the current
+    value of their fields once per step.
+    """
+
+    def __init__(self):
+        self.reducers = {}
+        self._bindings = []
+
+    def register_reducer(self, name: str, obj, field_name: str, reducer: Reducer):
+        if not isinstance(reducer, Reducer):
+            raise TypeError("The reducer object must be of type Reducer.")
+        if name in self.reducers:
+            raise RuntimeError(f'A reducer with the name {name} has been already registered')
+        self.reducers[name] = reducer
+        self._bindings.append((obj, field_name, reducer))
+
+    def update_reducers(self, time: float):
+        for obj, field_name, reducer in self._bindings:
+            reducer.update(time, getattr(obj, field_name))
+
+    def reset_reducers(self):
+        for reducer in self.reducers.values():
+            reducer.reset()
+
+    def get_results(self) -> dict:
+        return {name: reducer.result() for name, reducer in self.reducers.items()}
@@ -0,0 +1,174 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .result_store import ResultStore, StoredResult
+
+
+class ResultIndex:
+    """
+    An index of the runs in a ResultStore.
+
+    Opening a run only reads its meta.json, so indexing hundreds of long runs
+    is cheap; columns are read later, through a DecimatedReader.
+
+    Parameters:
+    ----------
+    store : ResultStore
+        The store to index.
+    """
+
+    def __init__(self, store: ResultStore):
+        self.store = store
+        self.results = {}
+
+    def refresh(self) -> list:
+        """Pick up new runs and forget deleted ones; returns the keys of the new runs."""
+        keys = self.store.keys()
+        for key in set(self.results) - set(keys):
+            del self.results[key]
+        added = [key for key in keys if key not in self.results]
+        for key in added:
+            self.results[key] = self.store.load(key)
+        return added
+
+    def get_label(self, key: str) -> str:
+        """Return the name of a run's scenario, or the start of its key."""
+        scenario = self.results[key].scenario or {}
+        return scenario.get('name') or key[:12]
+
+    def get_fields(self, keys=None) -> list:
+        """Return the fields stored by any of the given runs, all by default."""
+        fields = {}
+        for key in (keys if keys is not None else self.results):
+            fields.update(dict.fromkeys(self.results[key].fields))
+        return list(fields)
+
+
+class DecimatedReader:
+    """
+    Reads the visible part of stored columns at screen resolution.
+
+    Only the samples of the requested time range are read from the
+    memory-mapped columns. When they are more than max_points, the range is
+    drawn from a min/max pyramid instead: level 0 holds the minimum and
+    maximum of every block of block_size samples, and every further level
+    halves the number of blocks. A level is computed once per column, reading
+    the column in chunks of chunk_size samples, and kept in an LRU cache of at
+    most cache_bytes, so panning and zooming only slice cached arrays.
+
+    Parameters:
+    ----------
+    block_size : int, optional
+        Samples per block of the first pyramid level. Default is 64.
+    chunk_size : int, optional
+        Samples read at once while building a level. Default is 2**20.
+    cache_bytes : int, optional
+        Memory budget of the cached pyramid levels. Default is 64 MB.
+    """
+
+    DEFAULT_BLOCK_SIZE = 64
+    DEFAULT_CHUNK_SIZE = 1 << 20
+    DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+    def __init__(self,
+                 *,
+                 block_size: int = None,
+                 chunk_size: int = None,
+                 cache_bytes: int = None):
+        self.block_size = block_size if block_size is not None else self.DEFAULT_BLOCK_SIZE
+        self.chunk_size = chunk_size if chunk_size is not None else self.DEFAULT_CHUNK_SIZE
+        if self.chunk_size % self.block_size:
+            raise ValueError("chunk_size must be a multiple of block_size.")
+        self.cache_bytes = cache_bytes if cache_bytes is not None else self.DEFAULT_CACHE_BYTES
+        self._levels = OrderedDict()   # (path, field, level) -> (minima, maxima)
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def read(self,
+             result: StoredResult,
+             tracked_field_name: str,
+             *,
+             start_time: float = None,
+             end_time: float = None,
+             max_points: int = 2000):
+        """
+        Return (times, values) of a field between start_time and end_time, with at most about
+        max_points points. Decimated ranges hold the minimum and the maximum of every block at
+        the block's start time, so peaks remain visible at any zoom level.
+        """
+        length = result.get_length(tracked_field_name)
+        start = result.find_index(tracked_field_name, start_time) if start_time is not None else 0
+        # One sample on each side of the range, so lines run up to the edges of the view
+        start = max(start - 1, 0)
+        stop = min(result.find_index(tracked_field_name, end_time) + 1, length) if end_time is not None else length
+        if stop <= start:
+            return np.zeros(0), np.zeros(0)
+        if stop - start <= max_points:
+            return (np.array(result.get_time(tracked_field_name, start, stop)),
+                    np.array(result.get(tracked_field_name)[start:stop]))
+
+        # The finest level with at most max_points / 2 blocks in the range
+        samples_per_block = math.ceil(2 * (stop - start) / max(max_points, 2))
+        level = max(0, math.ceil(math.log2(samples_per_block / self.block_size)))
+        block = self.block_size << level
+        minima, maxima = self._get_level(result, tracked_field_name, level)
+        first_block, last_block = start // block, math.ceil(stop / block)
+
+        times = np.array(result.get_time(tracked_field_name, first_block * block, last_block * block, block))
+        values = np.empty(2 * len(times))
+        values[0::2] = minima[first_block:last_block]
+        values[1::2] = maxima[first_block:last_block]
+        return np.repeat(times, 2), values
+
+    def _get_level(self, result: StoredResult, tracked_field_name: str, level: int):
+        key = (result.path, tracked_field_name, level)
+        with self._lock:
+            if key in self._levels:
+                self._levels.move_to_end(key)
+                return self._levels[key]
+
+        if level == 0:
+            minima, maxima = self._build_first_level(result.get(tracked_field_name))
+        else:
+            finer_minima, finer_maxima = self._get_level(result, tracked_field_name, level - 1)
+            minima, maxima = self._halve(finer_minima, np.minimum), self._halve(finer_maxima, np.maximum)
+
+        with self._lock:
+            self._levels[key] = (minima, maxima)
+            self._cached_bytes += minima.nbytes + maxima.nbytes
+            while self._cached_bytes > self.cache_bytes and len(self._levels) > 1:
+                _, (old_minima, old_maxima) = self._levels.popitem(last=False)
+                self._cached_bytes -= old_minima.nbytes + old_maxima.nbytes
+        return minima, maxima
+
+    def _build_first_level(self, column: np.ndarray):
+        block_size = self.block_size
+        blocks = math.ceil(len(column) / block_size)
+        minima, maxima = np.empty(blocks), np.empty(blocks)
+        for chunk_start in range(0, len(column), self.chunk_size):
+            chunk = np.asarray(column[chunk_start:chunk_start + self.chunk_size], dtype=np.float64)
+            full = len(chunk) // block_size * block_size
+            first_block = chunk_start // block_size
+            if full:
+                reshaped = chunk[:full].reshape(-1, block_size)
+                minima[first_block:first_block + len(reshaped)] = reshaped.min(axis=1)
+                maxima[first_block:first_block + len(reshaped)] = reshaped.max(axis=1)
+            if full < len(chunk):
+                minima[-1], maxima[-1] = chunk[full:].min(), chunk[full:].max()
+        return minima, maxima
+
+    @staticmethod
+    def _halve(values: np.ndarray, reduce) -> np.ndarray:
+        even = len(values) // 2 * 2
+        halved = reduce(values[0:even:2], values[1:even:2])
+        if even < len(values):
+            halved = np.append(halved, values[-1])
+        return halved
+
+    def clear(self):
+        with self._lock:
+            self._levels.clear()
+            self._cached_bytes = 0
@@ -0,0 +1,144 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .histories_storage import HistoriesStorage
+
+
+class StoredResult:
+    """
+    The results of one run as stored by a ResultStore.
+
+    Columns are loaded lazily and, by default, memory-mapped, so opening a
+    result only reads its description and reading a column only touches the
+    pages that are used.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, ResultStore.META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.key = meta['key']
+        self.fields = meta['fields']
+        self.units = meta['units']
+        self.intervals = meta['intervals']
+        self.metadata = meta['metadata']
+        self.scenario = meta.get('scenario')
+        self.reductions = meta.get('reductions', {})
+        self.events = meta.get('events', [])
+
+    def _column_path(self, tracked_field_name: str) -> str:
+        if tracked_field_name not in self.fields:
+            raise KeyError(f'The field {tracked_field_name} is not stored')
+        return os.path.join(self.path, self.fields[tracked_field_name])
+
+    def get(self, tracked_field_name: str, mmap: bool = True) -> np.ndarray:
+        """Return a column, memory-mapped read-only unless mmap is False."""
+        return np.load(self._column_path(tracked_field_name), mmap_mode='r' if mmap else None)
+
+    def get_length(self, tracked_field_name: str) -> int:
+        return len(self.get(tracked_field_name))
+
+    def _has_time_column(self, tracked_field_name: str) -> bool:
+        time_field = self.metadata.get('time_field')
+        return (time_field in self.fields and self.intervals[time_field] == self.intervals[tracked_field_name] and
+                self.get_length(time_field) == self.get_length(tracked_field_name))
+
+    def get_time(self, tracked_field_name: str, start: int = 0, stop: int = None, step: int = 1) -> np.ndarray:
+        """Return the time of every stored sample of a field, or of the samples start:stop:step."""
+        length = self.get_length(tracked_field_name)
+        if self._has_time_column(tracked_field_name):
+            return self.get(self.metadata['time_field'])[start:stop:step]
+        sample_period = self.metadata['time_step'] * self.intervals[tracked_field_name]
+        indices = range(length)[start:stop:step]
+        return self.metadata.get('start_time', 0.0) + sample_period * np.arange(indices.start, indices.stop, indices.step)
+
+    def find_index(self, tracked_field_name: str, time: float) -> int:
+        """Return the index of the first sample of a field at or after time."""
+        length = self.get_length(tracked_field_name)
+        if self._has_time_column(tracked_field_name):
+            # A binary search only touches a few pages of the memory-mapped time column
+            return int(np.searchsorted(self.get(self.metadata['time_field']), time, side='left'))
+        sample_period = self.metadata['time_step'] * self.intervals[tracked_field_name]
+        index = math.ceil((time - self.metadata.get('start_time', 0.0)) / sample_period - 1e-9)
+        return min(max(index, 0), length)
+
+
+class ResultStore:
+    """
+    An on-disk store of run results keyed by scenario key.
+
+    Every result is a directory holding a meta.json with the metadata, units,
+    recording intervals, reductions and events of the run, and one .npy file
+    per recorded field. Results are written to a temporary directory and moved
+    into place in one rename, so readers never see a partial result.
+
+    Parameters:
+    ----------
+    root : str
+        Directory of the store; it is created if needed.
+    """
+
+    META_FILE = 'meta.json'
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def has(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.path_for(key), self.META_FILE))
+
+    def keys(self) -> list:
+        return sorted(key for key in os.listdir(self.root) if self.has(key))
+
+    def save(self,
+             key: str,
+             histories: HistoriesStorage,
+             *,
+             scenario: dict = None,
+             reductions: dict = None,
+             events: list = None) -> str:
+        """Write the recorded histories of a run and return the path of the result."""
+        temporary_path = tempfile.mkdtemp(prefix=f'.{key}.', dir=self.root)
+        try:
+            fields = {}
+            for index, (tracked_field_name, history) in enumerate(histories.histories.items()):
+                file_name = f'{index:04d}.npy'
+                np.save(os.path.join(temporary_path, file_name), np.asarray(history, dtype=np.float64))
+                fields[tracked_field_name] = file_name
+            meta = {
+                'key': key,
+                'fields': fields,
+                'units': {name: histories.units.get(name, '') for name in fields},
+                'intervals': {name: histories.get_interval(name) for name in fields},
+                'metadata': histories.metadata,
+                'scenario': scenario,
+                'reductions': reductions or {},
+                'events': events or [],
+            }
+            with open(os.path.join(temporary_path, self.META_FILE), 'w') as meta_file:
+                json.dump(meta, meta_file, default=str)
+
+            path = self.path_for(key)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        return path
+
+    def load(self, key: str) -> StoredResult:
+        if not self.has(key):
+            raise KeyError(f'No result is stored for the key {key}')
+        return StoredResult(self.path_for(key))
+
+    def delete(self, key: str):
+        shutil.rmtree(self.path_for(key), ignore_errors=True)
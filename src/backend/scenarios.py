@@ -0,0 +1,135 @@
+import copy
+import hashlib
+import json
+
+from .model_spec import ModelSpec, default_model_spec
+from .simulation import Simulation, SimulationConfig
+from .histories_storage import TrackingConfig
+from .vesicle import VesicleConfig
+from .exterior import ExteriorConfig
+
+
+class Scenario:
+    """
+    A complete, serializable description of one simulation run.
+
+    A scenario is made of plain dicts and a ModelSpec, so it can be sent to
+    another process, written to JSON and hashed. Two scenarios with the same
+    content have the same key, which identifies their results.
+
+    Parameters:
+    ----------
+    spec : ModelSpec, optional
+        The model. Default is the default model spec.
+    config : dict, optional
+        SimulationConfig arguments, e.g. {'total_time': 10.0}.
+    vesicle : dict, optional
+        VesicleConfig arguments.
+    exterior : dict, optional
+        ExteriorConfig arguments.
+    tracking : dict, optional
+        TrackingConfig fields selection; None records the default fields.
+    name : str, optional
+        A label; it is not part of the key.
+    """
+
+    SECTIONS = ('config', 'vesicle', 'exterior', 'species', 'channels')
+
+    def __init__(self,
+                 *,
+                 spec: ModelSpec = None,
+                 config: dict = None,
+                 vesicle: dict = None,
+                 exterior: dict = None,
+                 tracking: dict = None,
+                 name: str = None):
+        self.spec = spec if spec is not None else default_model_spec
+        self.config = dict(config or {})
+        self.vesicle = dict(vesicle or {})
+        self.exterior = dict(exterior or {})
+        self.tracking = copy.deepcopy(tracking)
+        self.name = name
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        spec = data.get('spec')
+        return cls(spec=ModelSpec.from_dict(spec) if spec is not None else None,
+                   config=data.get('config'),
+                   vesicle=data.get('vesicle'),
+                   exterior=data.get('exterior'),
+                   tracking=data.get('tracking'),
+                   name=data.get('name'))
+
+    def to_dict(self) -> dict:
+        return {
+            'spec': self.spec.to_dict(),
+            'config': dict(self.config),
+            'vesicle': dict(self.vesicle),
+            'exterior': dict(self.exterior),
+            'tracking': copy.deepcopy(self.tracking),
+            'name': self.name,
+        }
+
+    def key(self) -> str:
+        """Return a hash of everything that determines the results of the run."""
+        content = self.to_dict()
+        del content['name']
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+    def with_overrides(self, overrides: dict, name: str = None):
+        """
+        Return a new scenario with parameters replaced by dotted paths, e.g.
+        {'config.total_time': 10.0, 'channels.asor.conductance': 1e-4, 'vesicle.init_radius': 1e-6}.
+        """
+        config, vesicle, exterior = dict(self.config), dict(self.vesicle), dict(self.exterior)
+        species_overrides, channel_overrides = {}, {}
+        sections = {'config': config, 'vesicle': vesicle, 'exterior': exterior}
+        for path, value in overrides.items():
+            section, _, rest = path.partition('.')
+            if section in sections and rest:
+                sections[section][rest] = value
+            elif section in ('species', 'channels') and rest.count('.') == 1:
+                object_name, parameter = rest.split('.')
+                target = species_overrides if section == 'species' else channel_overrides
+                known = self.spec.species if section == 'species' else self.spec.channels
+                if object_name not in known:
+                    raise ValueError(f"Override '{path}' refers to an unknown {section[:-1]} '{object_name}'.")
+                target.setdefault(object_name, {})[parameter] = value
+            else:
+                raise ValueError(f"Invalid override path '{path}'. Expected one of "
+                                 f"{', '.join(s + '.<name>' for s in self.SECTIONS[:3])} or "
+                                 f"species.<species>.<parameter>, channels.<channel>.<parameter>.")
+        spec = self.spec.evolve(species=species_overrides, channels=channel_overrides) \
+            if species_overrides or channel_overrides else self.spec
+        return Scenario(spec=spec, config=config, vesicle=vesicle, exterior=exterior,
+                        tracking=self.tracking, name=name if name is not None else self.name)
+
+    def with_tracked_fields(self, tracked_field_names: list, name: str = None):
+        """
+        Return a new scenario recording only the given tracked fields, e.g. ['Vesicle_pH', 'clc_h_flux'],
+        and the simulation time. Intervals selected by the scenario's tracking are kept.
+        """
+        tracking = TrackingConfig(fields=self.tracking) if self.tracking is not None else TrackingConfig()
+        object_names = ['simulation', 'Vesicle', 'Exterior', *self.spec.species, *self.spec.channels]
+        fields = {'simulation': {'time': 1}}
+        for tracked_field_name in tracked_field_names:
+            # The longest matching object name, so that 'clc_h_flux' is the flux of 'clc_h', not of 'clc'
+            object_name = max((object_name for object_name in object_names
+                               if tracked_field_name.startswith(f'{object_name}_')), key=len, default=None)
+            if object_name is None:
+                raise ValueError(f"Tracked field '{tracked_field_name}' doesn't belong to any object of the scenario. "
+                                 f"Available objects: {object_names}.")
+            field_name = tracked_field_name[len(object_name) + 1:]
+            fields.setdefault(object_name, {})[field_name] = tracking.get_fields(object_name).get(field_name, 1)
+        return Scenario(spec=self.spec, config=self.config, vesicle=self.vesicle, exterior=self.exterior,
+                        tracking=fields, name=name if name is not None else self.name)
+
+    def build_simulation(self, **kwargs):
+        """Create a fresh Simulation for the scenario; kwargs are passed on to Simulation."""
+        tracking_config = TrackingConfig(fields=self.tracking) if self.tracking is not None else None
+        return Simulation(config=SimulationConfig(**self.config),
+                          spec=self.spec,
+                          vesicle_config=VesicleConfig(**self.vesicle),
+                          exterior_config=ExteriorConfig(**self.exterior),
+                          tracking_config=tracking_config,
+                          **kwargs)
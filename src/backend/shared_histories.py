@@ -0,0 +1,173 @@
+import mmap
+import os
+import tempfile
+import uuid
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .histories_storage import HistoriesStorage
+from .history_codecs import ArrayColumn
+
+
+class SharedHistories:
+    """
+    A small, picklable handle to recorded histories placed in shared memory.
+
+    A worker process calls share_histories() on its HistoriesStorage and
+    returns the handle instead of the histories, so only the field layout and
+    the metadata are pickled. The parent calls attach() to get a
+    HistoriesStorage whose columns are views of the shared block, and
+    release() once it no longer needs them.
+
+    The samples are placed in a multiprocessing.shared_memory block. On
+    Windows a block disappears as soon as the process that created it exits,
+    so there a memory-mapped file in a temporary directory is used instead.
+    """
+
+    def __init__(self, *, kind: str, name: str, layout: dict, intervals: dict, units: dict, metadata: dict):
+        self.kind = kind
+        self.name = name
+        self.layout = layout   # field name -> (offset, length) in samples
+        self.intervals = intervals
+        self.units = units
+        self.metadata = metadata
+        self._block = None
+        self._attached = weakref.WeakSet()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_block'] = None
+        del state['_attached']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attached = weakref.WeakSet()
+        # The receiving process owns the block: its resource tracker frees it at exit if it is never released
+        if self.kind == 'shm' and os.name == 'posix':
+            resource_tracker.register(self.tracker_name, 'shared_memory')
+
+    @property
+    def tracker_name(self) -> str:
+        return f'/{self.name}'
+
+    def attach(self) -> HistoriesStorage:
+        """
+        Map the block in and return histories whose columns are ArrayColumns over it.
+        The returned histories keep this handle alive.
+        """
+        samples = self._map()
+        histories = HistoriesStorage()
+        histories.shared_block = self
+        histories.metadata = self.metadata
+        histories.units = dict(self.units)
+        for tracked_field_name, (offset, length) in self.layout.items():
+            histories.histories[tracked_field_name] = ArrayColumn.wrap(samples[offset:offset + length])
+            histories.intervals[tracked_field_name] = self.intervals[tracked_field_name]
+        self._attached.add(histories)
+        return histories
+
+    def _map(self) -> np.ndarray:
+        total = sum(length for _, length in self.layout.values())
+        if self._block is None:
+            if self.kind == 'shm':
+                self._block = shared_memory.SharedMemory(name=self.name)
+            else:
+                with open(self.name, 'r+b') as block_file:
+                    self._block = mmap.mmap(block_file.fileno(), 0)
+        buffer = self._block.buf if self.kind == 'shm' else self._block
+        return np.frombuffer(buffer, dtype=np.float64, count=total)
+
+    def release(self):
+        """
+        Free the block. The histories returned by attach() are emptied; arrays taken
+        from them must be deleted, or copied, before the block can be released.
+        """
+        for histories in self._attached:
+            for tracked_field_name in histories.histories:
+                histories.histories[tracked_field_name] = ArrayColumn(0)
+        self._attached.clear()
+        if self._block is not None:
+            try:
+                self._block.close()
+            except BufferError:
+                raise RuntimeError('Arrays taken from the shared histories are still in use; '
+                                   'delete or copy them before releasing the block.') from None
+            self._block = None
+        if self.kind == 'shm':
+            try:
+                block = shared_memory.SharedMemory(name=self.name)
+            except FileNotFoundError:
+                return
+            block.close()
+            block.unlink()
+        elif os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def share_histories(histories: HistoriesStorage, *, use_files: bool = None, directory: str = None) -> SharedHistories:
+    """
+    Copy recorded histories into one shared block and return its handle.
+
+    Parameters:
+    ----------
+    histories : HistoriesStorage
+        The histories of a finished run.
+    use_files : bool, optional
+        Use a memory-mapped file instead of shared memory. Default is True on Windows only.
+    directory : str, optional
+        Directory of the memory-mapped files. Default is the temporary directory.
+    """
+    use_files = use_files if use_files is not None else os.name == 'nt'
+    layout = {}
+    offset = 0
+    for tracked_field_name, history in histories.histories.items():
+        layout[tracked_field_name] = (offset, len(history))
+        offset += len(history)
+    size = max(offset, 1) * np.dtype(np.float64).itemsize
+
+    if use_files:
+        name = os.path.join(directory if directory is not None else tempfile.gettempdir(),
+                            f'histories-{uuid.uuid4().hex}.bin')
+        with open(name, 'w+b') as block_file:
+            block_file.truncate(size)
+            block = mmap.mmap(block_file.fileno(), size)
+        buffer = block
+    else:
+        block = shared_memory.SharedMemory(create=True, size=size)
+        name = block.name
+        buffer = block.buf
+        if os.name == 'posix':
+            # The block outlives this process; the process that attaches to it becomes responsible
+            # for it, so this process's resource tracker must not unlink it on exit
+            resource_tracker.unregister(f'/{name}', 'shared_memory')
+
+    samples = np.frombuffer(buffer, dtype=np.float64, count=offset)
+    for tracked_field_name, (start, length) in layout.items():
+        samples[start:start + length] = np.asarray(histories.histories[tracked_field_name], dtype=np.float64)
+    del samples
+    block.close()
+
+    return SharedHistories(kind='file' if use_files else 'shm',
+                           name=name,
+                           layout=layout,
+                           intervals={key: histories.get_interval(key) for key in layout},
+                           units={key: histories.units.get(key, '') for key in layout},
+                           metadata=histories.metadata)
+
+
+def run_shared(scenario: dict, use_files: bool = None) -> SharedHistories:
+    """Run a Scenario given as a dict, e.g. in a process pool, and return its histories as a SharedHistories."""
+    from .scenarios import Scenario
+
+    simulation = Scenario.from_dict(scenario).build_simulation()
+    simulation.run()
+    return share_histories(simulation.histories, use_files=use_files)
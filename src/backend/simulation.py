@@ -5,10 +5,18 @@ from .vesicle import VesicleConfig, Vesicle
 from .ion_species import IonSpecies
 from .ion_channels import IonChannel
 from .flux_calculation_parameters import FluxCalculationParameters
-from .default_channels import default_channels
-from .default_ion_species import default_ion_species
+from .model_spec import ModelSpec, default_model_spec
+from .model_cache import model_cache
 from .ion_and_channels_link import IonChannelsLink
-from .histories_storage import HistoriesStorage
+from .histories_storage import HistoriesStorage, TrackingConfig
+from .history_codecs import HistoryStorageConfig
+from .reducers import Reducer, ReducersStorage
+from .events import Event, EventsStorage
+from .protocol import Timeline, Protocol
+from .multirate import MultirateScheduler
+from .state_layout import StateLayout
+from .transport_network import TransportNetwork
+from .telemetry import Observer, CallbackObserver, Telemetry
 from math import log10
 
 class SimulationConfig:
@@ -16,22 +24,75 @@ class SimulationConfig:
     DEFAULT_TOTAL_TIME = 100.0
     DEFAULT_TEMPERATURE = 2578.5871 / IDEAL_GAS_CONSTANT
     DEFAULT_INIT_BUFFER_CAPACITY = 5e-4
+    DEFAULT_RECORD_HISTORIES = True
+    # Breakpoints closer than this fraction of a step to the current time are not split off
+    BREAKPOINT_TOLERANCE = 1e-6
+    DEFAULT_SLOW_CHANNELS = ('vatpase',)
+    # Keeps the pH error of 'auto' within a few percent of the single-rate error on the benchmark scenarios
+    DEFAULT_SLOW_UPDATE_TOLERANCE = 1e-4
+    DEFAULT_MAX_SLOW_UPDATE_RATIO = 1000
+    DEFAULT_USE_TRANSPORT_NETWORK = False
+    DEFAULT_HISTORY_MEMORY_BUDGET = None
+    DEFAULT_USE_GATING_TABLES = False
+    DEFAULT_GATING_TABLE_MAX_ERROR = 1e-6
+    DEFAULT_GATING_VOLTAGE_RANGE = (-0.5, 0.5)
+    DEFAULT_GATING_PH_RANGE = (0.0, 14.0)
+    DEFAULT_USE_MODEL_CACHE = True
 
     def __init__(self,
                  *,
                  time_step: float = None,
                  total_time: float = None,
                  temperature: float = None,
-                 init_buffer_capacity: float = None):
+                 init_buffer_capacity: float = None,
+                 record_histories: bool = None,
+                 slow_update_ratio=None,
+                 slow_update_tolerance: float = None,
+                 max_slow_update_ratio: int = None,
+                 slow_channels: tuple = None,
+                 use_transport_network: bool = None,
+                 history_memory_budget: int = None,
+                 use_gating_tables: bool = None,
+                 gating_table_max_error: float = None,
+                 gating_voltage_range: tuple = None,
+                 gating_pH_range: tuple = None,
+                 use_model_cache: bool = None):
         
         self.time_step = time_step if time_step is not None else self.DEFAULT_TIME_STEP
         self.total_time = total_time if total_time is not None else self.DEFAULT_TOTAL_TIME
         self.temperature = temperature if temperature is not None else self.DEFAULT_TEMPERATURE
         self.init_buffer_capacity = init_buffer_capacity if init_buffer_capacity is not None else self.DEFAULT_INIT_BUFFER_CAPACITY
+        self.record_histories = record_histories if record_histories is not None else self.DEFAULT_RECORD_HISTORIES
+
+        # Multi-rate integration: None keeps every process on the global time step,
+        # an integer or 'auto' updates the slow processes once every slow_update_ratio steps.
+        # Only the slow channels are skipped between updates, so with the default single
+        # slow channel the run takes about as long as a single-rate one; a speedup needs
+        # more of the costly channels in slow_channels
+        self.slow_update_ratio = slow_update_ratio
+        self.slow_update_tolerance = slow_update_tolerance if slow_update_tolerance is not None else self.DEFAULT_SLOW_UPDATE_TOLERANCE
+        self.max_slow_update_ratio = max_slow_update_ratio if max_slow_update_ratio is not None else self.DEFAULT_MAX_SLOW_UPDATE_RATIO
+        self.slow_channels = slow_channels if slow_channels is not None else self.DEFAULT_SLOW_CHANNELS
+
+        # Compute fluxes through a stoichiometry matrix, with each exchanger computed once per step
+        self.use_transport_network = use_transport_network if use_transport_network is not None else self.DEFAULT_USE_TRANSPORT_NETWORK
+
+        # Upper bound of the memory used by recorded histories in bytes, None for no limit
+        self.history_memory_budget = history_memory_budget if history_memory_budget is not None else self.DEFAULT_HISTORY_MEMORY_BUDGET
+
+        # Evaluate voltage and pH gating from precomputed tables with a bounded error
+        self.use_gating_tables = use_gating_tables if use_gating_tables is not None else self.DEFAULT_USE_GATING_TABLES
+        self.gating_table_max_error = gating_table_max_error if gating_table_max_error is not None else self.DEFAULT_GATING_TABLE_MAX_ERROR
+        self.gating_voltage_range = gating_voltage_range if gating_voltage_range is not None else self.DEFAULT_GATING_VOLTAGE_RANGE
+        self.gating_pH_range = gating_pH_range if gating_pH_range is not None else self.DEFAULT_GATING_PH_RANGE
+
+        # Connect models built from a spec as compiled for their topology, see model_cache
+        self.use_model_cache = use_model_cache if use_model_cache is not None else self.DEFAULT_USE_MODEL_CACHE
         
 
 class Simulation(Trackable):
     TRACKABLE_FIELDS = ('buffer_capacity','time')
+    FIELD_UNITS = {'buffer_capacity': '', 'time': 's'}
 
     def __init__(self,
                  *,
@@ -41,6 +102,10 @@ class Simulation(Trackable):
                  ion_channel_links: IonChannelsLink = None,
                  vesicle_config: VesicleConfig = None,
                  exterior_config: ExteriorConfig = None,
+                 protocol: Protocol = None,
+                 spec: ModelSpec = None,
+                 tracking_config: TrackingConfig = None,
+                 storage_config: HistoryStorageConfig = None,
                  display_name: str = 'simulation',
                  **kwargs):
         super(Simulation, self).__init__(display_name=display_name, **kwargs)
@@ -50,19 +115,57 @@ class Simulation(Trackable):
         self.iter_num = int(self.config.total_time / self.config.time_step)
         self.time = 0.0
 
+        # Model objects are instantiated from a spec so that runs never share mutable state
+        self.compiled_model = None
+        model_spec = None
+        if spec is not None:
+            if channels is not None or species is not None or ion_channel_links is not None:
+                raise ValueError("Either a model spec or channels/species/ion_channel_links can be given, not both.")
+            model_spec = spec
+        elif channels is None and species is None and ion_channel_links is None:
+            model_spec = default_model_spec
+        if model_spec is not None:
+            if self.config.use_model_cache:
+                self.compiled_model = model_cache.get(model_spec)
+            dependence_parameters = self.compiled_model.dependence_parameters if self.compiled_model is not None else None
+            species, channels, ion_channel_links = model_spec.instantiate(dependence_parameters)
+        elif channels is None or species is None:
+            default_species, default_channel_objects, _ = default_model_spec.instantiate()
+            channels = channels if channels is not None else default_channel_objects
+            species = species if species is not None else default_species
+        self.spec = spec
+
         # Default configs
-        self.channels = channels if channels is not None else default_channels
-        self.species = species if species is not None else default_ion_species
+        self.channels = channels
+        self.species = species
         self.ion_channel_links = ion_channel_links if ion_channel_links is not None else IonChannelsLink()
         self.vesicle_config = vesicle_config if vesicle_config is not None else VesicleConfig()
         self.exterior_config = exterior_config if exterior_config is not None else ExteriorConfig()
+        self.protocol = protocol if protocol is not None else Protocol()
 
         # External components and tracking
         self.exterior = None
         self.vesicle = None
         self.all_species = []  
         self.buffer_capacity = self.config.init_buffer_capacity
-        self.histories = HistoriesStorage()
+        # A compiled model keeps the history layout of every tracking config it was run with
+        tracking_key = tracking_config.key() if tracking_config is not None else None
+        history_layouts = (self.compiled_model.history_layouts.get(tracking_key)
+                           if self.compiled_model is not None else None)
+        self.histories = HistoriesStorage(tracking_config=tracking_config,
+                                          memory_budget=self.config.history_memory_budget,
+                                          storage_config=storage_config,
+                                          layouts=history_layouts)
+        self.reducers = ReducersStorage()
+        self.events = EventsStorage()
+        self.terminated = False
+        self.stop_requested = False
+        self.telemetry = Telemetry()
+        self._last_step = None
+        self.multirate = None
+        self.network = None
+        self._fast_network = None
+        self._slow_network = None
         self.nernst_constant = self.config.DEFAULT_TEMPERATURE * IDEAL_GAS_CONSTANT / FARADAY_CONSTANT
         self.unaccounted_ion_amounts = None
         self.histories.register_object(self)
@@ -70,6 +173,9 @@ class Simulation(Trackable):
         # Initialize simulation components
         self._initialize_vesicle_and_exterior()
         self._initialize_species_and_channels() 
+        self.histories.metadata = self.get_metadata(model_spec)
+        if self.compiled_model is not None and history_layouts is None:
+            self.compiled_model.history_layouts[tracking_key] = dict(self.histories.layouts)
 
     def _initialize_vesicle_and_exterior(self):
         """
@@ -87,18 +193,70 @@ class Simulation(Trackable):
         """
         Initialize ions and channels and link them based on the IonChannelsLink configuration.
         """
-        # Step 1: Connect channels to species
-        for species_name, links in self.ion_channel_links.get_links().items():
-            primary_species = self.species[species_name]
-            for channel_name, secondary_species_name in links:
-                channel = self.channels[channel_name]
-                secondary_species = self.species.get(secondary_species_name)
-                primary_species.connect_channel(channel=channel, secondary_species=secondary_species)
+        # Step 1: Connect channels to species, skipping the validation for an already compiled topology
+        if self.compiled_model is not None:
+            self.compiled_model.connect(self.species, self.channels)
+        else:
+            for species_name, links in self.ion_channel_links.get_links().items():
+                primary_species = self.species[species_name]
+                for channel_name, secondary_species_name in links:
+                    channel = self.channels[channel_name]
+                    secondary_species = self.species.get(secondary_species_name)
+                    primary_species.connect_channel(channel=channel, secondary_species=secondary_species)
 
         # Step 2: Add species to the simulation
         for species in self.species.values():
             self.add_ion_species(species)                     
 
+        # Step 3: Channels are only recorded on request, so only register them with a tracking config
+        if self.histories.tracking_config is not None:
+            for channel in self.channels.values():
+                if channel.primary_ion_species is not None and channel.display_name not in self.histories.objects:
+                    self.histories.register_object(channel)
+            self.histories.check_tracked_objects()
+
+        self.state_layout = StateLayout([self, self.vesicle, self.exterior, *self.all_species])
+
+        if self.config.use_gating_tables:
+            for channel in self.channels.values():
+                channel.use_gating_tables(voltage_range=self.config.gating_voltage_range,
+                                          pH_range=self.config.gating_pH_range,
+                                          max_error=self.config.gating_table_max_error)
+
+        if self.config.slow_update_ratio is not None:
+            self._initialize_multirate()
+        self._build_networks()
+
+    def _initialize_multirate(self):
+        """Split every species' channels into the fast ones and the slow ones held between slow updates."""
+        unknown = [name for name in self.config.slow_channels if name not in self.channels]
+        if unknown:
+            raise ValueError(f"Unknown slow channels: {unknown}. Available channels: {list(self.channels)}.")
+        slow_channel_objects = self._slow_channel_objects = [self.channels[name] for name in self.config.slow_channels]
+        # Protocol changes to these objects invalidate the slow fluxes held between slow updates
+        self._slow_targets = [*slow_channel_objects, *(channel.config for channel in slow_channel_objects)]
+        self.multirate = MultirateScheduler(ratio=self.config.slow_update_ratio,
+                                            tolerance=self.config.slow_update_tolerance,
+                                            max_ratio=self.config.max_slow_update_ratio)
+        self._fast_channels = [[ch for ch in ion.channels if not any(ch is slow for slow in slow_channel_objects)]
+                               for ion in self.all_species]
+        self._slow_channels = [[ch for ch in ion.channels if any(ch is slow for slow in slow_channel_objects)]
+                               for ion in self.all_species]
+        self._slow_fluxes = [0.0] * len(self.all_species)
+
+    def _build_networks(self):
+        """Build the transport networks, merging the exchanger pairs whose channels currently match."""
+        if not self.config.use_transport_network:
+            return
+        if self.multirate is None:
+            self.network = TransportNetwork.from_species(self.all_species)
+            return
+        slow_channel_objects = self._slow_channel_objects
+        self._fast_network = TransportNetwork.from_species(
+            self.all_species, channel_filter=lambda channel: not any(channel is slow for slow in slow_channel_objects))
+        self._slow_network = TransportNetwork.from_species(
+            self.all_species, channel_filter=lambda channel: any(channel is slow for slow in slow_channel_objects))
+
     def add_ion_species(self, 
                         species_obj: IonSpecies
                         ):
@@ -115,7 +273,78 @@ class Simulation(Trackable):
         # Add channel to primary_species, which performs validation
         primary_species.connect_channel(channel_obj, secondary_species)
         self.histories.register_object(channel_obj)
+
+    def add_reducer(self,
+                    name: str,
+                    tracked_field_name: str,
+                    reducer: Reducer):
+        """
+        Register an online reduction over a tracked field, e.g. 'Vesicle_pH'.
+        Reducers are updated every iteration whether or not histories are recorded.
+        """
+        obj, field_name = self.histories.resolve_field(tracked_field_name)
+        self.reducers.register_reducer(name, obj, field_name, reducer)
+
+    def get_reductions(self) -> dict:
+        return self.reducers.get_results()
+
+    def add_event(self, event: Event):
+        """Register an event whose sign changes are located within each step."""
+        self.events.register_event(event)
+
+    def add_observer(self, observer: Observer, *, every_steps: int = None, every_seconds: float = None):
+        """Report progress and diagnostics of the step loop to an observer, see Telemetry.add_observer."""
+        self.telemetry.add_observer(observer, every_steps=every_steps, every_seconds=every_seconds)
+
+    def get_diagnostics(self) -> dict:
+        return self.telemetry.get_diagnostics()
+
+    def get_event_occurrences(self) -> list:
+        return self.events.get_occurrences()
+
+    def add_schedule(self,
+                     timeline: Timeline,
+                     *,
+                     obj=None,
+                     attribute: str = None,
+                     setter=None):
+        """
+        Drive a parameter from a timeline, e.g. add_schedule(timeline, obj=channel.config, attribute='conductance').
+        Steps are split at the timeline breakpoints so changes take effect at their exact times.
+        """
+        self.protocol.add_schedule(timeline, obj=obj, attribute=attribute, setter=setter)
+
+    def schedule_exterior_pH(self, timeline: Timeline):
+        """Drive the exterior pH together with the exterior hydrogen concentration it implies."""
+        hydrogen_species = next((s for s in self.all_species if s.display_name == 'h'), None)
+        if hydrogen_species is None:
+            raise ValueError("Hydrogen species not found in the simulation.")
+
+        def set_exterior_pH(pH):
+            self.exterior.pH = pH
+            hydrogen_species.exterior_conc = 10 ** (-pH) / self.config.init_buffer_capacity
+
+        self.protocol.add_schedule(timeline, setter=set_exterior_pH)
     
+    def get_metadata(self, model_spec: ModelSpec = None) -> dict:
+        """
+        Describe the configuration that generates this simulation's results. model_spec, the spec the
+        model objects were just instantiated from, saves rebuilding it from the objects.
+        """
+        if model_spec is None:
+            model_spec = ModelSpec.from_objects(species=self.species,
+                                                channels=self.channels,
+                                                ion_channel_links=self.ion_channel_links)
+        return {
+            'time_field': f'{self.display_name}_time',
+            'time_step': self.config.time_step,
+            'start_time': self.time,
+            'simulation_config': dict(vars(self.config)),
+            'vesicle_config': dict(vars(self.vesicle_config)),
+            'exterior_config': dict(vars(self.exterior_config)),
+            'model_spec': model_spec.to_dict(),
+        }
+
     def get_Flux_Calculation_Parameters(self):
         flux_calculation_parameters = FluxCalculationParameters()
         flux_calculation_parameters.voltage = self.vesicle.voltage
@@ -185,13 +414,36 @@ class Simulation(Trackable):
         for ion in self.all_species:
             ion.vesicle_amount = ion.vesicle_conc * 1000 * self.vesicle.volume
 
-    def update_ion_amounts(self, fluxes):
+    def get_state(self, out=None):
+        """Return the whole simulation state as a flat float64 vector laid out by state_layout."""
+        return self.state_layout.pack(out)
+
+    def set_state(self, vector):
+        """Restore a state vector returned by get_state."""
+        self.state_layout.unpack(vector)
+
+    def get_ion_amounts(self):
+        return [ion.vesicle_amount for ion in self.all_species]
+
+    def restore_ion_amounts(self, amounts):
+        for ion, amount in zip(self.all_species, amounts):
+            ion.vesicle_amount = amount
+
+    def get_vesicle_concentrations(self):
+        return [ion.vesicle_conc for ion in self.all_species]
+
+    def restore_vesicle_concentrations(self, concentrations):
+        for ion, concentration in zip(self.all_species, concentrations):
+            ion.vesicle_conc = concentration
+
+    def update_ion_amounts(self, fluxes, time_step: float = None):
+        time_step = time_step if time_step is not None else self.config.time_step
         for ion, flux in zip(self.all_species, fluxes):
-            ion.vesicle_amount += flux * self.config.time_step
+            ion.vesicle_amount += flux * time_step
             
             if ion.vesicle_amount < 0:
                 ion.vesicle_amount = 0
-                print(f"Warning: {ion.display_name} ion amount fell below zero and has been reset to zero.")
+                self.telemetry.record_clamp(ion.display_name, self.time)
 
     def update_vesicle_concentrations(self):
         for ion in self.all_species:
@@ -210,26 +462,227 @@ class Simulation(Trackable):
         self.update_voltage()
         self.update_pH()
 
+    def update_fast_state(self):
+        """Update the quantities that follow the ion amounts at every step of a multi-rate run."""
+        self.update_vesicle_concentrations()
+        self.update_charge()
+        self.update_voltage()
+        self.update_pH()
+
+    def compute_fluxes(self):
+        flux_calculation_parameters = self.get_Flux_Calculation_Parameters()
+        if self.multirate is None:
+            if self.network is not None:
+                return self.network.compute_species_fluxes(flux_calculation_parameters)
+            return [ion.compute_total_flux(flux_calculation_parameters=flux_calculation_parameters) for ion in self.all_species]
+
+        if self._fast_network is not None:
+            fast_fluxes = self._fast_network.compute_species_fluxes(flux_calculation_parameters)
+        else:
+            fast_fluxes = [ion.compute_total_flux(flux_calculation_parameters=flux_calculation_parameters, channels=channels)
+                           for ion, channels in zip(self.all_species, self._fast_channels)]
+        return [fast_flux + slow_flux for fast_flux, slow_flux in zip(fast_fluxes, self._slow_fluxes)]
+
+    def update_slow_processes(self):
+        """Refresh the slow channel fluxes held between slow updates and let the scheduler adapt the ratio."""
+        self.compute_slow_fluxes()
+        self.multirate.record_slow_update([self.vesicle.volume, self.buffer_capacity, *self._slow_fluxes])
+
+    def compute_slow_fluxes(self):
+        flux_calculation_parameters = self.get_Flux_Calculation_Parameters()
+        if self._slow_network is not None:
+            self._slow_fluxes = self._slow_network.compute_species_fluxes(flux_calculation_parameters)
+        else:
+            self._slow_fluxes = [ion.compute_total_flux(flux_calculation_parameters=flux_calculation_parameters, channels=channels)
+                                 for ion, channels in zip(self.all_species, self._slow_channels)]
+
+    def apply_protocol(self, time: float):
+        """
+        Apply the protocol at the given time and update what depends on the changed parameters, see
+        _on_parameters_changed, so that the changes take effect at once.
+        """
+        changed = self.protocol.apply(time)
+        if changed:
+            self._on_parameters_changed(changed)
+
+    def _on_parameters_changed(self, changed: list):
+        """
+        Bring what is derived from the parameters up to date after the protocol or an event action changed
+        the given objects, None standing for unknown ones: the transport networks are built again if a merged
+        exchanger pair no longer matches, and held slow fluxes are recomputed.
+        """
+        networks = [network for network in (self.network, self._fast_network, self._slow_network) if network is not None]
+        if not all(network.partners_match() for network in networks):
+            self._build_networks()
+        if self.multirate is not None and any(
+                obj is None or any(obj is target for target in self._slow_targets) for obj in changed):
+            self.compute_slow_fluxes()
+
+    def _save_step(self, fluxes, time_step: float):
+        self._last_step = (self.get_ion_amounts(), self.get_vesicle_concentrations(), fluxes, time_step, self.time)
+
+    def _refresh_step_state(self):
+        """
+        Recompute the derived state from the current ion amounts. The volume update lags the
+        concentrations by one call, so the concentrations at the start of the step are restored first.
+        """
+        self.restore_vesicle_concentrations(self._last_step[1])
+        self.update_simulation_state()
+
+    def _interpolate_step(self, fraction: float):
+        """Put the state at a fraction of the last step, which is linear in the ion amounts."""
+        start_amounts, _, fluxes, time_step, _ = self._last_step
+        for ion, amount, flux in zip(self.all_species, start_amounts, fluxes):
+            ion.vesicle_amount = max(amount + flux * fraction * time_step, 0.0)
+        self._refresh_step_state()
+
+    def check_events(self):
+        """
+        Locate the events whose functions changed sign during the last step.
+
+        The state is moved to each event time, the event actions are applied and the
+        remainder of the step is integrated with the updated state and parameters.
+        Returns True if a terminal event stopped the run.
+        """
+        previous_values = self.events.last_values
+        current_values = self.events.evaluate(self)
+        self.events.last_values = current_values
+        if previous_values is None or self._last_step is None:
+            return False
+
+        step_end_time = self.time
+        while crossings := self.events.find_crossings(previous_values, current_values):
+            values_by_event = dict(zip(self.events.events.values(), zip(previous_values, current_values)))
+
+            located = []
+            for event in crossings:
+                def evaluate_at(fraction, event=event):
+                    self._interpolate_step(fraction)
+                    return event.function(self)
+                located.append((self.events.locate(event, evaluate_at, *values_by_event[event]), event))
+            event_fraction = min(fraction for fraction, _ in located)
+            triggered = [event for fraction, event in located
+                         if fraction - event_fraction <= self.events.tolerance]
+
+            # Move to the event time and fire the triggered events
+            _, _, _, time_step, step_start_time = self._last_step
+            self._interpolate_step(event_fraction)
+            self.time = step_start_time + event_fraction * time_step
+            for event in triggered:
+                self.events.record(event, self.time)
+                if event.action is not None:
+                    event.action(self)
+
+            self._refresh_step_state()
+            if any(event.action is not None for event in triggered):
+                self._on_parameters_changed([None])
+            if any(event.terminal for event in triggered):
+                self.events.last_values = self.events.evaluate(self)
+                return True
+
+            # Integrate the remainder of the step from the event state
+            previous_values = self.events.evaluate(self)
+            fluxes = self.compute_fluxes()
+            self._save_step(fluxes, step_end_time - self.time)
+            self.update_ion_amounts(fluxes, self._last_step[3])
+            self.time = step_end_time
+            self.update_simulation_state()
+            current_values = self.events.evaluate(self)
+            self.events.last_values = current_values
+
+        return False
     
     def run_one_iteration(self):
-        self.update_simulation_state()
+        if self.multirate is None:
+            self.update_simulation_state()
+        elif self.multirate.is_slow_update_due():
+            self.update_simulation_state()
+            self.update_slow_processes()
+        else:
+            self.update_fast_state()
+            self.multirate.record_fast_step()
 
-        flux_calculation_parameters = self.get_Flux_Calculation_Parameters()
-        fluxes = [ion.compute_total_flux(flux_calculation_parameters=flux_calculation_parameters) for ion in self.all_species]
+        if self.events.events and self.check_events():
+            self.terminated = True
+            return
 
-        self.histories.update_histories()
-        
-        self.update_ion_amounts(fluxes)
+        if self.protocol.schedules:
+            self.apply_protocol(self.time + self.config.BREAKPOINT_TOLERANCE * self.config.time_step)
+        fluxes = self.compute_fluxes()
 
-        self.time += self.config.time_step
+        if self.config.record_histories:
+            self.histories.update_histories()
+        self.reducers.update_reducers(self.time)
 
-    def run(self):            
-        
+        if not self.protocol.schedules:
+            self._advance(fluxes, self.config.time_step)
+            self.time += self.config.time_step
+            return
+
+        # Split the step at protocol breakpoints so parameter changes apply at their exact times
+        step_end_time = self.time + self.config.time_step
+        tolerance = self.config.BREAKPOINT_TOLERANCE * self.config.time_step
+        while ((breakpoint := self.protocol.next_breakpoint(self.time + tolerance)) is not None and
+               breakpoint < step_end_time - tolerance):
+            self._advance(fluxes, breakpoint - self.time)
+            self.time = breakpoint
+            self.update_simulation_state()
+            if self.events.events and self.check_events():
+                self.terminated = True
+                return
+            self.apply_protocol(self.time)
+            fluxes = self.compute_fluxes()
+
+        self._advance(fluxes, step_end_time - self.time)
+        self.time = step_end_time
+
+    def _advance(self, fluxes, time_step: float):
+        if self.events.events:
+            self._save_step(fluxes, time_step)
+        self.update_ion_amounts(fluxes, time_step)
+
+    def stop(self):
+        """Ask a running simulation, e.g. in another thread, to stop after the current iteration."""
+        self.stop_requested = True
+
+    def run(self, progress_callback=None):
+        """
+        Run the simulation. progress_callback, if given, is called with the completed
+        fraction of the run about every percent of the iterations; observers added with
+        add_observer receive structured progress and diagnostic records.
+        """
         self.set_ion_amounts()
         self.get_unaccounted_ion_amount()
+        if self.config.record_histories:
+            if self.histories.step == 0:
+                self.histories.metadata['start_time'] = self.time
+            self.histories.plan_recording(self.iter_num)
+
+        callback_observer = None
+        if progress_callback is not None:
+            callback_observer = CallbackObserver(progress=lambda record: progress_callback(record['fraction']))
+            self.add_observer(callback_observer, every_steps=max(1, self.iter_num // 100))
 
-        for iter_idx in range(self.iter_num):
-            # print(f'Iter #: {iter_idx}')
+        iter_idx = 0
+        next_poll = self.telemetry.start(self, self.iter_num)
+        for iter_idx in range(1, self.iter_num + 1):
             self.run_one_iteration()
-        
+            if self.terminated or self.stop_requested:
+                break
+            if iter_idx >= next_poll:
+                next_poll = self.telemetry.poll(iter_idx)
+
+        # Events in the final step are only visible once the final state is computed
+        if self.events.events and not self.terminated and not self.stop_requested:
+            self.update_simulation_state()
+            self.terminated = self.check_events()
+
+        summary = self.telemetry.finish(iter_idx, completed=not self.stop_requested)
+        if callback_observer is not None:
+            self.telemetry.remove_observer(callback_observer)
+        if self.config.record_histories:
+            self.histories.metadata['diagnostics'] = self.get_diagnostics()
+        if not self.telemetry.observers and summary['clamp_counts']:
+            clamps = ', '.join(f'{name}: {count}' for name, count in summary['clamp_counts'].items())
+            print(f"Warning: ion amounts fell below zero and were reset to zero ({clamps} steps).")
         return self.histories
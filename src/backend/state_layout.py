@@ -0,0 +1,35 @@
+import numpy as np
+
+
+class StateLayout:
+    """
+    Maps the tracked fields of a set of objects onto a flat float64 vector.
+
+    Packing copies the whole state into one array and unpacking writes it back,
+    so snapshots for histories, checkpoints and integrators are a single array
+    operation instead of one dict per object. Fields that are not set yet
+    (e.g. ion amounts before a run starts) are packed as NaN.
+    """
+
+    __slots__ = ('fields', 'names', 'index')
+
+    def __init__(self, objects: list):
+        self.fields = tuple((obj, field_name) for obj in objects for field_name in obj.TRACKABLE_FIELDS)
+        self.names = tuple(f'{obj.display_name}_{field_name}' for obj, field_name in self.fields)
+        self.index = {name: position for position, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.fields)
+
+    def pack(self, out: np.ndarray = None) -> np.ndarray:
+        values = [getattr(obj, field_name) for obj, field_name in self.fields]
+        if out is None:
+            out = np.empty(len(values), dtype=np.float64)
+        out[:] = [np.nan if value is None else value for value in values]
+        return out
+
+    def unpack(self, vector: np.ndarray):
+        if len(vector) != len(self.fields):
+            raise ValueError(f"Expected a state vector of length {len(self.fields)}, got {len(vector)}.")
+        for (obj, field_name), value in zip(self.fields, vector.tolist()):
+            setattr(obj, field_name, value)
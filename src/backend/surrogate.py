@@ -0,0 +1,337 @@
+import json
+import math
+
+import numpy as np
+
+from .scenarios import Scenario
+
+
+def evaluate_scenario(scenario: dict, fields: list, times: list) -> np.ndarray:
+    """
+    Run a Scenario given as a dict, recording only the fields, and return the fields at the given
+    times followed by their final values, as one vector, see get_output_columns. Top-level so that
+    it can run in a process pool.
+    """
+    simulation = Scenario.from_dict(scenario).with_tracked_fields(fields).build_simulation()
+    histories = simulation.run()
+    trajectories, finals = [], []
+    for tracked_field_name in fields:
+        values = np.asarray(histories.get_histories()[tracked_field_name], dtype=np.float64)
+        trajectories.append(np.interp(times, histories.get_time(tracked_field_name), values))
+        finals.append(values[-1])
+    return np.concatenate(trajectories + [np.array(finals)])
+
+
+def get_output_columns(fields: list, times: list) -> list:
+    """Return the names of the values returned by evaluate_scenario: 'field@time' columns, then the final values."""
+    columns = [f'{tracked_field_name}@{t:g}' for tracked_field_name in fields for t in times]
+    return columns + list(fields)
+
+
+class SurrogatePrediction:
+    """
+    Predicted trajectories and final values of the surrogate outputs.
+
+    error maps every field to the estimated standard deviation of its prediction,
+    the largest over its sampled times and final value. source is 'surrogate' or
+    'simulation' when the query fell back to the simulator, whose error is zero.
+    """
+
+    def __init__(self, *, times: np.ndarray, trajectories: dict, final: dict, error: dict, source: str):
+        self.times = times
+        self.trajectories = trajectories
+        self.final = final
+        self.error = error
+        self.source = source
+
+
+class Surrogate:
+    """
+    A Gaussian-process emulator of simulation outputs over a box of parameters.
+
+    The surrogate is trained on simulations at a Latin hypercube design of the
+    box. Each training run gives the output fields at fixed times and their
+    final values; these vectors are standardized and projected on their
+    principal components, and every retained component is emulated by a
+    Gaussian process with a squared-exponential kernel. All the components
+    share the kernel's length scales, chosen per parameter by maximizing the
+    marginal likelihood, so a prediction costs one kernel row and a few dot
+    products.
+
+    Predictions come with an error estimate: the posterior standard deviation
+    plus the variance lost by truncating the basis. query() falls back to the
+    simulator when a point lies outside the box or its estimated error exceeds
+    the tolerance.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The base scenario; the parameters are applied to it as overrides.
+    parameters : dict
+        Maps Scenario override paths, e.g. 'channels.asor.conductance', to (low, high)
+        or (low, high, 'log') for parameters sampled on a log scale.
+    times : sequence of float
+        Times at which the trajectories are emulated.
+    fields : sequence of str, optional
+        Tracked fields to emulate. Default is the vesicle pH and voltage.
+    """
+
+    DEFAULT_FIELDS = ('Vesicle_pH', 'Vesicle_voltage')
+    DEFAULT_SAMPLES = 40
+    # Fraction of the output variance kept by the reduced basis
+    DEFAULT_EXPLAINED_VARIANCE = 1 - 1e-8
+    NUGGET = 1e-10
+    LENGTH_SCALE_GRID = np.geomspace(0.05, 20.0, 25)
+
+    def __init__(self,
+                 *,
+                 scenario: Scenario,
+                 parameters: dict,
+                 times,
+                 fields=None):
+        if not parameters:
+            raise ValueError("A surrogate needs at least one parameter.")
+        self.scenario = scenario
+        self.parameters = {}
+        for path, bounds in parameters.items():
+            low, high, scale = (*bounds, 'linear') if len(bounds) == 2 else bounds
+            if scale not in ('linear', 'log'):
+                raise ValueError(f"Unknown scale '{scale}' for parameter '{path}'. Expected 'linear' or 'log'.")
+            if not low < high or (scale == 'log' and low <= 0):
+                raise ValueError(f"Invalid bounds ({low}, {high}) for parameter '{path}'.")
+            self.parameters[path] = (float(low), float(high), scale)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.fields = list(fields) if fields is not None else list(self.DEFAULT_FIELDS)
+
+        self.design = None
+        self.outputs = None
+        self.length_scales = None
+        self._reset_model()
+
+    def _reset_model(self):
+        self._output_mean = None
+        self._output_scale = None
+        self._basis = None
+        self._truncation_variance = None
+        self._weights = None
+        self._kernel_inverse = None
+        self._signal_variances = None
+        self.validation_error = None
+
+    # Parameter space
+
+    def to_unit(self, point: dict) -> np.ndarray:
+        """Map parameter values to the unit cube of the design."""
+        unit = np.empty(len(self.parameters))
+        for index, (path, (low, high, scale)) in enumerate(self.parameters.items()):
+            if path not in point:
+                raise KeyError(f"The point has no value for the parameter '{path}'.")
+            value = point[path]
+            if scale == 'log':
+                unit[index] = (math.log(value) - math.log(low)) / (math.log(high) - math.log(low)) if value > 0 else -np.inf
+            else:
+                unit[index] = (value - low) / (high - low)
+        return unit
+
+    def from_unit(self, unit: np.ndarray) -> dict:
+        point = {}
+        for coordinate, (path, (low, high, scale)) in zip(unit, self.parameters.items()):
+            if scale == 'log':
+                point[path] = float(math.exp(math.log(low) + coordinate * (math.log(high) - math.log(low))))
+            else:
+                point[path] = float(low + coordinate * (high - low))
+        return point
+
+    def contains(self, point: dict) -> bool:
+        unit = self.to_unit(point)
+        return bool(np.all((unit >= 0.0) & (unit <= 1.0)))
+
+    @staticmethod
+    def latin_hypercube(samples: int, dimensions: int, seed: int = None) -> np.ndarray:
+        """Return samples points in the unit cube, exactly one in every 1/samples slice of each dimension."""
+        rng = np.random.default_rng(seed)
+        slices = np.array([rng.permutation(samples) for _ in range(dimensions)]).T
+        return (slices + rng.random((samples, dimensions))) / samples
+
+    # Training
+
+    def _scenario_at(self, point: dict) -> Scenario:
+        return self.scenario.with_overrides(point)
+
+    def train(self, samples: int = None, *, seed: int = None, map_function=map):
+        """
+        Run the simulations of a Latin hypercube design and fit the emulator.
+
+        map_function is used to run the design, e.g. ProcessPoolExecutor().map to run it in parallel.
+        """
+        samples = samples if samples is not None else self.DEFAULT_SAMPLES
+        design = self.latin_hypercube(samples, len(self.parameters), seed)
+        scenarios = [self._scenario_at(self.from_unit(unit)).to_dict() for unit in design]
+        outputs = list(map_function(evaluate_scenario, scenarios,
+                                    [self.fields] * samples, [self.times.tolist()] * samples))
+        self.fit(design, np.array(outputs))
+        return self
+
+    def fit(self, design: np.ndarray, outputs: np.ndarray, length_scales: np.ndarray = None):
+        """
+        Fit the emulator to outputs (one row per design point, as returned by evaluate_scenario).
+        The kernel length scales are searched for unless they are given.
+        """
+        design = np.asarray(design, dtype=np.float64)
+        outputs = np.asarray(outputs, dtype=np.float64)
+        if len(design) != len(outputs) or len(design) < 2:
+            raise ValueError("The design and the outputs must have the same number of rows, at least two.")
+        self._reset_model()
+        self.design = design
+        self.outputs = outputs
+
+        # Standardize the outputs and keep the principal components that explain them
+        self._output_mean = outputs.mean(axis=0)
+        self._output_scale = outputs.std(axis=0)
+        self._output_scale[self._output_scale == 0] = 1.0
+        standardized = (outputs - self._output_mean) / self._output_scale
+        _, singular_values, components = np.linalg.svd(standardized, full_matrices=False)
+        explained = np.cumsum(singular_values ** 2) / max(np.sum(singular_values ** 2), np.finfo(float).tiny)
+        rank = int(np.searchsorted(explained, self.DEFAULT_EXPLAINED_VARIANCE) + 1)
+        rank = min(rank, len(singular_values))
+        self._basis = components[:rank]
+        residual = standardized - standardized @ self._basis.T @ self._basis
+        self._truncation_variance = np.mean(residual ** 2, axis=0)
+        scores = standardized @ self._basis.T
+
+        if length_scales is not None:
+            self.length_scales = np.asarray(length_scales, dtype=np.float64)
+        else:
+            self.length_scales = self._fit_length_scales(design, scores)
+        self._factorize(design, scores)
+        self.validation_error = self._leave_one_out_error(scores)
+        return self
+
+    def _kernel(self, first: np.ndarray, second: np.ndarray, length_scales: np.ndarray) -> np.ndarray:
+        differences = (first[:, None, :] - second[None, :, :]) / length_scales
+        return np.exp(-0.5 * np.sum(differences ** 2, axis=-1))
+
+    def _log_likelihood(self, design: np.ndarray, scores: np.ndarray, length_scales: np.ndarray) -> float:
+        kernel = self._kernel(design, design, length_scales) + self.NUGGET * np.eye(len(design))
+        try:
+            cholesky = np.linalg.cholesky(kernel)
+        except np.linalg.LinAlgError:
+            return -np.inf
+        solved = np.linalg.solve(cholesky, scores)
+        # Each component has its own signal variance, estimated in closed form
+        signal_variances = np.maximum(np.sum(solved ** 2, axis=0) / len(design), np.finfo(float).tiny)
+        log_determinant = 2.0 * np.sum(np.log(np.diag(cholesky)))
+        return float(-0.5 * np.sum(len(design) * np.log(signal_variances) + log_determinant))
+
+    def _fit_length_scales(self, design: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Coordinate search of the length scales on a log grid, a few sweeps over the parameters."""
+        length_scales = np.full(design.shape[1], 0.5)
+        best = self._log_likelihood(design, scores, length_scales)
+        for _ in range(3):
+            improved = False
+            for dimension in range(design.shape[1]):
+                for candidate in self.LENGTH_SCALE_GRID:
+                    trial = length_scales.copy()
+                    trial[dimension] = candidate
+                    likelihood = self._log_likelihood(design, scores, trial)
+                    if likelihood > best:
+                        best, length_scales, improved = likelihood, trial, True
+            if not improved:
+                break
+        return length_scales
+
+    def _factorize(self, design: np.ndarray, scores: np.ndarray):
+        kernel = self._kernel(design, design, self.length_scales) + self.NUGGET * np.eye(len(design))
+        cholesky_inverse = np.linalg.inv(np.linalg.cholesky(kernel))
+        self._kernel_inverse = cholesky_inverse.T @ cholesky_inverse
+        self._weights = self._kernel_inverse @ scores
+        solved = cholesky_inverse @ scores
+        self._signal_variances = np.sum(solved ** 2, axis=0) / len(design)
+
+    def _leave_one_out_error(self, scores: np.ndarray) -> dict:
+        """Root-mean-square leave-one-out error of every field, from the closed form for Gaussian processes."""
+        score_residuals = self._weights / np.diag(self._kernel_inverse)[:, None]
+        residuals = (score_residuals @ self._basis) * self._output_scale
+        return self._per_field(np.sqrt(np.mean(residuals ** 2, axis=0)))
+
+    # Prediction
+
+    def _per_field(self, vector: np.ndarray) -> dict:
+        count = len(self.times)
+        finals = vector[len(self.fields) * count:]
+        return {field: float(max(np.max(vector[index * count:(index + 1) * count], initial=0.0), finals[index]))
+                for index, field in enumerate(self.fields)}
+
+    def _split(self, vector: np.ndarray):
+        count = len(self.times)
+        trajectories = {field: vector[index * count:(index + 1) * count] for index, field in enumerate(self.fields)}
+        finals = vector[len(self.fields) * count:]
+        return trajectories, {field: float(finals[index]) for index, field in enumerate(self.fields)}
+
+    def predict(self, point: dict) -> SurrogatePrediction:
+        """Evaluate the emulator at a point, inside or outside the trained box."""
+        if self._weights is None:
+            raise RuntimeError("The surrogate has not been trained.")
+        unit = self.to_unit(point)[None, :]
+        kernel_row = self._kernel(unit, self.design, self.length_scales)[0]
+        scores = kernel_row @ self._weights
+        vector = self._output_mean + (scores @ self._basis) * self._output_scale
+
+        posterior = max(1.0 + self.NUGGET - float(kernel_row @ self._kernel_inverse @ kernel_row), 0.0)
+        variance = (posterior * self._signal_variances) @ self._basis ** 2 + self._truncation_variance
+        error = np.sqrt(variance) * self._output_scale
+
+        trajectories, final = self._split(vector)
+        return SurrogatePrediction(times=self.times, trajectories=trajectories, final=final,
+                                   error=self._per_field(error), source='surrogate')
+
+    def simulate(self, point: dict) -> SurrogatePrediction:
+        """Run the simulator at a point and return its outputs in the form of a prediction."""
+        vector = evaluate_scenario(self._scenario_at(point).to_dict(), self.fields, self.times.tolist())
+        trajectories, final = self._split(vector)
+        return SurrogatePrediction(times=self.times, trajectories=trajectories, final=final,
+                                   error={field: 0.0 for field in self.fields}, source='simulation')
+
+    def query(self, point: dict, tolerance: float = None) -> SurrogatePrediction:
+        """
+        Predict with the emulator, or run the simulator if the point is outside the trained
+        box or if the estimated error of any field exceeds tolerance.
+        """
+        if not self.contains(point):
+            return self.simulate(point)
+        prediction = self.predict(point)
+        if tolerance is not None and max(prediction.error.values()) > tolerance:
+            return self.simulate(point)
+        return prediction
+
+    # Persistence
+
+    def save(self, path: str):
+        """Save the trained surrogate to a single .npz file, at path exactly as given."""
+        if self._weights is None:
+            raise RuntimeError("The surrogate has not been trained.")
+        meta = {
+            'scenario': self.scenario.to_dict(),
+            'parameters': {path: list(bounds) for path, bounds in self.parameters.items()},
+            'fields': self.fields,
+        }
+        # np.savez would append '.npz' to a path without it, which load(path) would then not find
+        with open(path, 'wb') as surrogate_file:
+            np.savez(surrogate_file,
+                     meta=np.array(json.dumps(meta)),
+                     times=self.times,
+                     design=self.design,
+                     outputs=self.outputs,
+                     length_scales=self.length_scales)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a surrogate saved by save(); the emulator is refitted from the stored design and outputs."""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            surrogate = cls(scenario=Scenario.from_dict(meta['scenario']),
+                            parameters={path: tuple(bounds) for path, bounds in meta['parameters'].items()},
+                            times=data['times'],
+                            fields=meta['fields'])
+            surrogate.fit(data['design'], data['outputs'], length_scales=data['length_scales'])
+        return surrogate
@@ -0,0 +1,443 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import socket
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from .scenarios import Scenario
+from .surrogate import evaluate_scenario, get_output_columns
+
+
+class SweepManifest:
+    """
+    A parameter sweep over Scenario overrides, split into deterministic shards.
+
+    The points are either the grid of every combination of parameter values,
+    enumerated with the last parameter varying fastest, or an explicit list.
+    Point i always belongs to shard i // shard_size, so any process reading the
+    same manifest agrees on the work of every shard. Each point gives the
+    values of the output fields at the times, if any, followed by their final
+    values, as evaluate_scenario does.
+
+    Parameters:
+    ----------
+    scenario : Scenario
+        The base scenario; the points are applied to it as overrides.
+    parameters : dict, optional
+        Grid sweep: maps override paths, e.g. 'channels.asor.conductance', to lists of values.
+    points : list, optional
+        Explicit sweep: a list of override dicts, all with the same paths.
+    shard_size : int, optional
+        Points per shard. Default is 16.
+    fields : sequence of str, optional
+        Tracked fields to output. Default is the vesicle pH and voltage.
+    times : sequence of float, optional
+        Times at which the fields are also output. Default is None, final values only.
+    name : str, optional
+        A label; it is not part of the key.
+    """
+
+    FORMAT_VERSION = 1
+    DEFAULT_SHARD_SIZE = 16
+    DEFAULT_FIELDS = ('Vesicle_pH', 'Vesicle_voltage')
+
+    def __init__(self,
+                 *,
+                 scenario: Scenario,
+                 parameters: dict = None,
+                 points: list = None,
+                 shard_size: int = None,
+                 fields=None,
+                 times=None,
+                 name: str = None):
+        if (parameters is None) == (points is None):
+            raise ValueError("A sweep needs either parameters (a grid) or points (an explicit list).")
+        self.scenario = scenario
+        self.parameters = {path: list(values) for path, values in parameters.items()} if parameters is not None else None
+        self.points = [dict(point) for point in points] if points is not None else None
+        self.shard_size = shard_size if shard_size is not None else self.DEFAULT_SHARD_SIZE
+        self.fields = list(fields) if fields is not None else list(self.DEFAULT_FIELDS)
+        self.times = [float(t) for t in times] if times is not None else []
+        self.name = name
+
+        if self.shard_size < 1:
+            raise ValueError(f"shard_size must be a positive integer, got {self.shard_size}.")
+        if self.parameters is not None:
+            if not self.parameters or any(not values for values in self.parameters.values()):
+                raise ValueError("Every parameter of a grid sweep needs at least one value.")
+            self.paths = list(self.parameters)
+        else:
+            if not self.points:
+                raise ValueError("An explicit sweep needs at least one point.")
+            self.paths = list(self.points[0])
+            for index, point in enumerate(self.points):
+                if list(point) != self.paths:
+                    raise ValueError(f"Point {index} overrides {list(point)}, expected {self.paths}.")
+        # Fail before any node starts, rather than on every point
+        scenario.with_overrides(self.get_point(0))
+
+    @property
+    def n_points(self) -> int:
+        if self.points is not None:
+            return len(self.points)
+        return math.prod(len(values) for values in self.parameters.values())
+
+    @property
+    def n_shards(self) -> int:
+        return -(-self.n_points // self.shard_size)
+
+    def get_point(self, index: int) -> dict:
+        """Return the overrides of a point."""
+        if not 0 <= index < self.n_points:
+            raise IndexError(f"Point {index} is out of range for a sweep of {self.n_points} points.")
+        if self.points is not None:
+            return dict(self.points[index])
+        point = {}
+        for path in reversed(self.paths):
+            values = self.parameters[path]
+            index, position = divmod(index, len(values))
+            point[path] = values[position]
+        return {path: point[path] for path in self.paths}
+
+    def get_shard_points(self, shard: int) -> range:
+        """Return the indices of the points of a shard."""
+        if not 0 <= shard < self.n_shards:
+            raise IndexError(f"Shard {shard} is out of range for a sweep of {self.n_shards} shards.")
+        return range(shard * self.shard_size, min((shard + 1) * self.shard_size, self.n_points))
+
+    def get_columns(self) -> list:
+        """Return the names of the output columns, in the order of evaluate_scenario."""
+        return get_output_columns(self.fields, self.times)
+
+    def to_dict(self) -> dict:
+        return {
+            'format': self.FORMAT_VERSION,
+            'scenario': self.scenario.to_dict(),
+            'parameters': self.parameters,
+            'points': self.points,
+            'shard_size': self.shard_size,
+            'fields': self.fields,
+            'times': self.times,
+            'name': self.name,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if data.get('format') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported sweep manifest format {data.get('format')}.")
+        return cls(scenario=Scenario.from_dict(data.get('scenario', {})),
+                   parameters=data.get('parameters'),
+                   points=data.get('points'),
+                   shard_size=data.get('shard_size'),
+                   fields=data.get('fields'),
+                   times=data.get('times'),
+                   name=data.get('name'))
+
+    def key(self) -> str:
+        """Return a hash of everything that determines the outputs of the sweep."""
+        content = self.to_dict()
+        del content['name']
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+class Sweep:
+    """
+    A sweep directory on a filesystem shared by the nodes running it.
+
+    The directory holds the manifest, one output file per finished shard and
+    small claim and error files. Workers on any number of machines run
+    work() on the same directory: a shard is claimed by creating its claim
+    file exclusively, so no shard is run twice, and its output is written
+    under a temporary name and renamed, so a partial output is never seen.
+    Every output is self-describing: it holds the sweep key, the shard, its
+    points, per-point errors and where and when it was computed.
+
+    status() tells which shards are done, failed, running (claimed without an
+    output, possibly by a node that died) or missing; reset() frees shards to
+    be run again and merge() checks that the sweep is complete and combines
+    the outputs into one columnar dataset, ordered by point.
+
+    Parameters:
+    ----------
+    directory : str
+        The sweep directory, created by Sweep.create().
+    """
+
+    MANIFEST_FILE = 'manifest.json'
+    SHARDS_DIRECTORY = 'shards'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, self.MANIFEST_FILE)) as manifest_file:
+            self.manifest = SweepManifest.from_dict(json.load(manifest_file))
+        self.key = self.manifest.key()
+        self.shards_directory = os.path.join(directory, self.SHARDS_DIRECTORY)
+
+    @classmethod
+    def create(cls, directory: str, manifest: SweepManifest):
+        """Write the manifest of a new sweep, or open the sweep if the directory already holds the same one."""
+        path = os.path.join(directory, cls.MANIFEST_FILE)
+        if os.path.exists(path):
+            sweep = cls(directory)
+            if sweep.key != manifest.key():
+                raise ValueError(f"{directory} already holds a different sweep.")
+            return sweep
+        os.makedirs(os.path.join(directory, cls.SHARDS_DIRECTORY), exist_ok=True)
+        _write_atomically(path, json.dumps(manifest.to_dict(), indent=2, default=str).encode())
+        return cls(directory)
+
+    def _path(self, shard: int, suffix: str) -> str:
+        return os.path.join(self.shards_directory, f'shard-{shard:06d}{suffix}')
+
+    def output_path(self, shard: int) -> str:
+        return self._path(shard, '.npz')
+
+    # Running
+
+    def work(self, *, node: int = None, nodes: int = None, progress_callback=None) -> list:
+        """
+        Claim and run shards until none is left; returns the shards run. With node and
+        nodes, only the shards node, node + nodes, node + 2 * nodes... are considered.
+        """
+        if (node is None) != (nodes is None) or (nodes is not None and not 0 <= node < nodes):
+            raise ValueError(f"Invalid node {node} of {nodes}.")
+        shards = range(self.manifest.n_shards)
+        if nodes is not None:
+            shards = shards[node::nodes]
+        done = []
+        for shard in shards:
+            if not self.claim(shard):
+                continue
+            try:
+                self.run_shard(shard, progress_callback=progress_callback)
+            except Exception:
+                # Recorded for status() and the merge report; the node moves on to the next shard
+                _write_atomically(self._path(shard, '.error.json'),
+                                  json.dumps(dict(_provenance(), error=traceback.format_exc())).encode())
+            done.append(shard)
+        return done
+
+    def claim(self, shard: int) -> bool:
+        """Claim a shard for this process; returns False if it is done or claimed elsewhere."""
+        if os.path.exists(self.output_path(shard)):
+            return False
+        try:
+            file_descriptor = os.open(self._path(shard, '.claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(file_descriptor, 'w') as claim_file:
+            json.dump(_provenance(), claim_file)
+        return True
+
+    def run_shard(self, shard: int, progress_callback=None) -> str:
+        """Run the points of a shard and write its output; returns the output path."""
+        manifest = self.manifest
+        indices = manifest.get_shard_points(shard)
+        started = time.time()
+        values = np.full((len(indices), len(manifest.get_columns())), np.nan)
+        errors = {}
+        for row, index in enumerate(indices):
+            try:
+                scenario = manifest.scenario.with_overrides(manifest.get_point(index))
+                values[row] = evaluate_scenario(scenario.to_dict(), manifest.fields, manifest.times)
+            except Exception as e:
+                errors[str(index)] = f'{type(e).__name__}: {e}'
+            if progress_callback is not None:
+                progress_callback(shard, (row + 1) / len(indices))
+
+        meta = dict(_provenance(),
+                    sweep=self.key,
+                    shard=shard,
+                    first_point=indices.start,
+                    n_points=len(indices),
+                    points=[manifest.get_point(index) for index in indices],
+                    columns=manifest.get_columns(),
+                    errors=errors,
+                    started=started,
+                    finished=time.time())
+        path = self.output_path(shard)
+        _write_atomically(path, lambda output_file: np.savez(output_file, meta=np.array(json.dumps(meta, default=str)),
+                                                            values=values))
+        if os.path.exists(self._path(shard, '.error.json')):
+            os.remove(self._path(shard, '.error.json'))
+        return path
+
+    def load_shard(self, shard: int):
+        """Return the (meta, values) of a shard output."""
+        with np.load(self.output_path(shard), allow_pickle=False) as data:
+            return json.loads(str(data['meta'])), data['values']
+
+    # Bookkeeping
+
+    def status(self) -> dict:
+        """
+        Return the shards by state: 'done', 'failed' (an error, or failed points), 'running'
+        (claimed without an output) and 'missing' (not claimed).
+        """
+        files = set(os.listdir(self.shards_directory)) if os.path.isdir(self.shards_directory) else set()
+        states = {'done': [], 'failed': [], 'running': [], 'missing': []}
+        for shard in range(self.manifest.n_shards):
+            name = os.path.basename(self._path(shard, ''))
+            if f'{name}.npz' in files:
+                meta, _ = self.load_shard(shard)
+                states['failed' if meta['errors'] else 'done'].append(shard)
+            elif f'{name}.error.json' in files:
+                states['failed'].append(shard)
+            elif f'{name}.claim' in files:
+                states['running'].append(shard)
+            else:
+                states['missing'].append(shard)
+        return states
+
+    def get_errors(self) -> dict:
+        """Return the errors of the failed shards: the traceback of the shard or its failed points."""
+        errors = {}
+        for shard in self.status()['failed']:
+            if os.path.exists(self.output_path(shard)):
+                errors[shard] = self.load_shard(shard)[0]['errors']
+            else:
+                with open(self._path(shard, '.error.json')) as error_file:
+                    errors[shard] = json.load(error_file)['error']
+        return errors
+
+    def reset(self, shards=None):
+        """
+        Remove the claims, errors and outputs of shards so that work() runs them again; by default
+        the failed shards. Only reset 'running' shards whose node is known to be gone.
+        """
+        shards = shards if shards is not None else self.status()['failed']
+        for shard in shards:
+            for suffix in ('.npz', '.error.json', '.claim'):
+                if os.path.exists(self._path(shard, suffix)):
+                    os.remove(self._path(shard, suffix))
+
+    # Merging
+
+    def merge(self, path: str = None, *, allow_incomplete: bool = False) -> dict:
+        """
+        Combine the shard outputs into columns ordered by point: 'point', one column per parameter,
+        then the output columns. Raises a RuntimeError listing the shards to run again if any is not
+        done, unless allow_incomplete, which leaves out the rows of the points not run or failed. With a path, the dataset is also
+        written as Parquet (.parquet, requires pyarrow) or NumPy (.npz) with the manifest in its metadata.
+        """
+        states = self.status()
+        incomplete = {state: shards for state, shards in states.items() if state != 'done' and shards}
+        if incomplete and not allow_incomplete:
+            raise RuntimeError('The sweep is incomplete: ' +
+                               '; '.join(f'{state} shards {shards}' for state, shards in incomplete.items()))
+
+        manifest = self.manifest
+        columns = manifest.get_columns()
+        indices, blocks = [], []
+        for shard in sorted(states['done'] + states['failed']):
+            if not os.path.exists(self.output_path(shard)):
+                continue
+            meta, values = self.load_shard(shard)
+            expected = manifest.get_shard_points(shard)
+            if (meta['sweep'] != self.key or meta['shard'] != shard or meta['first_point'] != expected.start
+                    or meta['n_points'] != len(expected) or meta['columns'] != columns
+                    or values.shape != (len(expected), len(columns))):
+                raise RuntimeError(f"The output of shard {shard} does not belong to this sweep; reset and run it again.")
+            succeeded = np.array([str(index) not in meta['errors'] for index in expected], dtype=bool)
+            indices.append(np.arange(expected.start, expected.stop)[succeeded])
+            blocks.append(values[succeeded])
+
+        points = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(blocks) if blocks else np.zeros((0, len(columns)))
+        dataset = {'point': points}
+        for path_name in manifest.paths:
+            dataset[path_name] = np.array([manifest.get_point(int(index))[path_name] for index in points])
+        for position, column in enumerate(columns):
+            dataset[column] = values[:, position]
+
+        if path is not None:
+            self._write_dataset(path, dataset)
+        return dataset
+
+    def _write_dataset(self, path: str, dataset: dict):
+        metadata = json.dumps({'sweep': self.key, 'manifest': self.manifest.to_dict()}, default=str)
+        if path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({name: pa.array(values) for name, values in dataset.items()})
+            table = table.replace_schema_metadata({'sweep': metadata})
+            _write_atomically(path, lambda output_file: pq.write_table(table, output_file))
+        elif path.endswith('.npz'):
+            _write_atomically(path, lambda output_file: np.savez(output_file, meta=np.array(metadata), **dataset))
+        else:
+            raise ValueError(f"Unsupported dataset file '{path}'. Expected a .parquet or .npz file.")
+
+
+def _provenance() -> dict:
+    return {'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()}
+
+
+def _write_atomically(path: str, content):
+    """Write bytes, or call content(file) to write, under a temporary name and rename it to path."""
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as output_file:
+            if callable(content):
+                content(output_file)
+            else:
+                output_file.write(content)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a sharded parameter sweep on a shared directory.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='Create a sweep directory from a manifest JSON file.')
+    create.add_argument('directory')
+    create.add_argument('manifest')
+    work = commands.add_parser('work', help='Claim and run shards until none is left.')
+    work.add_argument('directory')
+    work.add_argument('--node', type=int, default=None, help='Index of this node, with --nodes.')
+    work.add_argument('--nodes', type=int, default=None, help='Number of nodes sharing the shards statically.')
+    status = commands.add_parser('status', help='Show the shards by state.')
+    status.add_argument('directory')
+    reset = commands.add_parser('reset', help='Free shards to be run again; by default the failed ones.')
+    reset.add_argument('directory')
+    reset.add_argument('--shards', type=int, nargs='+', default=None)
+    merge = commands.add_parser('merge', help='Check the sweep is complete and write the combined dataset.')
+    merge.add_argument('directory')
+    merge.add_argument('output', help='A .parquet or .npz file.')
+    merge.add_argument('--allow-incomplete', action='store_true')
+    arguments = parser.parse_args()
+
+    if arguments.command == 'create':
+        with open(arguments.manifest) as manifest_file:
+            data = json.load(manifest_file)
+        # Hand-written manifests may leave the format out
+        data.setdefault('format', SweepManifest.FORMAT_VERSION)
+        manifest = SweepManifest.from_dict(data)
+        sweep = Sweep.create(arguments.directory, manifest)
+        print(f'Sweep {sweep.key}: {manifest.n_points} points in {manifest.n_shards} shards')
+    elif arguments.command == 'work':
+        shards = Sweep(arguments.directory).work(node=arguments.node, nodes=arguments.nodes)
+        print(f'Ran shards {shards}')
+    elif arguments.command == 'status':
+        sweep = Sweep(arguments.directory)
+        for state, shards in sweep.status().items():
+            print(f'{state}: {len(shards)}' + (f' {shards}' if shards and state != 'done' else ''))
+        for shard, error in sweep.get_errors().items():
+            print(f'shard {shard}: {error}')
+    elif arguments.command == 'reset':
+        Sweep(arguments.directory).reset(arguments.shards)
+    elif arguments.command == 'merge':
+        dataset = Sweep(arguments.directory).merge(arguments.output, allow_incomplete=arguments.allow_incomplete)
+        print(f'Wrote {len(dataset["point"])} rows to {arguments.output}')
+
+
+if __name__ == '__main__':
+    main()
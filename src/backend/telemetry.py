@@ -0,0 +1,232 @@
+import math
+import time
+
+
+class Observer:
+    """
+    Receives structured records from a running simulation. Override the hooks that are needed.
+
+    Progress records are dicts with 'step', 'total_steps', 'fraction', 'time'
+    (simulated), 'elapsed' (wall seconds) and 'steps_per_second'. Diagnostic
+    records are dicts with a 'kind', e.g. 'clamp' or 'nonfinite', and its details.
+    """
+
+    def on_start(self, simulation):
+        pass
+
+    def on_progress(self, record: dict):
+        pass
+
+    def on_diagnostic(self, record: dict):
+        pass
+
+    def on_finish(self, summary: dict):
+        pass
+
+
+class CallbackObserver(Observer):
+    """An observer forwarding the records to plain functions."""
+
+    def __init__(self, *, progress=None, diagnostic=None, finish=None):
+        self.progress = progress
+        self.diagnostic = diagnostic
+        self.finish = finish
+
+    def on_progress(self, record: dict):
+        if self.progress is not None:
+            self.progress(record)
+
+    def on_diagnostic(self, record: dict):
+        if self.diagnostic is not None:
+            self.diagnostic(record)
+
+    def on_finish(self, summary: dict):
+        if self.finish is not None:
+            self.finish(summary)
+
+
+class RecordingObserver(Observer):
+    """An observer keeping every record, e.g. to store them with the results of a batch job."""
+
+    def __init__(self):
+        self.progress = []
+        self.diagnostics = []
+        self.summary = None
+
+    def on_progress(self, record: dict):
+        self.progress.append(record)
+
+    def on_diagnostic(self, record: dict):
+        self.diagnostics.append(record)
+
+    def on_finish(self, summary: dict):
+        self.summary = summary
+
+
+class Telemetry:
+    """
+    Progress reporting and diagnostic counters of a simulation's step loop.
+
+    The step loop only compares the step number with the next polling step;
+    all the work, reading the clock, checking the state for NaN or inf and
+    calling the observers, happens when polling, at most every check_steps
+    steps. Each observer has its own throttle, by step count, by wall time or
+    both, and diagnostic records of one kind and subject (e.g. clamps of one
+    species) are aggregated and emitted at most once per diagnostic_interval.
+
+    Parameters:
+    ----------
+    check_steps : int, optional
+        Maximum number of steps between two polls. Default is 100.
+    diagnostic_interval : float, optional
+        Minimum wall time in seconds between two diagnostic records of the same kind and subject. Default is 1.0.
+    stop_on_nonfinite : bool, optional
+        Stop the simulation when a NaN or inf is found in its state. Default is False.
+    """
+
+    DEFAULT_CHECK_STEPS = 100
+    DEFAULT_DIAGNOSTIC_INTERVAL = 1.0
+
+    def __init__(self,
+                 *,
+                 check_steps: int = None,
+                 diagnostic_interval: float = None,
+                 stop_on_nonfinite: bool = False):
+        self.check_steps = check_steps if check_steps is not None else self.DEFAULT_CHECK_STEPS
+        self.diagnostic_interval = diagnostic_interval if diagnostic_interval is not None else self.DEFAULT_DIAGNOSTIC_INTERVAL
+        self.stop_on_nonfinite = stop_on_nonfinite
+        self.observers = []   # [observer, every_steps, every_seconds, next_step, next_wall_time]
+        self.clamp_counts = {}
+        self.nonfinite = None
+        self._pending = {}    # (kind, subject) -> [count since the last record, first time, last time]
+        self._last_emitted = {}
+        self._simulation = None
+        self._total_steps = 0
+        self._start_wall_time = 0.0
+
+    def add_observer(self, observer: Observer, *, every_steps: int = None, every_seconds: float = None):
+        """Register an observer; its progress is reported every every_steps steps and/or every_seconds seconds."""
+        if not isinstance(observer, Observer):
+            raise TypeError("The observer must be of type Observer.")
+        if every_steps is not None and every_steps < 1:
+            raise ValueError(f"every_steps must be a positive integer, got {every_steps}.")
+        self.observers.append([observer, every_steps, every_seconds, 0, 0.0])
+
+    def remove_observer(self, observer: Observer):
+        self.observers = [entry for entry in self.observers if entry[0] is not observer]
+
+    # Step loop
+
+    def start(self, simulation, total_steps: int) -> int:
+        """Prepare a run and return the first polling step."""
+        self._simulation = simulation
+        self._total_steps = total_steps
+        self._start_wall_time = time.perf_counter()
+        for entry in self.observers:
+            _, every_steps, every_seconds, _, _ = entry
+            entry[3] = every_steps if every_steps is not None else math.inf
+            entry[4] = self._start_wall_time + every_seconds if every_seconds is not None else math.inf
+            entry[0].on_start(simulation)
+        return self._next_poll(0)
+
+    def _next_poll(self, step: int) -> int:
+        next_step = step + self.check_steps
+        for _, every_steps, _, observer_next_step, _ in self.observers:
+            if every_steps is not None:
+                next_step = min(next_step, observer_next_step)
+        return next_step
+
+    def poll(self, step: int) -> int:
+        """Check the state, report progress to the observers that are due and return the next polling step."""
+        now = time.perf_counter()
+        if self.check_state(step) and self.stop_on_nonfinite:
+            self._simulation.stop()
+        self._emit_pending(now, force=False)
+
+        record = None
+        for entry in self.observers:
+            observer, every_steps, every_seconds, next_step, next_wall_time = entry
+            if step >= next_step or now >= next_wall_time:
+                record = record or self._progress_record(step, now)
+                observer.on_progress(record)
+                if every_steps is not None:
+                    entry[3] = (step // every_steps + 1) * every_steps
+                if every_seconds is not None:
+                    entry[4] = now + every_seconds
+        return self._next_poll(step)
+
+    def finish(self, step: int, completed: bool) -> dict:
+        """Flush the diagnostics, send the final progress and summary to the observers and return the summary."""
+        now = time.perf_counter()
+        self.check_state(step)
+        self._emit_pending(now, force=True)
+        if completed:
+            step = self._total_steps
+        record = self._progress_record(step, now)
+        summary = dict(self.get_diagnostics(), steps=step, completed=completed, elapsed=record['elapsed'])
+        for observer, *_ in self.observers:
+            observer.on_progress(record)
+            observer.on_finish(summary)
+        return summary
+
+    def _progress_record(self, step: int, now: float) -> dict:
+        elapsed = now - self._start_wall_time
+        return {
+            'step': step,
+            'total_steps': self._total_steps,
+            'fraction': step / self._total_steps if self._total_steps else 1.0,
+            'time': self._simulation.time,
+            'elapsed': elapsed,
+            'steps_per_second': step / elapsed if elapsed > 0 else 0.0,
+        }
+
+    # Diagnostics
+
+    def record_clamp(self, species_name: str, time: float):
+        """Count an ion amount clamped to zero; cheap enough to be called inside the step loop."""
+        self.clamp_counts[species_name] = self.clamp_counts.get(species_name, 0) + 1
+        pending = self._pending.get(('clamp', species_name))
+        if pending is None:
+            self._pending[('clamp', species_name)] = [1, time, time]
+        else:
+            pending[0] += 1
+            pending[2] = time
+
+    def check_state(self, step: int) -> bool:
+        """Record the first NaN or inf in the state of the simulation; returns whether one was found now."""
+        if self.nonfinite is not None or self._simulation is None:
+            return False
+        simulation = self._simulation
+        values = {'Vesicle_pH': simulation.vesicle.pH,
+                  'Vesicle_voltage': simulation.vesicle.voltage,
+                  'Vesicle_volume': simulation.vesicle.volume}
+        for ion in simulation.all_species:
+            values[f'{ion.display_name}_vesicle_amount'] = ion.vesicle_amount
+        fields = [name for name, value in values.items() if value is None or not math.isfinite(value)]
+        if not fields:
+            return False
+        self.nonfinite = {'kind': 'nonfinite', 'fields': fields, 'step': step, 'time': simulation.time}
+        for observer, *_ in self.observers:
+            observer.on_diagnostic(dict(self.nonfinite))
+        return True
+
+    def _emit_pending(self, now: float, force: bool):
+        for key in list(self._pending):
+            if not force and now - self._last_emitted.get(key, -math.inf) < self.diagnostic_interval:
+                continue
+            count, first_time, last_time = self._pending.pop(key)
+            self._last_emitted[key] = now
+            kind, subject = key
+            record = {'kind': kind, 'species': subject, 'count': count, 'total': self.clamp_counts[subject],
+                      'first_time': first_time, 'last_time': last_time}
+            for observer, *_ in self.observers:
+                observer.on_diagnostic(record)
+
+    def get_diagnostics(self) -> dict:
+        return {'clamp_counts': dict(self.clamp_counts), 'nonfinite': self.nonfinite}
+
+    def reset(self):
+        self.clamp_counts = {}
+        self.nonfinite = None
+        self._pending = {}
+        self._last_emitted = {}
@@ -2,7 +2,11 @@ from abc import ABC
 from typing import List, Tuple
 
 class Trackable(ABC):
+    # Subclasses that list their attributes in __slots__ must include 'display_name'
+    __slots__ = ()
     TRACKABLE_FIELDS = ()
+    # Units of the fields, used as metadata when histories are exported
+    FIELD_UNITS = {}
     
     def __init__(self, 
                  *args,
@@ -0,0 +1,161 @@
+import numpy as np
+
+from .ion_channels import IonChannel
+from .flux_calculation_parameters import FluxCalculationParameters
+
+
+class TransportNetwork:
+    """
+    A species x transporter network with a sparse stoichiometry matrix.
+
+    Every transporter is an IonChannel whose flux is computed once per step and
+    scattered to all the species it moves, scaled by the stoichiometric
+    coefficients. The matrix is stored in coordinate form (species index,
+    transporter index, coefficient), so the per-step cost is proportional to
+    the number of transporters and non-zero coefficients.
+
+    Parameters:
+    ----------
+    species : list
+        The IonSpecies objects, in the order used for the returned fluxes.
+    """
+
+    def __init__(self, species: list):
+        self.species = list(species)
+        self.species_index = {ion.display_name: index for index, ion in enumerate(self.species)}
+        self.transporters = []
+        self.transporter_names = []
+        self._entries = []
+        self._rows = np.zeros(0, dtype=np.intp)
+        self._columns = np.zeros(0, dtype=np.intp)
+        self._coefficients = np.zeros(0, dtype=np.float64)
+        self.transporter_fluxes = np.zeros(0, dtype=np.float64)
+        self._partners = []
+
+    def add_transporter(self, name: str, channel: IonChannel, stoichiometry: dict, partners: list = None):
+        """
+        Add a transporter moving several species at once.
+
+        Parameters:
+        ----------
+        name : str
+            Name of the transporter.
+        channel : IonChannel
+            A channel already connected to its species; its flux is the reference flux.
+        stoichiometry : dict
+            Maps species names to the coefficients applied to the reference flux.
+        partners : list, optional
+            (channel, coefficient) pairs of channels merged into this transporter. They are not
+            computed, but their flux, Nernst potential and dependences are set from the
+            reference channel every step so that they can still be recorded.
+        """
+        if not isinstance(channel, IonChannel):
+            raise TypeError("The channel object must be of type IonChannel.")
+        if channel.primary_ion_species is None:
+            raise ValueError(f"Channel '{channel.display_name}' must be connected to its ion species before "
+                             f"it is added to a transport network.")
+        if name in self.transporter_names:
+            raise RuntimeError(f'A transporter with the name {name} has been already added')
+
+        column = len(self.transporters)
+        for species_name, coefficient in stoichiometry.items():
+            if species_name not in self.species_index:
+                raise ValueError(f"Transporter '{name}' refers to an unknown ion species '{species_name}'.")
+            self._entries.append((self.species_index[species_name], column, coefficient))
+        self.transporters.append(channel)
+        self.transporter_names.append(name)
+        for partner, coefficient in partners or ():
+            self._partners.append((column, partner, coefficient))
+
+        self._rows = np.array([row for row, _, _ in self._entries], dtype=np.intp)
+        self._columns = np.array([column for _, column, _ in self._entries], dtype=np.intp)
+        self._coefficients = np.array([coefficient for _, _, coefficient in self._entries], dtype=np.float64)
+        self.transporter_fluxes = np.zeros(len(self.transporters), dtype=np.float64)
+
+    @classmethod
+    def from_species(cls, species: list, channel_filter=None):
+        """
+        Build a network from species whose channels are already connected.
+
+        Each connection of a channel to a species becomes a stoichiometric entry.
+        Two-ion exchangers modelled as a pair of channels (e.g. 'clc' on cl and
+        'clc_h' on h) that share the same species and configuration apart from
+        flux_multiplier are merged into one transporter, with the coefficient of
+        the second species set to the ratio of the flux multipliers.
+
+        Parameters:
+        ----------
+        species : list
+            The IonSpecies objects of the simulation.
+        channel_filter : callable, optional
+            Only channels for which channel_filter(channel) is true are included.
+        """
+        network = cls(species)
+        transporters = []   # [reference channel, {species_name: coefficient}, [(partner channel, coefficient)]]
+        for ion in species:
+            for channel in ion.channels:
+                if channel_filter is not None and not channel_filter(channel):
+                    continue
+                partner = next((transporter for transporter in transporters
+                                if cls._is_exchanger_pair(transporter[0], channel)
+                                and ion.display_name not in transporter[1]), None)
+                if partner is not None:
+                    coefficient = channel.config.flux_multiplier / partner[0].config.flux_multiplier
+                    partner[1][ion.display_name] = coefficient
+                    partner[2].append((channel, coefficient))
+                else:
+                    transporters.append([channel, {ion.display_name: 1.0}, []])
+
+        for channel, stoichiometry, partners in transporters:
+            network.add_transporter(channel.display_name, channel, stoichiometry, partners)
+        return network
+
+    def partners_match(self) -> bool:
+        """
+        Return whether every merged partner still has the parameters of its reference channel, apart from a
+        flux multiplier in the ratio of its coefficient. A protocol or an event action changing a partner breaks
+        the merge, and the network must then be built again.
+        """
+        for index, partner, coefficient in self._partners:
+            reference = self.transporters[index]
+            if (not self._is_exchanger_pair(reference, partner) or
+                    partner.config.flux_multiplier / reference.config.flux_multiplier != coefficient):
+                return False
+        return True
+
+    @staticmethod
+    def _is_exchanger_pair(first: IonChannel, second: IonChannel) -> bool:
+        if first is second or first.secondary_ion_species is None or second.secondary_ion_species is None:
+            return False
+        if (first.primary_ion_species is not second.primary_ion_species or
+                first.secondary_ion_species is not second.secondary_ion_species):
+            return False
+        if not first.config.flux_multiplier:
+            return False
+        ignored = ('display_name', 'flux_multiplier')
+        first_params = {key: value for key, value in vars(first.config).items() if key not in ignored}
+        second_params = {key: value for key, value in vars(second.config).items() if key not in ignored}
+        return first_params == second_params and first.get_dependence_parameters() == second.get_dependence_parameters()
+
+    def get_stoichiometry_matrix(self) -> np.ndarray:
+        """Return the stoichiometry matrix as a dense (species x transporters) array."""
+        matrix = np.zeros((len(self.species), len(self.transporters)), dtype=np.float64)
+        np.add.at(matrix, (self._rows, self._columns), self._coefficients)
+        return matrix
+
+    def compute_species_fluxes(self, flux_calculation_parameters: FluxCalculationParameters) -> list:
+        """Compute every transporter flux once and return the total flux of each species."""
+        transporter_fluxes = self.transporter_fluxes
+        for index, channel in enumerate(self.transporters):
+            transporter_fluxes[index] = channel.compute_flux(flux_calculation_parameters)
+        for index, partner, coefficient in self._partners:
+            reference = self.transporters[index]
+            partner.flux = coefficient * transporter_fluxes[index]
+            partner.nernst_potential = reference.nernst_potential
+            partner.voltage_dependence = reference.voltage_dependence
+            partner.pH_dependence = reference.pH_dependence
+            partner.time_dependence = reference.time_dependence
+        species_fluxes = np.bincount(self._rows,
+                                     weights=self._coefficients * transporter_fluxes[self._columns],
+                                     minlength=len(self.species))
+        return species_fluxes.tolist()
@@ -26,7 +26,11 @@ class VesicleConfig:
 
 
 class Vesicle(Trackable):
+    __slots__ = ('display_name', 'config', 'init_volume', 'volume', 'init_area', 'area',
+                 'init_capacitance', 'capacitance', 'init_charge', 'charge', 'pH', 'voltage')
+
     TRACKABLE_FIELDS = ('pH', 'volume', 'area', 'capacitance', 'charge', 'voltage')
+    FIELD_UNITS = {'pH': '', 'volume': 'm^3', 'area': 'm^2', 'capacitance': 'F', 'charge': 'C', 'voltage': 'V'}
 
     def __init__(self,
                  *,
@@ -1,13 +1,21 @@
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton
 from backend.default_channels import default_channels
 from backend.ion_and_channels_link import IonChannelsLink
 from utils.parameter_editor import ParameterEditorDialog
 
 class ChannelsTab(QWidget):
+    # Emitted whenever channel parameters change, including unsaved edits in the parameter editor
+    parameters_edited = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         layout = QVBoxLayout()
 
+        # Parameters of every row, and the unsaved edits of the row being edited
+        self.row_parameters = []
+        self.pending_parameters = {}
+
         self.table = QTableWidget()
         self.table.setColumnCount(4)
         self.table.setHorizontalHeaderLabels(["Channel Name", "Primary Ion Name", "Secondary Ion Name", "Edit Parameters"])
@@ -17,7 +25,7 @@ class ChannelsTab(QWidget):
         for ion_name, channel_list in links.items():
             for channel_name, secondary_ion in channel_list:
                 channel_config = default_channels[channel_name]
-                self.add_channel_row(channel_name, ion_name, secondary_ion, channel_config.__dict__)
+                self.add_channel_row(channel_name, ion_name, secondary_ion, dict(channel_config.__dict__))
 
         layout.addWidget(self.table)
 
@@ -40,11 +48,19 @@ class ChannelsTab(QWidget):
         edit_button = QPushButton("Edit")
         edit_button.clicked.connect(lambda: self.edit_parameters(row, parameters))
         self.table.setCellWidget(row, 3, edit_button)
+        self.row_parameters.append(parameters)
 
     def edit_parameters(self, row, parameters):
         dialog = ParameterEditorDialog(parameters)
+        dialog.parameters_edited.connect(lambda edited: self.preview_parameters(row, edited))
         if dialog.exec_():
             print(f"Updated parameters: {parameters}")
+        self.pending_parameters.pop(row, None)
+        self.parameters_edited.emit()
+
+    def preview_parameters(self, row, edited):
+        self.pending_parameters[row] = edited
+        self.parameters_edited.emit()
 
     def add_channel(self):
         self.add_channel_row("", "", "", {})
@@ -58,13 +74,14 @@ class ChannelsTab(QWidget):
             primary_ion = self.table.item(row, 1).text()
             secondary_ion = self.table.item(row, 2).text()
 
-            # Retrieve parameters from default_channels if available
+            # Edited parameters, including unsaved edits shown in the interactive preview,
+            # or the parameters from default_channels if available
             default_config = default_channels.get(channel_name)
-            if not default_config:
+            parameters = (self.pending_parameters.get(row) or self.row_parameters[row] or
+                          (vars(default_config) if default_config else None))
+            if not parameters:
                 continue  # Skip rows without a valid channel name
-
-            # Use vars() to extract the dictionary representation of the IonChannelConfig
-            parameters = vars(default_config).copy()
+            parameters = dict(parameters)
 
             channels[channel_name] = parameters
             self.ion_channel_links.add_link(
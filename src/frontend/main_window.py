@@ -1,11 +1,13 @@
 import sys
 
 import os
+import time
 
 
 # Add the 'src' directory to the Python path
 sys.path.append(r"C:\Away\FMP\MP_volume_GUI\MP_Volume_V5\src")
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget
 from PyQt5.QtWidgets import QMessageBox
 
@@ -14,14 +16,22 @@ from ion_species_tab import IonSpeciesTab
 from channels_tab import ChannelsTab
 from simulation_tab import SimulationParamsTab
 from results_tab import ResultsTab
+from results_browser_tab import ResultsBrowserTab
+from utils.preview_worker import PreviewWorker
 from backend.simulation import Simulation, SimulationConfig
 from backend.ion_species import IonSpecies
 from backend.ion_channels import IonChannel, IonChannelConfig
 from backend.default_channels import default_channels
 from backend.default_ion_species import default_ion_species
 from backend.ion_and_channels_link import IonChannelsLink
+from backend.model_spec import ModelSpec
+from backend.scenarios import Scenario
+from backend.result_store import ResultStore
 
 class SimulationGUI(QMainWindow):
+    # Every run is kept here, so it can be compared with other runs in the "Compare Runs" tab
+    RESULTS_DIRECTORY = os.path.join(os.path.expanduser("~"), ".vesicle_simulation", "results")
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Simulation GUI")
@@ -35,16 +45,79 @@ class SimulationGUI(QMainWindow):
         self.channels_tab = ChannelsTab()
         self.simulation_tab = SimulationParamsTab()
         self.results_tab = ResultsTab()
+        self.result_store = ResultStore(self.RESULTS_DIRECTORY)
+        self.results_browser_tab = ResultsBrowserTab(self.result_store)
 
         self.tabs.addTab(self.vesicle_tab, "Vesicle/Exterior")
         self.tabs.addTab(self.ion_species_tab, "Ion Species")
         self.tabs.addTab(self.channels_tab, "Channels")
         self.tabs.addTab(self.simulation_tab, "Simulation Parameters")
         self.tabs.addTab(self.results_tab, "Results")
+        self.tabs.addTab(self.results_browser_tab, "Compare Runs")
 
         # Connect the run button
         self.simulation_tab.run_button.clicked.connect(self.run_simulation)
 
+        # Interactive preview: edits are collected for a moment, then a preview replaces the running one
+        self.preview_worker = None
+        self.retired_preview_workers = []
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(50)
+        self.preview_timer.timeout.connect(self.start_preview)
+        self.channels_tab.parameters_edited.connect(self.schedule_preview)
+        self.simulation_tab.interactive_preview.toggled.connect(self.schedule_preview)
+
+    def schedule_preview(self):
+        if not self.simulation_tab.interactive_preview.isChecked():
+            self.cancel_preview()
+            return
+        self.preview_timer.start()
+
+    def cancel_preview(self):
+        if self.preview_worker is not None:
+            self.preview_worker.cancel()
+            self.retired_preview_workers.append(self.preview_worker)
+            self.preview_worker = None
+
+    def get_scenario(self):
+        vesicle_data = self.vesicle_tab.get_data()
+        channels_data_plain, ion_channel_links = self.channels_tab.get_data()
+        spec = ModelSpec(species=self.ion_species_tab.get_data(),
+                         channels=channels_data_plain,
+                         links=ion_channel_links.get_links())
+        return Scenario(spec=spec,
+                        config=self.simulation_tab.get_data(),
+                        vesicle=vesicle_data["vesicle_config"],
+                        exterior=vesicle_data["exterior_config"])
+
+    def start_preview(self):
+        self.cancel_preview()
+        try:
+            scenario = self.get_scenario()
+        except Exception as e:
+            print(f"Error in preview parameters: {e}")
+            return
+
+        worker = PreviewWorker(scenario)
+        worker.level_ready.connect(self.show_preview_level)
+        worker.failed.connect(lambda message: print(f"Error in PreviewWorker: {message}"))
+        worker.finished.connect(lambda: self.forget_preview_worker(worker))
+        self.preview_worker = worker
+        worker.start()
+
+    def show_preview_level(self, level_index, histories_dict, time_step, is_final):
+        # Levels of a cancelled preview may still be queued
+        if self.sender() is not self.preview_worker:
+            return
+        self.results_tab.plot_preview(histories_dict, time_step, is_final)
+        if level_index == 0:
+            self.tabs.setCurrentWidget(self.results_tab)
+
+    def forget_preview_worker(self, worker):
+        if worker in self.retired_preview_workers:
+            self.retired_preview_workers.remove(worker)
+
     def run_simulation(self):
         try:
             print("Simulation started")
@@ -90,7 +163,14 @@ class SimulationGUI(QMainWindow):
             # Display results
             self.results_tab.plot_results(histories.get_histories())
             self.tabs.setCurrentWidget(self.results_tab)
-            
+
+            # Store the run for the results browser; the time stamp keeps reruns of a scenario apart
+            scenario = self.get_scenario()
+            run_time = time.localtime()
+            scenario.name = f"Run {time.strftime('%Y-%m-%d %H:%M:%S', run_time)}"
+            self.result_store.save(f"{time.strftime('%Y%m%d-%H%M%S', run_time)}-{scenario.key()[:12]}", histories,
+                                   scenario=scenario.to_dict())
+            self.results_browser_tab.refresh()
 
         except Exception as e:
             print(f"Error in SimulationWorker: {e}")
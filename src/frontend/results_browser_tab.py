@@ -0,0 +1,123 @@
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem, QComboBox, QPushButton, QLabel
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+
+from backend.result_browser import ResultIndex, DecimatedReader
+
+class ResultsBrowserTab(QWidget):
+    """Overlays a tracked field of any number of stored runs, reading only the visible part at screen resolution."""
+
+    def __init__(self, result_store):
+        super().__init__()
+        self.index = ResultIndex(result_store)
+        self.reader = DecimatedReader()
+        self.lines = {}
+
+        layout = QHBoxLayout()
+        controls = QVBoxLayout()
+        controls.addWidget(QLabel("Stored Runs:"))
+        self.runs_list = QListWidget()
+        self.runs_list.itemChanged.connect(self.update_plot)
+        controls.addWidget(self.runs_list)
+        controls.addWidget(QLabel("Field:"))
+        self.field_selector = QComboBox()
+        self.field_selector.currentTextChanged.connect(self.update_plot)
+        controls.addWidget(self.field_selector)
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.refresh)
+        controls.addWidget(self.refresh_button)
+        layout.addLayout(controls, 1)
+
+        plot_layout = QVBoxLayout()
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+        plot_layout.addWidget(NavigationToolbar(self.canvas, self))
+        plot_layout.addWidget(self.canvas)
+        layout.addLayout(plot_layout, 3)
+        self.setLayout(layout)
+
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_xlabel('Time (s)')
+        self.ax.callbacks.connect('xlim_changed', self.schedule_reload)
+
+        # Zooming and panning change the limits many times a second; the visible data is reloaded once they settle
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(100)
+        self.reload_timer.timeout.connect(self.reload_visible)
+
+        self.refresh()
+
+    def refresh(self):
+        """Update the list of runs and fields from the store."""
+        self.index.refresh()
+
+        self.runs_list.blockSignals(True)
+        for row in reversed(range(self.runs_list.count())):
+            if self.runs_list.item(row).data(Qt.UserRole) not in self.index.results:
+                self.runs_list.takeItem(row)
+        listed = {self.runs_list.item(row).data(Qt.UserRole) for row in range(self.runs_list.count())}
+        for key in self.index.results:
+            if key not in listed:
+                item = QListWidgetItem(self.index.get_label(key))
+                item.setData(Qt.UserRole, key)
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Unchecked)
+                self.runs_list.addItem(item)
+        self.runs_list.blockSignals(False)
+
+        current_field = self.field_selector.currentText() or 'Vesicle_pH'
+        self.field_selector.blockSignals(True)
+        self.field_selector.clear()
+        self.field_selector.addItems(self.index.get_fields())
+        self.field_selector.setCurrentIndex(max(self.field_selector.findText(current_field), 0))
+        self.field_selector.blockSignals(False)
+
+        self.update_plot()
+
+    def get_checked_keys(self):
+        return [self.runs_list.item(row).data(Qt.UserRole) for row in range(self.runs_list.count())
+                if self.runs_list.item(row).checkState() == Qt.Checked]
+
+    def get_max_points(self):
+        # A minimum and a maximum for every pixel column
+        return max(2 * self.canvas.width(), 500)
+
+    def update_plot(self):
+        """Draw the checked runs over their whole time range."""
+        for line in self.lines.values():
+            line.remove()
+        self.lines = {}
+
+        field = self.field_selector.currentText()
+        for key in self.get_checked_keys():
+            result = self.index.results[key]
+            if field not in result.fields:
+                continue
+            times, values = self.reader.read(result, field, max_points=self.get_max_points())
+            self.lines[key], = self.ax.plot(times, values, label=self.index.get_label(key))
+
+        self.ax.set_ylabel(field)
+        if self.lines:
+            self.ax.legend()
+        elif self.ax.get_legend() is not None:
+            self.ax.get_legend().remove()
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.canvas.draw_idle()
+
+    def schedule_reload(self, ax):
+        self.reload_timer.start()
+
+    def reload_visible(self):
+        """Replace the data of every line with the visible time range at screen resolution."""
+        start_time, end_time = self.ax.get_xlim()
+        field = self.field_selector.currentText()
+        for key, line in self.lines.items():
+            times, values = self.reader.read(self.index.results[key], field,
+                                             start_time=start_time, end_time=end_time,
+                                             max_points=self.get_max_points())
+            line.set_data(times, values)
+        self.canvas.draw_idle()
@@ -21,4 +21,15 @@ class ResultsTab(QWidget):
         ax.set_xlabel('Time (s)')
         ax.set_ylabel('Vesicle pH')
         ax.set_title('Simulation Results: Vesicle pH Over Time')
-        self.canvas.draw()
\ No newline at end of file
+        self.canvas.draw()
+
+    def plot_preview(self, histories_dict, time_step, is_final):
+        """Plot a preview level; previews are already decimated, so every sample is drawn."""
+        self.figure.clear()
+        ax = self.figure.add_subplot(111)
+        ax.plot(histories_dict['simulation_time'], histories_dict['Vesicle_pH'])
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Vesicle pH')
+        status = 'final' if is_final else 'refining'
+        ax.set_title(f'Preview: Vesicle pH Over Time (time step {time_step:g} s, {status})')
+        self.canvas.draw_idle()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from PyQt5.QtWidgets import QWidget, QFormLayout, QDoubleSpinBox, QPushButton
+from PyQt5.QtWidgets import QWidget, QFormLayout, QDoubleSpinBox, QPushButton, QCheckBox
 
 class SimulationParamsTab(QWidget):
     def __init__(self):
@@ -17,6 +17,17 @@ class SimulationParamsTab(QWidget):
         self.total_time.setValue(1000.0)
         layout.addRow("Total Simulation Time (s):", self.total_time)
 
+        self.memory_budget = QDoubleSpinBox()
+        self.memory_budget.setDecimals(0)
+        self.memory_budget.setRange(0.0, 100000.0)
+        self.memory_budget.setValue(1000.0)
+        self.memory_budget.setToolTip("Histories are recorded at a coarser resolution to stay within this budget. 0 means no limit.")
+        layout.addRow("History Memory Budget (MB):", self.memory_budget)
+
+        self.interactive_preview = QCheckBox()
+        self.interactive_preview.setToolTip("Re-simulate at a coarse resolution on every parameter edit, then refine in the background.")
+        layout.addRow("Interactive Preview:", self.interactive_preview)
+
         self.run_button = QPushButton("Run")
         layout.addWidget(self.run_button)
 
@@ -26,4 +37,5 @@ class SimulationParamsTab(QWidget):
         return {
             "time_step": self.time_step.value(),
             "total_time": self.total_time.value(),
+            "history_memory_budget": int(self.memory_budget.value() * 1e6) or None,
         }
\ No newline at end of file
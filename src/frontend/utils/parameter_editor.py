@@ -1,6 +1,12 @@
+import ast
+
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QLineEdit, QPushButton
 
 class ParameterEditorDialog(QDialog):
+    # Emitted with the parsed parameters on every edit, before they are saved
+    parameters_edited = pyqtSignal(dict)
+
     def __init__(self, parameters, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Edit Parameters")
@@ -12,6 +18,7 @@ class ParameterEditorDialog(QDialog):
         self.inputs = {}
         for key, value in parameters.items():
             input_field = QLineEdit(str(value))
+            input_field.textEdited.connect(self.emit_edited_parameters)
             self.inputs[key] = input_field
             self.form_layout.addRow(key, input_field)
 
@@ -21,7 +28,20 @@ class ParameterEditorDialog(QDialog):
         self.save_button.clicked.connect(self.save_parameters)
         self.layout.addWidget(self.save_button)
 
+    @staticmethod
+    def parse_value(text):
+        """Convert the text of a field back to a number, bool or None; anything else stays a string."""
+        try:
+            return ast.literal_eval(text.strip())
+        except (ValueError, SyntaxError):
+            return text
+
+    def get_edited_parameters(self):
+        return {key: self.parse_value(input_field.text()) for key, input_field in self.inputs.items()}
+
+    def emit_edited_parameters(self):
+        self.parameters_edited.emit(self.get_edited_parameters())
+
     def save_parameters(self):
-        for key, input_field in self.inputs.items():
-            self.parameters[key] = input_field.text()
-        self.accept()
\ No newline at end of file
+        self.parameters.update(self.get_edited_parameters())
+        self.accept()
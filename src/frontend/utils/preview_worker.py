@@ -0,0 +1,27 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from backend.preview import ProgressivePreview
+
+class PreviewWorker(QThread):
+    """Runs a ProgressivePreview in the background and emits the histories of every level."""
+    # level index, {tracked field name: list of samples}, time step of the level, whether it is the last level
+    level_ready = pyqtSignal(int, object, float, bool)
+    failed = pyqtSignal(str)
+
+    def __init__(self, scenario, parent=None):
+        super().__init__(parent)
+        self.preview = ProgressivePreview(scenario)
+        self.levels = self.preview.get_levels()
+
+    def run(self):
+        try:
+            self.preview.run(self.emit_level)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def emit_level(self, level_index, histories, is_final):
+        histories_dict = {key: list(values) for key, values in histories.get_histories().items()}
+        self.level_ready.emit(level_index, histories_dict, self.levels[level_index][0], is_final)
+
+    def cancel(self):
+        self.preview.cancel()